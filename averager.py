@@ -1,62 +1,157 @@
 import machine
+import instrument
+from scheduler import Periodic
+from array import array
+
+class StreamingStats:
+    def __init__(self, width=1, window=0, alpha=0.1):
+        """
+        Running statistics over samples of a fixed width, in preallocated arrays.
+
+        width: Values per sample (1 for plain numbers, 4 for get_avel, ...).
+        window: Length of the sliding window for window_mean (0 disables it).
+        alpha: Smoothing factor of the exponential moving average.
+
+        add() does no allocation and no type checks, so it is safe to call from
+        timer callbacks; everything else only reads the arrays.
+        """
+        self.width = width
+        self.window = window
+        self.alpha = alpha
+        self._mean = array('f', [0.0] * width)
+        self._m2 = array('f', [0.0] * width)     # Sum of squared deviations (Welford)
+        self._min = array('f', [0.0] * width)
+        self._max = array('f', [0.0] * width)
+        self._ema = array('f', [0.0] * width)
+        self._ring = array('f', [0.0] * (width * window))
+        self._window_sum = array('f', [0.0] * width)
+        self._ring_pos = 0
+        self.window_count = 0
+        self.ema_ready = False
+        self.count = 0
+
+    def add(self, sample):
+        """ Add one sample: a number when width is 1, otherwise an indexable of width numbers. """
+        self.count += 1
+        n = self.count
+        width = self.width
+        alpha = self.alpha
+        first_ema = not self.ema_ready
+        mean, m2, lo, hi, ema = self._mean, self._m2, self._min, self._max, self._ema
+        ring, window_sum = self._ring, self._window_sum
+        base = self._ring_pos * width
+        for i in range(width):
+            x = sample if width == 1 else sample[i]
+            # Block statistics since the last reset
+            delta = x - mean[i]
+            mean[i] += delta / n
+            m2[i] += delta * (x - mean[i])
+            if n == 1 or x < lo[i]:
+                lo[i] = x
+            if n == 1 or x > hi[i]:
+                hi[i] = x
+            # EMA and sliding window keep running across resets
+            ema[i] = x if first_ema else ema[i] + alpha * (x - ema[i])
+            if self.window:
+                window_sum[i] += x - ring[base + i]
+                ring[base + i] = x
+        self.ema_ready = True
+        if self.window:
+            if self.window_count < self.window:
+                self.window_count += 1
+            self._ring_pos += 1
+            if self._ring_pos == self.window:
+                self._ring_pos = 0
+                self._resum()
+
+    def _resum(self):
+        # Recompute window sums once per lap so float32 rounding can't accumulate
+        for i in range(self.width):
+            total = 0.0
+            for j in range(i, self.window * self.width, self.width):
+                total += self._ring[j]
+            self._window_sum[i] = total
+
+    def reset(self):
+        """ Start a new block for mean/variance/min/max; EMA and the window carry on. """
+        self.count = 0
+        for i in range(self.width):
+            self._mean[i] = 0.0
+            self._m2[i] = 0.0
+
+    def mean(self, i=0):
+        return self._mean[i] if self.count else None
+
+    def variance(self, i=0):
+        return self._m2[i] / (self.count - 1) if self.count > 1 else None
+
+    def std(self, i=0):
+        variance = self.variance(i)
+        return None if variance is None else max(variance, 0.0) ** 0.5
+
+    def min(self, i=0):
+        return self._min[i] if self.count else None
+
+    def max(self, i=0):
+        return self._max[i] if self.count else None
+
+    def ema(self, i=0):
+        return self._ema[i] if self.ema_ready else None
+
+    def window_mean(self, i=0):
+        return self._window_sum[i] / self.window_count if self.window_count else None
 
 class MeasurementAverager:
-    def __init__(self, sample_function, interval=10):
+    def __init__(self, sample_function, interval=10, window=0, alpha=0.1, scheduler=None):
         """
         Initializes the averager.
         
         sample_function: A callable that returns a measurement (number or tuple).
         interval: Timer period in milliseconds for sampling.
+        window, alpha: Passed to StreamingStats, available through self.stats.
+        scheduler: See scheduler.Periodic.
         """
         self.sample_function = sample_function
         self.interval = interval
-        self._sum = None   # Running total of samples
-        self._count = 0    # Number of samples taken
-        
-        # Take the first measurement immediately, to avoid missing any samples
-        self._sample_callback(None)
-
-        # Set up the timer for periodic sampling
-        self.timer = machine.Timer(-1)
-        self.timer.init(period=self.interval, mode=machine.Timer.PERIODIC, callback=self._sample_callback)
-    
-    def _sample_callback(self, t):
-        sample = self.sample_function()
-        # On first sample, initialize _sum
-        if self._sum is None:
-            self._sum = sample
-        else:
-            if isinstance(sample, tuple):
-                # Element-wise addition for tuples
-                self._sum = tuple(s + v for s, v in zip(self._sum, sample))
-            else:
-                self._sum += sample
-        self._count += 1
+
+        # Take the first measurement immediately, to avoid missing any samples, and size the stats from it
+        sample = sample_function()
+        self._tuple = isinstance(sample, tuple)
+        self.stats = StreamingStats(len(sample) if self._tuple else 1, window, alpha)
+        self.stats.add(sample)
+
+        # Sample periodically from a timer (or as a scheduler task)
+        self.periodic = Periodic(interval, self._sample, "sample", scheduler)
+
+    @instrument.timed("MeasurementAverager._sample")  # Both the timer callback and the scheduler task
+    def _sample(self):
+        self.stats.add(self.sample_function())
 
     def average_since_last_measurement(self):
         """
         Returns the average measurement since the last call and resets the accumulators.
         If no samples have been collected, returns None.
         """
-        if self._count == 0:
-            return None
-        if isinstance(self._sum, tuple):
-            avg = tuple(s / self._count for s in self._sum)
+        # Read and reset atomically with respect to the timer callback
+        irq_state = machine.disable_irq()
+        stats = self.stats
+        if stats.count == 0:
+            avg = None
+        elif self._tuple:
+            avg = tuple(stats.mean(i) for i in range(stats.width))
         else:
-            avg = self._sum / self._count
-        # Reset the accumulator and sample count
-        self._sum = None
-        self._count = 0
+            avg = stats.mean()
+        stats.reset()
+        machine.enable_irq(irq_state)
 
         # Take the next measurement immediately, to avoid missing any samples
-        self._sample_callback(None)
+        if avg is not None:
+            self._sample()
         return avg
 
     def stop(self):
-        """ Stops the timer. """
-        if self.timer:
-            self.timer.deinit()
-            self.timer = None
+        """ Stops the timer or removes the scheduler task. """
+        self.periodic.stop()
 
     # Context-manager support:
     def __enter__(self):
@@ -71,13 +166,16 @@ class MeasurementAverager:
 # Test the averager
 if __name__ == "__main__":
     import time
-    import mpu6050
+    from mpu6050 import get_mpu
+    mpu = get_mpu()
 
     def test():
-        with MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=10) as yaw_averager:
+        with MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=10, window=50) as yaw_averager:
             while True:
                 # Inside this block, yaw_averager is active and sampling.
                 time.sleep(0.5)  # Let it collect some samples
+                stats = yaw_averager.stats
+                print("Yaw rate min/max/std:", stats.min(), stats.max(), stats.std(), "EMA:", stats.ema(), "Window:", stats.window_mean())
                 avg_yaw = yaw_averager.average_since_last_measurement()
                 print("Averaged yaw rate:", avg_yaw)
 
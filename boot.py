@@ -1 +1,16 @@
 # boot.py -- run on boot-up
+import boottime
+
+PROFILE = True  # Print how long each import took; hardware constructors are added as they happen
+INSTRUMENT = False  # Time the hot paths and their allocations, served at /stats; costs a little on every call
+
+if INSTRUMENT:
+    # Before anything instrumented is imported, since the decorators apply at definition
+    import instrument
+    instrument.enable()
+
+if PROFILE:
+    # The modules main.py imports anyway, so timing them here costs nothing extra
+    for name in ("instrument", "scheduler", "averager", "calibration", "calstore", "car", "mpu6050", "telemetry", "pid", "failsafe", "gyrobias", "odometry"):
+        boottime.timed_import(name)
+    boottime.report()
@@ -0,0 +1,40 @@
+""" Boot-time profile: when each import, hardware constructor and first event happened.
+
+Times are in ms relative to when this module was imported, which boot.py
+does first thing; the lazy hardware factories (car.get_car,
+mpu6050.get_mpu, web.get_wlan) record their constructors here on first use.
+"""
+import time
+
+_start = time.ticks_us()
+_entries = []  # (name, start, duration) in us since _start
+_firsts = {}   # event -> us since _start
+
+def _since(t):
+    return time.ticks_diff(t, _start)
+
+def timed(name, func, *args):
+    """ Call func(*args), record how long it took under name, and return its result. """
+    t = time.ticks_us()
+    result = func(*args)
+    _entries.append((name, _since(t), time.ticks_diff(time.ticks_us(), t)))
+    return result
+
+def timed_import(name):
+    """ Import a module by name, recording the import cost. """
+    return timed("import " + name, __import__, name)
+
+def first(event):
+    """ Record the first time event happens; returns True only on that first call. """
+    if event in _firsts:
+        return False
+    _firsts[event] = _since(time.ticks_us())
+    return True
+
+def report():
+    """ Print every entry as 'at ms, took ms, name', then the first events. """
+    print("Boot profile (ms since boot.py, ms taken):")
+    for name, at, took in _entries:
+        print(f"{at / 1000:9.1f} {took / 1000:8.1f}  {name}")
+    for event, at in _firsts.items():
+        print(f"{at / 1000:9.1f} {'':>8}  first {event}")
@@ -0,0 +1,147 @@
+import time
+from array import array
+from averager import MeasurementAverager
+
+POINTS = 17  # Table entries per curve: commanded speed 0, 1/16, ..., 1
+
+class MotorCurve:
+    def __init__(self, table):
+        """
+        Maps commanded speed (0 to 1) to the duty fraction that produces it.
+
+        table: POINTS-ish duty values (0-1023) at evenly spaced commanded speeds.
+        table[0] is the deadband: the duty at which the wheel just starts to turn,
+        so any non-zero command gets at least that much.
+        """
+        self.table = array('H', table)
+        self._last = len(self.table) - 1
+
+    def __call__(self, speed):
+        """ Duty fraction for speed, by linear interpolation between table entries (O(1)). """
+        if speed <= 0:
+            return 0.0
+        table = self.table
+        if speed >= 1:
+            return table[self._last] / 1023
+        x = speed * self._last
+        i = int(x)
+        lo = table[i]
+        return (lo + (table[i + 1] - lo) * (x - i)) / 1023
+
+    @staticmethod
+    def identity(points=POINTS):
+        """ The uncalibrated mapping: duty proportional to speed. """
+        return MotorCurve([round(1023 * i / (points - 1)) for i in range(points)])
+
+    @staticmethod
+    def fit(levels, rates, top, threshold, points=POINTS):
+        """
+        Invert a measured curve so commanded speed maps linearly onto rate.
+
+        levels: Increasing duty fractions that were applied.
+        rates: Measured response at each level (any unit, e.g. °/s).
+        top: Response that commanded speed 1 should produce; at most max(rates).
+        threshold: Response below which the wheel counts as stalled.
+        """
+        # Noise can make a measured curve dip; the inverse needs it non-decreasing
+        mono = []
+        for r in rates:
+            mono.append(max(r, mono[-1]) if mono else r)
+
+        def duty_for(target):
+            for i, r in enumerate(mono):
+                if r >= target:
+                    if i == 0 or r == mono[i - 1]:
+                        return levels[i]
+                    f = (target - mono[i - 1]) / (r - mono[i - 1])
+                    return levels[i - 1] + (levels[i] - levels[i - 1]) * f
+            return levels[-1]
+
+        table = [duty_for(threshold)]
+        for k in range(1, points):
+            table.append(max(table[-1], duty_for(top * k / (points - 1))))
+        return MotorCurve([min(1023, round(d * 1023)) for d in table])
+
+class MotorCalibration:
+    NAMES = ("left_fwd", "left_rev", "right_fwd", "right_rev")
+
+    def __init__(self, left_fwd, left_rev, right_fwd, right_rev):
+        """ One MotorCurve per side and direction; Car picks one per update. """
+        self.left_fwd = left_fwd
+        self.left_rev = left_rev
+        self.right_fwd = right_fwd
+        self.right_rev = right_rev
+
+    def curve(self, left, forward):
+        if left:
+            return self.left_fwd if forward else self.left_rev
+        return self.right_fwd if forward else self.right_rev
+
+    def curves(self):
+        return (self.left_fwd, self.left_rev, self.right_fwd, self.right_rev)
+
+    def save(self, filename="motors.txt"):
+        """ One line per curve: name followed by its duty table. """
+        with open(filename, "w") as f:
+            for name, curve in zip(self.NAMES, self.curves()):
+                f.write(name + " " + " ".join(str(d) for d in curve.table) + "\n")
+
+    @staticmethod
+    def load(filename="motors.txt"):
+        """ Load curves saved by save(); returns None if the file is missing or malformed. """
+        try:
+            curves = {}
+            with open(filename, "r") as f:
+                for line in f:
+                    parts = line.split()
+                    if parts:
+                        curves[parts[0]] = MotorCurve([int(d) for d in parts[1:]])
+            calibration = MotorCalibration(*[curves[name] for name in MotorCalibration.NAMES])
+            if len(set(len(c.table) for c in calibration.curves())) != 1:
+                raise ValueError
+            print(f"{filename} motor calibration loaded")
+            return calibration
+        except (OSError, ValueError, KeyError):
+            print(f"No valid {filename} file found. Using linear duty.")
+            return None
+
+def measure_motor(car, mpu, motor, direction, levels, settle=300, duration=500):
+    """
+    Drive one motor at each duty level with the other stopped, so the car pivots on the
+    stopped wheel, and return the mean yaw rate magnitude (°/s) at each level. The pivot
+    rate is that wheel's ground speed over the track width, so it measures one wheel alone.
+    Like spin_for_time, the rate is averaged from the gyro by a MeasurementAverager.
+    """
+    rates = []
+    calibration = car.calibration
+    car.calibration = None  # Drive raw duty levels
+    try:
+        car.stop()
+        with MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=10) as averager:
+            for level in levels:
+                car.update_motor(motor, direction * level)
+                time.sleep_ms(settle)
+                averager.average_since_last_measurement()  # Discard the spin-up
+                time.sleep_ms(duration)
+                rates.append(abs(averager.average_since_last_measurement()))
+    finally:
+        car.calibration = calibration
+        car.stop()
+    return rates
+
+def calibrate(car, mpu, steps=20, settle=300, duration=500, threshold=2.0, points=POINTS, log=print):
+    """
+    Measure all four side/direction curves and fit tables that make commanded speed
+    linear in wheel speed, up to the top speed the weakest of them reaches, so both
+    sides and directions match. Returns a MotorCalibration.
+    """
+    levels = [i / steps for i in range(1, steps + 1)]
+    measured = []
+    for motor, side in ((car.MtrA, "left"), (car.MtrB, "right")):
+        for direction, name in ((1, "fwd"), (-1, "rev")):
+            rates = measure_motor(car, mpu, motor, direction, levels, settle, duration)
+            log(side, name, " ".join("%.1f" % r for r in rates))
+            measured.append(rates)
+    top = min(max(rates) for rates in measured)
+    log("Matched top rate: %.1f °/s" % top)
+    return MotorCalibration(*[MotorCurve.fit(levels, rates, top, threshold, points) for rates in measured])
@@ -0,0 +1,162 @@
+import os
+import ustruct
+import ubinascii
+import boottime
+from calibration import MotorCurve, MotorCalibration, POINTS
+
+FILENAME = "calib.bin"
+MAGIC = b"CALB"
+VERSION = 1
+
+# Flags: which optional sections hold data
+MOTORS = 0x01
+
+# Little-endian, unpadded: magic, version, flags, gyro bias (raw LSB, x y z), accel bias (raw LSB, x y z),
+# accel scale (x y z), tilt offsets (roll, pitch), gyro bias drift (LSB per °C, x y z), reference temperature
+# (°C), motor tables (left_fwd, left_rev, right_fwd, right_rev), then the CRC32 of everything before it
+FORMAT = "<4sBB3f3f3f2f3ff%dHI" % (4 * POINTS)
+SIZE = ustruct.calcsize(FORMAT)
+TABLES = 18  # Index of the first motor table entry in the unpacked fields
+
+class CalibrationRecord:
+    def __init__(self, gyro_bias=(0.0, 0.0, 0.0), accel_bias=(0.0, 0.0, 0.0), accel_scale=(1.0, 1.0, 1.0),
+                 tilt_offsets=(0.0, 0.0), temp_coeff=(0.0, 0.0, 0.0), temp_ref=25.0, motors=None):
+        """
+        Everything the car measures about itself, stored as one fixed-size binary record.
+
+        motors: MotorCalibration, or None for duty proportional to speed.
+        """
+        self.gyro_bias = list(gyro_bias)
+        self.accel_bias = list(accel_bias)
+        self.accel_scale = list(accel_scale)
+        self.tilt_offsets = list(tilt_offsets)
+        self.temp_coeff = list(temp_coeff)
+        self.temp_ref = temp_ref
+        self.motors = motors
+
+    # Encoding
+    def pack(self):
+        """ The record as SIZE bytes, CRC included. """
+        tables = []
+        if self.motors:
+            for curve in self.motors.curves():
+                tables.extend(_resample(curve))
+        else:
+            tables = [0] * (4 * POINTS)
+        body = ustruct.pack(FORMAT[:-1], MAGIC, VERSION, MOTORS if self.motors else 0,
+                            *(self.gyro_bias + self.accel_bias + self.accel_scale + self.tilt_offsets
+                              + self.temp_coeff + [self.temp_ref] + tables))
+        return body + ustruct.pack("<I", ubinascii.crc32(body))
+
+    @staticmethod
+    def unpack(data):
+        """ Decode a record made by pack(); raises ValueError if it is truncated, corrupt or another version. """
+        if len(data) != SIZE:
+            raise ValueError("size")
+        fields = ustruct.unpack(FORMAT, data)
+        if fields[0] != MAGIC or fields[1] != VERSION:
+            raise ValueError("version")
+        if fields[-1] != ubinascii.crc32(memoryview(data)[:-4]):
+            raise ValueError("crc")
+        motors = None
+        if fields[2] & MOTORS:
+            motors = MotorCalibration(*[MotorCurve(fields[TABLES + i * POINTS:TABLES + (i + 1) * POINTS]) for i in range(4)])
+        return CalibrationRecord(fields[3:6], fields[6:9], fields[9:12], fields[12:14], fields[14:17], fields[17], motors)
+
+    # Persistence
+    def save(self, filename=FILENAME):
+        """ Write the record to a temporary file, then rename it over filename, so a power cut leaves the old or the new record. """
+        temp = filename + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(self.pack())
+        os.rename(temp, filename)
+
+    @staticmethod
+    def load(filename=FILENAME):
+        """
+        Read the record; returns None if there is none or it fails its checks. A complete
+        .tmp file is used if the main file is missing or bad: a filesystem that replaces the
+        old file by deleting it first can lose power between the delete and the rename.
+        """
+        for name in (filename, filename + ".tmp"):
+            try:
+                with open(name, "rb") as f:
+                    record = CalibrationRecord.unpack(f.read(SIZE + 1))
+                print(f"{name} calibration loaded")
+                return record
+            except OSError:
+                pass
+            except ValueError as e:
+                print(f"{name} is invalid ({e}), ignoring it.")
+        return None
+
+def _resample(curve):
+    """ A curve's table at POINTS entries (tables from motors.txt can have any length). """
+    if len(curve.table) == POINTS:
+        return curve.table
+    return [curve.table[0]] + [round(curve(i / (POINTS - 1)) * 1023) for i in range(1, POINTS)]
+
+# Migration from the text files
+def _read_floats(filename, expected_length):
+    try:
+        with open(filename, "r") as f:
+            values = [float(line) for line in f.read().split()]
+        if len(values) != expected_length:
+            raise ValueError
+        return values
+    except ValueError:
+        print(f"{filename} is malformed, not migrating it.")
+    except OSError:
+        pass
+    return None
+
+def migrate(filename=FILENAME, gyro="gyro.txt", tilt="tilt.txt", motors="motors.txt"):
+    """ Build a record from the text files that exist and save it; returns it, or None if there were none. """
+    record = CalibrationRecord()
+    found = []
+    gyro_bias = _read_floats(gyro, 3)
+    if gyro_bias:
+        record.gyro_bias = gyro_bias
+        found.append(gyro)
+    tilt_offsets = _read_floats(tilt, 2)
+    if tilt_offsets:
+        record.tilt_offsets = tilt_offsets
+        found.append(tilt)
+    if _exists(motors):
+        record.motors = MotorCalibration.load(motors)
+        if record.motors:
+            found.append(motors)
+    if not found:
+        return None
+    record.save(filename)
+    print(f"Migrated {', '.join(found)} to {filename}")
+    return record
+
+def _exists(filename):
+    try:
+        os.stat(filename)
+        return True
+    except OSError:
+        return False
+
+# Shared record
+_record = None
+
+def get_record():
+    """
+    Return the shared CalibrationRecord, loading it on first use. With no record on flash the
+    text files are migrated; a record that exists but fails its checks is not silently
+    replaced by them, and defaults are used until the car is calibrated again.
+    """
+    global _record
+    if _record is None:
+        def load():
+            record = CalibrationRecord.load()
+            if record is None and not _exists(FILENAME) and not _exists(FILENAME + ".tmp"):
+                record = migrate()
+            if record is None:
+                print(f"No valid {FILENAME}. Using default calibration.")
+                record = CalibrationRecord()
+            return record
+        _record = boottime.timed("calibration record", load)
+    return _record
@@ -1,5 +1,8 @@
 import machine
 from machine import Pin, PWM
+import boottime
+import instrument
+import calstore
 
 class Car:
     def __init__(self, ena_pin=5, in1_pin=4, in2_pin=0, enb_pin=14, in3_pin=12, in4_pin=13):
@@ -22,6 +25,15 @@ class Car:
         self._throttle = 0
         self._steering = 0
         self.turn_strength = 1  # Adjust how sharp turns are
+        self._batch = 0         # Nesting depth of "with car:" blocks; motors are applied when it returns to 0
+
+        # Last values written to each motor: [freq, mode, duty]; None forces the next write
+        self._applied_a = [None, None, None]
+        self._applied_b = [None, None, None]
+        self.writes = 0  # PWM and pin writes issued, for benchmarking
+
+        # Per-side duty curves that make commanded speed linear in wheel speed (None = duty proportional to speed)
+        self.calibration = calstore.get_record().motors
 
         # Initialize both motors to stop
         self.update_motors()
@@ -34,7 +46,8 @@ class Car:
     def throttle(self, value):
         """ Set overall throttle (-1 to 1) """
         self._throttle = max(-1, min(1, value))  # Clamp between -1 and 1
-        self.update_motors()
+        if not self._batch:
+            self.update_motors()
 
     @property
     def steering(self):
@@ -44,8 +57,29 @@ class Car:
     def steering(self, value):
         """ Set steering value (-1 to 1) """
         self._steering = max(-1, min(1, value))  # Clamp between -1 and 1
-        self.update_motors()
-
+        if not self._batch:
+            self.update_motors()
+
+    def set(self, throttle=None, steering=None):
+        """ Set throttle and/or steering, applying the motors once. """
+        if throttle is not None:
+            self._throttle = max(-1, min(1, throttle))
+        if steering is not None:
+            self._steering = max(-1, min(1, steering))
+        if not self._batch:
+            self.update_motors()
+
+    # Transactions: inside "with car:", setters only record values, and the motors are applied once on exit
+    def __enter__(self):
+        self._batch += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._batch -= 1
+        if not self._batch:
+            self.update_motors()
+
+    @instrument.timed("Car.update_motors")
     def update_motors(self):
         """ Compute and apply motor speeds based on throttle and steering, smoothly transitioning between movement and in-place turning. """
         left_speed = self._throttle * (1 - abs(self._steering)) + self._steering
@@ -55,29 +89,54 @@ class Car:
         left_speed = max(-1, min(1, left_speed))
         right_speed = max(-1, min(1, right_speed))
 
-        # Apply speeds to motors
-        self.update_motor(self.MtrA, left_speed)
-        self.update_motor(self.MtrB, right_speed)
+        # Apply speeds to motors. All ESP8266 PWM channels share one frequency, so whenever
+        # A's is written B's is rewritten after it, leaving the same frequency as writing both
+        freq_written = self.update_motor(self.MtrA, left_speed)
+        self.update_motor(self.MtrB, right_speed, freq_written)
 
-    def update_motor(self, motor, throttle):
-        """ Update motor speed and mode based on throttle """
+    def update_motor(self, motor, throttle, force_freq=False):
+        """ Update motor speed and mode based on throttle, writing only what changed; returns whether freq was written """
         speed = abs(throttle)
         mode = 0 if throttle == 0 else (1 if throttle > 0 else 2)  # 0 = Stop, 1 = Forward, 2 = Reverse
+        if self.calibration and mode:
+            speed = self.calibration.curve(motor is self.MtrA, mode == 1)(speed)  # Commanded speed to duty fraction
+        duty = int(min(speed * 1023, 1023))
 
-        # Direct multiplication scaling, clamped to min_freq
+        # Direct multiplication scaling of the applied duty, clamped to min_freq
         new_freq = max(self.min_freq, int(self.max_freq * speed))
-        motor[0].freq(new_freq)  # Dynamically update PWM frequency
-
-        set_mode(mode, motor)
-        set_speed(speed, motor)
 
-        print("left" if motor == self.MtrA else "right", "speed:", speed, "mode:", mode, "freq:", new_freq)
+        applied = self._applied_a if motor is self.MtrA else self._applied_b
+        freq_written = force_freq or applied[0] != new_freq
+        if freq_written:
+            motor[0].freq(new_freq)  # Dynamically update PWM frequency
+            applied[0] = new_freq
+            self.writes += 1
+        if applied[1] != mode:
+            set_mode(mode, motor)
+            applied[1] = mode
+            self.writes += 2
+        if applied[2] != duty:
+            motor[0].duty(duty)
+            applied[2] = duty
+            self.writes += 1
+        return freq_written
+
+    def invalidate(self):
+        """ Forget what was written, so the next update rewrites everything (after driving the pins directly). """
+        for applied in (self._applied_a, self._applied_b):
+            applied[0] = applied[1] = applied[2] = None
+
+    def log(self):
+        """ Print the applied state of both motors; kept out of update_motors so control updates stay fast. """
+        for name, applied in (("left", self._applied_a), ("right", self._applied_b)):
+            print(name, "duty:", applied[2], "mode:", applied[1], "freq:", applied[0])
 
     def stop(self):
-        """ Stop both motors """
+        """ Stop both motors, rewriting every output in case something drove the pins directly """
         self._throttle = 0
         self._steering = 0
-        self.update_motors()
+        self.invalidate()
+        self.update_motors()  # Even inside a transaction
 
 def set_mode(mode, motor):
     """ Set motor direction """
@@ -89,4 +148,11 @@ def set_speed(speed, motor):
     """ Set motor speed (0 to 1 scaled to 1023 PWM) """
     motor[0].duty(int(min(speed * 1023, 1023)))
 
-car = Car()
+_car = None
+
+def get_car():
+    """ Return the shared Car, constructing it (and driving the motor pins) on first use. """
+    global _car
+    if _car is None:
+        _car = boottime.timed("Car()", Car)
+    return _car
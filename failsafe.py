@@ -0,0 +1,76 @@
+from scheduler import Clock, Periodic
+
+class Failsafe:
+    def __init__(self, car, lease_ms=1000, ramp_ms=300, interval=50, scheduler=None, wdt=None, clock=None, max_lease_ms=None):
+        """
+        Command lease: every control update renews it, and when it runs out the
+        motors are ramped to zero, so a lost link can't leave the car driving.
+
+        car: The Car to stop.
+        lease_ms: Lease granted by renew() when the update doesn't carry its own.
+        max_lease_ms: Longest lease an update may ask for (default twice lease_ms).
+        ramp_ms: Time to ramp throttle and steering from their last values to zero.
+        interval: Check period in milliseconds.
+        scheduler: See scheduler.Periodic.
+        wdt: Optional machine.WDT, fed on every check, so a stalled loop resets the board.
+             Needs the scheduler: a hardware Timer keeps firing through a stalled loop.
+        """
+        if wdt and not scheduler:
+            raise ValueError("a watchdog needs the scheduler: a Timer callback would feed it through a stalled loop")
+        self.car = car
+        self.lease_ms = lease_ms
+        self.max_lease_ms = max_lease_ms or 2 * lease_ms
+        self.ramp_ms = ramp_ms
+        self.interval = interval
+        self.wdt = wdt
+        self.clock = clock or (scheduler.clock if scheduler else Clock())
+        self.deadline = self.clock.now()
+        self.active = False   # A lease is held
+        self._ramp = 0.0      # Fraction of the last command still applied while ramping down
+        self._from = (0, 0)   # Throttle and steering when the lease ran out
+        self.expirations = 0  # Leases that ran out with the car moving
+
+        self.periodic = Periodic(interval, self.check, "failsafe", scheduler)
+
+    def renew(self, lease_ms=None):
+        """ Extend the lease from now; call on every control update. Cancels a ramp in progress.
+
+        The lease comes from the client, so it is capped at max_lease_ms; a missing,
+        zero, negative or nan one gets the default lease_ms.
+        """
+        if lease_ms is None or not lease_ms > 0:
+            lease_ms = self.lease_ms
+        elif lease_ms > self.max_lease_ms:
+            lease_ms = self.max_lease_ms
+        self.deadline = self.clock.add(self.clock.now(), int(lease_ms * 1000))
+        self.active = True
+        self._ramp = 0.0
+
+    def parked(self):
+        """ True while no lease is held and no ramp is running: nothing is driving the car. """
+        return not self.active and not self._ramp
+
+    def expired(self):
+        return self.clock.diff(self.clock.now(), self.deadline) >= 0
+
+    def check(self):
+        """ Feed the watchdog, and once the lease has run out step the motors toward zero. """
+        if self.wdt:
+            self.wdt.feed()
+        if self.active and self.expired():
+            self.active = False
+            car = self.car
+            if car.throttle or car.steering:
+                self.expirations += 1
+                self._from = (car.throttle, car.steering)
+                self._ramp = 1.0
+        if self._ramp:
+            self._ramp = max(0.0, self._ramp - self.interval / self.ramp_ms)
+            if self._ramp:
+                self.car.set(self._from[0] * self._ramp, self._from[1] * self._ramp)
+            else:
+                self.car.stop()
+
+    def stop(self):
+        """ Stops the timer or removes the scheduler task. """
+        self.periodic.stop()
@@ -0,0 +1,135 @@
+import calstore
+from averager import StreamingStats
+from scheduler import Periodic
+from mpu6050 import GYRO_SCALE
+
+ACCEL_SCALE = 16384.0  # LSB per g, ±2 g mode
+
+class GyroBiasEstimator:
+    def __init__(self, mpu, car=None, block=50, interval=20, accel_std=0.02, gyro_std=0.5, max_step=2.0,
+                 forget=0.995, temperature=True, scheduler=None):
+        """
+        Re-estimates the gyro bias whenever the car stands still, as a linear function of
+        die temperature, and keeps mpu.gyro_offsets at the bias for the current temperature,
+        also while driving.
+
+        Samples are taken in blocks. A block counts as stationary when Car commanded nothing
+        during it and the one before (so coasting is over) and the accel and gyro spread stay
+        under accel_std (g) and gyro_std (°/s). Its mean gyro reading and temperature update
+        a recursive least-squares fit of bias = b + k * (T - temp_ref) per axis, starting
+        from the stored calibration record.
+
+        mpu: The MPU6050 whose offsets are kept up to date.
+        car: Car whose commands mark it as moving (None: rely on the IMU alone).
+        block: Samples per block.
+        interval: Sampling period in milliseconds; None to feed update() yourself (e.g. from the FIFO).
+        max_step: Once fitted, blocks further than this (°/s) from the model are taken for slow turns and skipped.
+        forget: RLS forgetting factor per stationary block, so old blocks fade out.
+        temperature: Fit the temperature coefficient; False tracks the bias alone.
+        scheduler: See scheduler.Periodic.
+        """
+        self.mpu = mpu
+        self.car = car
+        self.block = block
+        self.accel_limit = accel_std * ACCEL_SCALE
+        self.gyro_limit = gyro_std * GYRO_SCALE
+        self.max_step = max_step * GYRO_SCALE
+        self.forget = forget
+        self.temperature = temperature
+        self.stats = StreamingStats(7)  # One read_all_raw sample per add
+
+        # Model per axis, in raw LSB: bias = b + k * (T - temp_ref)
+        record = calstore.get_record()
+        self.b = list(mpu.gyro_offsets)
+        self.k = list(record.temp_coeff) if temperature else [0.0, 0.0, 0.0]
+        self.temp_ref = record.temp_ref
+        # Shared RLS covariance (the regressor [1, T - temp_ref] is the same for every axis), capped at the prior
+        self._p_max = (GYRO_SCALE ** 2, (0.05 * GYRO_SCALE) ** 2 if temperature else 0.0)
+        self.P = [self._p_max[0], 0.0, 0.0, self._p_max[1]]
+
+        self.temp = None      # Die temperature of the last block, °C
+        self._moving = False  # Car commanded motion during the current block
+        self._idle = 0        # Consecutive blocks without commands
+        self.fits = 0         # Stationary blocks used
+        self.rejected = 0     # Quiet blocks skipped for being too far from the model
+
+        self.periodic = Periodic(interval, self.sample, "gyro bias", scheduler)
+
+    def sample(self):
+        self.update(self.mpu.read_all_raw())
+
+    def update(self, raw):
+        """ Add one read_all_raw sample; ends the block once it is full. """
+        car = self.car
+        if car and (car.throttle or car.steering):
+            self._moving = True
+        self.stats.add(raw)
+        if self.stats.count >= self.block:
+            self._end_block()
+
+    def _end_block(self):
+        stats = self.stats
+        self.temp = stats.mean(3) / 340 + 36.53
+        self._idle = 0 if self._moving else self._idle + 1
+        if self._idle >= 2 and self._quiet():
+            y = (stats.mean(4), stats.mean(5), stats.mean(6))
+            if self.fits and max(abs(y[i] - self.bias(i)) for i in range(3)) > self.max_step:
+                self.rejected += 1
+            else:
+                self._fit(y)
+        offsets = self.mpu.gyro_offsets
+        for i in range(3):
+            offsets[i] = self.bias(i)
+        stats.reset()
+        self._moving = False
+
+    def _quiet(self):
+        stats = self.stats
+        for i in (0, 1, 2):
+            if stats.std(i) > self.accel_limit:
+                return False
+        for i in (4, 5, 6):
+            if stats.std(i) > self.gyro_limit:
+                return False
+        return True
+
+    def _fit(self, y):
+        # Recursive least squares with forgetting, regressor x = [1, dt]
+        dt = self.temp - self.temp_ref if self.temperature else 0.0
+        p00, p01, p10, p11 = self.P
+        px0 = p00 + p01 * dt
+        px1 = p10 + p11 * dt
+        gain = 1 / (self.forget + px0 + dt * px1)
+        k0 = px0 * gain
+        k1 = px1 * gain
+        for i in range(3):
+            error = y[i] - (self.b[i] + self.k[i] * dt)
+            self.b[i] += k0 * error
+            self.k[i] += k1 * error
+        # P = (P - K x'P) / forget, capped so a steady temperature can't wind it up
+        p00 = min((p00 - k0 * px0) / self.forget, self._p_max[0])
+        p11 = min((p11 - k1 * px1) / self.forget, self._p_max[1])
+        p01 = (p01 - k0 * px1) / self.forget
+        limit = (p00 * p11) ** 0.5
+        p01 = max(-limit, min(limit, p01))
+        self.P = [p00, p01, p01, p11]
+        self.fits += 1
+
+    def bias(self, i, temp=None):
+        """ Modelled raw bias of axis i (0 pitch, 1 roll, 2 yaw) at temp °C (default: the last block's). """
+        temp = self.temp if temp is None else temp
+        if temp is None:
+            return self.b[i]
+        return self.b[i] + self.k[i] * (temp - self.temp_ref)
+
+    def save(self):
+        """ Store the model (bias at temp_ref and its temperature coefficient) in the calibration record. """
+        record = calstore.get_record()
+        record.gyro_bias = list(self.b)
+        record.temp_coeff = list(self.k)
+        record.temp_ref = self.temp_ref
+        record.save()
+
+    def stop(self):
+        """ Stops the timer or removes the scheduler task. """
+        self.periodic.stop()
@@ -0,0 +1,182 @@
+""" Run-time profile: how long instrumented code takes and how much heap it allocates.
+
+Each measured name keeps a Stat: call count, mean and worst time, and fixed
+power-of-two histograms of the time in us (time.ticks_us) and of the bytes
+allocated per call (gc.mem_alloc before and after). Recording allocates
+nothing, so it is safe in timer callbacks.
+
+Disabled by default. timed() applies when the decorated function is defined,
+so with ENABLED False it returns the function itself and instrumented code
+runs exactly as if it weren't. To profile, call enable() (or set ENABLED) before
+the instrumented modules are imported, which boot.py does with INSTRUMENT = True.
+
+The numbers are served as JSON by web.stats_endpoint (/stats in main.main).
+Under CPython there is no gc.mem_alloc; allocations are read from tracemalloc,
+and are 0 unless it has been started.
+"""
+import gc
+import time
+from array import array
+
+ENABLED = False
+BINS = 20  # Bin i counts values below 2 ** i (and at least 2 ** (i - 1)); the last also everything above
+
+try:
+    _mem_alloc = gc.mem_alloc
+except AttributeError:
+    import tracemalloc
+
+    def _mem_alloc():
+        return tracemalloc.get_traced_memory()[0]
+
+_stats = {}  # name -> Stat
+
+def enable(on=True):
+    """ Instrument whatever is decorated from now on; already defined functions stay as they are. """
+    global ENABLED
+    ENABLED = on
+
+def _bin(value):
+    i = 0
+    while value > 0 and i < BINS - 1:
+        value >>= 1
+        i += 1
+    return i
+
+def _percentile(hist, count, fraction):
+    # Upper bound of the bin holding the given fraction of the values
+    if not count:
+        return 0
+    target = count * fraction
+    seen = 0
+    for i in range(BINS):
+        seen += hist[i]
+        if seen >= target:
+            return 1 << i
+    return 1 << BINS
+
+class Stat:
+    def __init__(self, name):
+        """ Counters and histograms for one measured name; see add(). """
+        self.name = name
+        self.time_hist = array("I", [0] * BINS)
+        self.alloc_hist = array("I", [0] * BINS)
+        self.reset()
+
+    def reset(self):
+        """ Forget everything recorded so far. """
+        for i in range(BINS):
+            self.time_hist[i] = 0
+            self.alloc_hist[i] = 0
+        self.count = 0
+        self.total_us = 0.0     # Floats, which don't allocate on the ESP8266 (small ints overflow after 18 minutes)
+        self.max_us = 0
+        self.total_alloc = 0.0
+        self.max_alloc = 0
+        self.collections = 0  # Calls during which the heap shrank (a collection ran), so the allocation is unknown
+
+    def add(self, us, alloc):
+        """ Record one call that took us microseconds and grew the heap by alloc bytes. """
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+        self.time_hist[_bin(us)] += 1
+        if alloc < 0:
+            self.collections += 1
+            alloc = 0
+        self.total_alloc += alloc
+        if alloc > self.max_alloc:
+            self.max_alloc = alloc
+        self.alloc_hist[_bin(alloc)] += 1
+
+    def summary(self):
+        """ Return a dict of the counters, percentiles (bin upper bounds) and both histograms. """
+        count = self.count
+        return {
+            "n": count,
+            "mean_us": self.total_us / count if count else 0,
+            "p50_us": _percentile(self.time_hist, count, 0.5),
+            "p99_us": _percentile(self.time_hist, count, 0.99),
+            "max_us": self.max_us,
+            "mean_alloc": self.total_alloc / count if count else 0,
+            "max_alloc": self.max_alloc,
+            "gc": self.collections,
+            "us": list(self.time_hist),
+            "alloc": list(self.alloc_hist),
+        }
+
+class _Span:
+    # Context manager for one Stat, kept per name so entering it doesn't allocate
+    def __init__(self, stat):
+        self.stat = stat
+        self.alloc = 0
+        self.start = 0
+
+    def __enter__(self):
+        self.alloc = _mem_alloc()
+        self.start = time.ticks_us()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stat.add(time.ticks_diff(time.ticks_us(), self.start), _mem_alloc() - self.alloc)
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NO_SPAN = _NoSpan()
+_spans = {}  # name -> _Span
+
+def get(name):
+    """ Return the Stat recorded under name, creating it. """
+    stat = _stats.get(name)
+    if stat is None:
+        stat = _stats[name] = Stat(name)
+    return stat
+
+def timed(name):
+    """ Decorator recording every call of the function under name; returns the function unchanged when disabled. """
+    def decorate(func):
+        if not ENABLED:
+            return func
+        stat = get(name)
+
+        def wrapper(*args, **kwargs):
+            alloc = _mem_alloc()
+            start = time.ticks_us()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stat.add(time.ticks_diff(time.ticks_us(), start), _mem_alloc() - alloc)
+        return wrapper
+    return decorate
+
+def span(name):
+    """ Context manager recording the time and allocations of its block under name.
+
+    Unlike timed() this is looked up on every use, which costs a call and a
+    dict lookup even when disabled; prefer timed() on hot paths. Not reentrant
+    per name (nested blocks of the same name share one start time).
+    """
+    if not ENABLED:
+        return _NO_SPAN
+    s = _spans.get(name)
+    if s is None:
+        s = _spans[name] = _Span(get(name))
+    return s
+
+def stats():
+    """ Return {name: Stat.summary()} for everything recorded, plus the heap state if known. """
+    result = {name: _stats[name].summary() for name in _stats}
+    if hasattr(gc, "mem_free"):
+        result["heap"] = {"free": gc.mem_free(), "alloc": gc.mem_alloc()}
+    return result
+
+def reset():
+    """ Clear every Stat (they stay registered). """
+    for name in _stats:
+        _stats[name].reset()
@@ -1,13 +1,25 @@
 import asyncio
-import web
 import machine
 import time
-from car import car, set_mode, set_speed
-from mpu6050 import mpu
+import boottime
+import instrument
+from car import get_car, set_mode, set_speed
+from mpu6050 import get_mpu, OrientationFilter
 from averager import MeasurementAverager
+from telemetry import Telemetry
+from scheduler import Scheduler
+from pid import PID, RelayAutotuner
+import calibration
+import calstore
+from failsafe import Failsafe
+from gyrobias import GyroBiasEstimator
+from odometry import Odometry, HeadingHold
 import math
 
+LOG_CONTROL = False  # Print every ctrl request; decodes its params and writes to the UART on the hottest path
+
 def test():
+    mpu = get_mpu()
     with MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=10) as yaw_averager:
         while True:
             # Inside this block, yaw_averager is active and sampling.
@@ -17,6 +29,7 @@ def test():
 
 # MPU Test functions
 def print_avel(interval=10, sleep_time=0.2):
+    mpu = get_mpu()
     with MeasurementAverager(sample_function=lambda: mpu.get_avel(), interval=interval) as avel_averager:
         while True:
             Gx, Gy, Gz, total = avel_averager.average_since_last_measurement()
@@ -24,6 +37,7 @@ def print_avel(interval=10, sleep_time=0.2):
             time.sleep(sleep_time)
 
 def print_pitch_rate(interval=10, sleep_time=0.2):
+    mpu = get_mpu()
     with MeasurementAverager(sample_function=lambda: mpu.get_pitch_rate(), interval=interval) as pitch_rate_averager:
         while True:
             pr = pitch_rate_averager.average_since_last_measurement()
@@ -31,6 +45,7 @@ def print_pitch_rate(interval=10, sleep_time=0.2):
             time.sleep(sleep_time)
 
 def print_tilt(interval=10, sleep_time=0.2):
+    mpu = get_mpu()
     with MeasurementAverager(sample_function=lambda: mpu.get_tilt(), interval=interval) as tilt_averager:
         while True:
             roll, pitch, total = tilt_averager.average_since_last_measurement()
@@ -38,14 +53,42 @@ def print_tilt(interval=10, sleep_time=0.2):
             time.sleep(sleep_time)
 
 def print_pitch(interval=10, sleep_time=0.2):
+    mpu = get_mpu()
     with MeasurementAverager(sample_function=lambda: mpu.get_pitch(), interval=interval) as pitch_averager:
         while True:
             p = pitch_averager.average_since_last_measurement()
             print(f"{p}")
             time.sleep(sleep_time)
 
+def print_avel_fifo(rate=100, sleep_time=0.2):
+    """ Like print_avel, but every sample comes from the hardware FIFO instead of a polling timer. """
+    mpu = get_mpu()
+    total = [0.0, 0.0, 0.0]
+    count = 0
+
+    def accumulate(raw):
+        nonlocal count
+        Gx, Gy, Gz, _ = mpu.get_avel(raw)
+        total[0] += Gx
+        total[1] += Gy
+        total[2] += Gz
+        count += 1
+
+    mpu.start_fifo(rate)
+    try:
+        while True:
+            time.sleep(sleep_time)
+            mpu.read_fifo(accumulate)
+            if count:
+                print(f"Gx: {total[0] / count}, Gy: {total[1] / count}, Gz: {total[2] / count}, Samples: {count}, Overflows: {mpu.fifo_overflows}")
+            total[0] = total[1] = total[2] = 0.0
+            count = 0
+    finally:
+        mpu.stop_fifo()
+
 # Car test functions
 def test_sequence():
+    car = get_car()
     time.sleep(5)
 
     # Test forward movement
@@ -71,16 +114,22 @@ def test_sequence():
     # Stop
     car.stop()
 
-def aim_up(threshold=1, timeout=10000, spin_time=200, pause_time=150):
-    """ Aligns the car to face uphill using spin-pause cycles to reduce accelerometer noise. """
+def aim_up(threshold=1, timeout=10000, interval=50, rate=100):
+    """ Aligns the car to face uphill, steering continuously from the gyro/accel orientation filter. """
+    car = get_car()
+    mpu = get_mpu()
     print("Test starting in 5 seconds...")
     time.sleep(5)
 
+    # The filter keeps tilt valid while spinning, so no stop-and-settle pauses are needed
+    orientation = OrientationFilter(mpu, rate=rate)
+    mpu.start_fifo(rate)
     try:
         start_time = time.ticks_ms()  # Record start time
         while time.ticks_diff(time.ticks_ms(), start_time) < timeout:
             # Read current tilt values
-            roll, pitch, total = mpu.get_tilt()
+            orientation.poll()
+            roll, pitch, total = orientation.get_tilt()
 
             # Compute pitch error
             error = total - pitch  # We want pitch to match total incline
@@ -94,80 +143,93 @@ def aim_up(threshold=1, timeout=10000, spin_time=200, pause_time=150):
 
             print(f"Aligning... Roll: {roll:.2f}, Pitch: {pitch:.2f}, Target: {total:.2f}, Error: {error:.2f}, Raw Steering: {raw_steering:.2f}, Scaled Steering: {car.steering:.2f}")
 
-            # Spin for a short duration
-            time.sleep(spin_time / 1000)
-
-            # Stop briefly to let accelerometer settle
-            car.steering = 0  
-            time.sleep(pause_time / 1000)
+            time.sleep(interval / 1000)
 
     finally:
+        mpu.stop_fifo()
         car.stop()
 
-def spin_at_rate(dps=9, timeout=10, dt=0.05, Kp=0, Ki=0.1, Kd=0, limit=0.5, sample_rate=10):
-    """ Spins the car at a constant rate using a PID loop with a Timer. """
-    tmr = machine.Timer(-1)  # Create a software timer
-    averager = None
+def spin_at_rate(dps=9, timeout=10, dt=0.05, Kp=0, Ki=0.1, Kd=0, limit=0.5, sample_rate=10, scheduler=None):
+    """ Spins the car at a constant rate using a PID loop run by the scheduler. """
+    car = get_car()
+    mpu = get_mpu()
+    scheduler = scheduler or Scheduler()
+    averager = control = None
     try:
         print("Starting spin in 5 seconds...")
         time.sleep(5)
-        start_time = time.time()  # Record start time
 
-        # PID Variables
-        integral = 0
-        last_error = 0
-
-        def pid_control(t):
-            nonlocal integral, last_error
+        # Output limits double as the anti-windup limits
+        pid = PID(Kp, Ki, Kd, dt, -limit, limit)
 
+        @instrument.timed("spin_at_rate pid")
+        def pid_control():
             # Read current yaw rate (Z-axis) from the gyro
             # Assuming mpu.get_avel() returns (Gx_dps, Gy_dps, Gz_dps)
             yaw_rate = -averager.average_since_last_measurement()  # Invert yaw rate for Z-axis
 
-            # Compute error (desired rate minus current rate)
-            error = dps - yaw_rate
-
-            # Update integral (with anti-windup)
-            integral += error * dt
-            # Cap the integral term using min and max functions
-            integral = max(-100, min(100, integral))
+            car.steering = pid.update(dps, yaw_rate)
 
-            # Derivative term
-            derivative = (error - last_error) / dt
-            last_error = error
+            print(f"Y: {yaw_rate:.2f}, T: {dps}, E: {dps - yaw_rate:.2f}, S: {car.steering:.2f}")
 
-            # PID output
-            output = (Kp * error) + (Ki * integral) + (Kd * derivative)
+        # Sampling is registered first, so on a shared tick the PID sees the fresh sample
+        averager = MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=dt*1000/sample_rate, scheduler=scheduler)
+        control = scheduler.every(dt * 1000, pid_control, "pid")
 
-            # Apply steering adjustment (ensure within [-1, 1])
-            car.steering = max(-limit, min(limit, output))
+        # Run both at their fixed rates, sleeping in between, until the timeout
+        scheduler.run(timeout * 1000)
+        print("Spin complete.")
+        scheduler.report()
 
-            print(f"Y: {yaw_rate:.2f}, T: {dps}, E: {error:.2f}, S: {car.steering:.2f}")
-
-            # Stop the timer and car when timeout is reached
-            if time.time() - start_time >= timeout:
-                tmr.deinit()
-                car.stop()
-                print("Spin complete.")
-
-        # Start taking measurements
-        averager = MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=int(dt*1000/sample_rate))
+    finally:
+        if averager:
+            averager.stop()
+        if control:
+            scheduler.remove(control)
+        car.stop()
 
-        # Start the PID loop using the timer (fixed interval)
-        tmr.init(period=int(dt * 1000), mode=machine.Timer.PERIODIC, callback=pid_control)
+def autotune_spin(dps=18, bias=0.3, amplitude=0.1, dt=0.02, cycles=4, timeout=30, sample_rate=5, scheduler=None):
+    """ Relay-feedback autotune of the spin_at_rate loop; prints the ultimate gain/period and suggested gains. """
+    car = get_car()
+    mpu = get_mpu()
+    scheduler = scheduler or Scheduler()
+    tuner = RelayAutotuner(dps, bias, amplitude, hysteresis=2, cycles=cycles)
+    averager = control = None
+    try:
+        print("Starting autotune in 5 seconds...")
+        time.sleep(5)
 
-        # Wait until the timeout is reached
-        while time.time() - start_time < timeout:
-            pass
+        def relay():
+            yaw_rate = -averager.average_since_last_measurement()
+            car.steering = tuner.update(yaw_rate, dt)
+            print(f"Y: {yaw_rate:.2f}, T: {dps}, E: {dps - yaw_rate:.2f}, S: {car.steering:.2f}")
+            if tuner.done:
+                scheduler.stop()
+
+        averager = MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=dt*1000/sample_rate, scheduler=scheduler)
+        control = scheduler.every(dt * 1000, relay, "relay")
+        scheduler.run(timeout * 1000)
+
+        if not tuner.done:
+            print("Autotune timed out; try a larger amplitude or bias.")
+            return None
+        Ku, Pu = tuner.result()
+        print(f"Ku: {Ku:.4f}, Pu: {Pu:.2f} s")
+        for rule in ("pi", "tl", "pid"):
+            print(rule, "Kp={:.4f}, Ki={:.4f}, Kd={:.4f}".format(*tuner.gains(rule)))
+        return tuner.gains("tl")
 
     finally:
         if averager:
             averager.stop()
-        tmr.deinit()
+        if control:
+            scheduler.remove(control)
         car.stop()
 
 def spin_for_time(spin=0.3, timeout=5):
     """ Spins the car at a fixed steering value for a fixed duration, and measures its angular velocity. """
+    car = get_car()
+    mpu = get_mpu()
     with MeasurementAverager(sample_function=lambda: mpu.get_avel()[2], interval=10) as averager:
         try:
             start_time = time.time()  # Record start time
@@ -179,61 +241,174 @@ def spin_for_time(spin=0.3, timeout=5):
             car.stop()
             print(f"Yaw rate: {yaw_rate:.2f}")
 
-def motor_test(m, freq):
+def calibrate_motors(steps=20, settle=300, duration=500, filename=calstore.FILENAME):
+    """ Measures each motor's duty-to-speed curve with the IMU (pivoting on the other wheel), then saves and applies the tables. """
+    car = get_car()
+    mpu = get_mpu()
+    print("Calibrating motors in 5 seconds... Give the car room to pivot.")
+    time.sleep(5)
+    car.calibration = calibration.calibrate(car, mpu, steps, settle, duration)
+    record = calstore.get_record()
+    record.motors = car.calibration
+    record.save(filename)
+    print(f"Motor calibration saved to {filename}")
+    return car.calibration
+
+def motor_test(m, freq, duration=10, scheduler=None):
+    car = get_car()
     # WARNING: Use 5V
     m[0].freq(freq)
 
-    tmr = machine.Timer(-1)
-    start_time = time.ticks_ms()  # use ticks_ms for millisecond resolution
-    duration = 10  # seconds
-
-    def timer_callback(timer):
-        elapsed = time.ticks_diff(time.ticks_ms(), start_time) / 1000  # convert ms to s
-        if elapsed < duration:
-            sin_val = math.sin(math.pi * elapsed)
-            print(sin_val)
-            set_mode(1 if sin_val >= 0 else 2, m)
-            set_speed(abs(sin_val), m)
-        else:
-            timer.deinit()
-            car.stop()
+    scheduler = scheduler or Scheduler()
+    clock = scheduler.clock
+    start_time = clock.now()
 
-    tmr.init(period=50, mode=machine.Timer.PERIODIC, callback=timer_callback)
+    def drive():
+        elapsed = clock.diff(clock.now(), start_time) / 1000000  # convert us to s
+        sin_val = math.sin(math.pi * elapsed)
+        print(sin_val)
+        set_mode(1 if sin_val >= 0 else 2, m)
+        set_speed(abs(sin_val), m)
 
-def main():
+    task = scheduler.every(50, drive, "motor_test")
+    try:
+        scheduler.run(duration * 1000)
+    finally:
+        scheduler.remove(task)
+        car.stop()
+
+def main(use_async=True, lease_ms=1000, watchdog=False, track_bias=True, udp=True, heading_hold=True):
+    """
+    Runs the web control server. Every control update carries a lease (lease_ms unless it
+    sends its own); when updates stop the motors ramp to zero. watchdog starts the
+    hardware watchdog, fed by the failsafe check, so a stalled loop resets the board
+    (async server only). Its timeout is fixed on the ESP8266: about 5 s.
+    track_bias re-estimates the gyro bias whenever the car stands still. udp also takes
+    control datagrams on web.UDP_PORT (see tools/udp_send.py). heading_hold keeps the
+    car on its heading while driving with the steering centred (see odometry.HeadingHold).
+    """
+    if watchdog and not use_async:
+        raise ValueError("watchdog needs use_async: the blocking server's failsafe runs from a timer, which would keep feeding it")
+    web = boottime.timed_import("web")  # Deferred so importing main for the test functions doesn't compile the server
+    car = None
+    failsafe = None
+    bias = None
+    udp_control = None
+    wifi = None
+    odometry = None
+    hold = None
+    drive = None  # car.set, or hold.set with heading hold
     tmr = machine.Timer(-1)
 
     def refresh(t):
         car.update_motors()
 
+    def parked():
+        # Nothing is driving: the Wi-Fi manager may scan, or take its access point down
+        return failsafe is not None and failsafe.parked()
+
+    def control_received():
+        # The first control packet ends the startup profile
+        if boottime.first("control"):
+            boottime.report()
+
     def receive_state(r):
-        print("Received:", r)
+        control_received()
+        if LOG_CONTROL:
+            print("Received:", r)
 
-        # Receive control variables
-        car.throttle = float(r['params'].get('t', car.throttle))
-        car.steering = float(r['params'].get('s', car.steering))
+        # Receive control variables, applying the motors once
+        drive(r.param_float(b't'), r.param_float(b's'))
+        failsafe.renew(r.param_float(b'l'))
         
         # Print received values
         return {"t": car.throttle, "s": car.steering}
 
+    def control_datagram(throttle, steering, lease):
+        control_received()
+        drive(throttle, steering)
+        failsafe.renew(lease)
+
+    async def control_socket(ws, request):
+        # Binary control frames stream in without replies; anything else is ignored
+        while True:
+            message = await ws.recv()
+            if message is None:
+                break
+            opcode, payload = message
+            if opcode == web.WS_BINARY and len(payload) in (4, 6):
+                control_received()
+                drive(*web.decode_control(payload))
+                failsafe.renew(web.decode_lease(payload))
+
     try:
         print("Starting program...")
         
         # tmr.init(period=20, mode=machine.Timer.PERIODIC, callback=refresh)
         
-        # Connect to network
-        web.connect_wifi()
-        # web.start_access_point()
+        # Start joining the network in the background; the hardware comes up while the radio
+        # associates, and the server starts without waiting (the manager falls back to the car's
+        # own access point if the network doesn't show up, and rejoins when the link drops)
+        scheduler = Scheduler()
+        runner = scheduler if use_async else None  # Periodic work runs on the async server's loop, else from Timers
+        wifi = web.WifiManager(scheduler=runner, idle=parked)
+        car = get_car()
+        telemetry = Telemetry(get_mpu(), car)
+        scheduler.every(20, telemetry.sample, "telemetry")
+
+        # The ESP8266 port takes no timeout (current firmware refuses anything but 5000 ms, older
+        # firmware the keyword); the longest the loop blocks, a Wi-Fi scan of about 2 s, fits in it
+        wdt = machine.WDT() if watchdog else None
+        failsafe = Failsafe(car, lease_ms, scheduler=runner, wdt=wdt)
+        if track_bias:
+            bias = GyroBiasEstimator(get_mpu(), car, scheduler=runner)
+        if heading_hold:
+            # Registered in this order, so each hold step sees the heading of the same tick
+            odometry = Odometry(get_mpu(), car, scheduler=runner)
+            hold = HeadingHold(car, odometry, scheduler=runner)
+        drive = hold.set if hold else car.set
+        if udp:
+            # The async server reads datagrams as they arrive (serve() below); the blocking one polls from a timer
+            udp_control = web.UdpControl(control_datagram, interval=None if use_async else 10)
 
         # Set up web server
         endpoints = {
             "ctrl": receive_state,
+            "ws": web.WebSocketEndpoint(control_socket),
+            "telemetry": web.WebSocketEndpoint(telemetry.stream),
+            "stats": web.stats_endpoint,  # Timings and allocations, with instrument.enable() in boot.py
         }
-        web.start_webserver(endpoints)
+        try:
+            # The packed UI, so the car can be driven from http://<car ip>/ with no local copy
+            endpoints[""] = web.StaticFile("www/ui.html.gz")
+        except OSError:
+            print("No www/ui.html.gz; run ui/html_packer.py and upload www/")
+        if use_async:
+            # The WebSocket control channel needs the async server; ctrl stays as the HTTP fallback
+            # Sensor sampling and control laws are scheduler tasks; the scheduler runs alongside the server
+            tasks = [scheduler.run_async()]
+            if udp_control:
+                tasks.append(udp_control.serve())
+            web.run_webserver(endpoints, tasks=tasks)
+        else:
+            web.start_webserver(endpoints)
     except Exception as e:
         print("Error:", e)
     finally:
-        car.stop()
+        if failsafe:
+            failsafe.stop()
+        if bias:
+            bias.stop()
+        if udp_control:
+            udp_control.stop()
+        if wifi:
+            wifi.stop()
+        if hold:
+            hold.stop()
+        if odometry:
+            odometry.stop()
+        if car:
+            car.stop()
         tmr.deinit()
 
 if __name__ == "__main__":
@@ -2,38 +2,40 @@ from machine import Pin, I2C
 import ustruct
 import time
 import math
-import os
+import boottime
+import calstore
+
+GYRO_SCALE = 131.0     # LSB per °/s, ±250 °/s mode
+
+# Registers used for FIFO sampling
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+FIFO_EN = 0x23
+INT_STATUS = 0x3A
+USER_CTRL = 0x6A
+FIFO_COUNT = 0x72
+FIFO_R_W = 0x74
+FIFO_SIZE = 1024
+FIFO_FRAME = 14      # Accel, temperature and gyro, laid out like read_all_raw
+FIFO_CHUNK = 16      # Frames fetched per I2C read when draining
 
 class MPU6050:
     def __init__(self, i2c, addr=0x68):
         self.i2c = i2c
         self.addr = addr
+        self._raw = bytearray(14)  # Burst-read buffer: accel, temperature, gyro
+        self._fifo = bytearray(FIFO_FRAME * FIFO_CHUNK)
+        self._fifo_mv = memoryview(self._fifo)
+        self.fifo_rate = 0         # Samples per second while the FIFO is running
+        self.fifo_overflows = 0
         # Wake up the MPU6050
         self.i2c.writeto_mem(self.addr, 0x6B, b'\x00')
-        # Load stored offsets (or default to zeros)
-        self.gyro_offsets = self.load_offsets("gyro.txt", 3)
-        self.tilt_offsets = self.load_offsets("tilt.txt", 2)
-
-    # Calibration and offset persistence
-    def save_offsets(self, filename, offsets):
-        """Save offsets to a file."""
-        with open(filename, "w") as f:
-            for value in offsets:
-                f.write(str(value) + "\n")
-
-    def load_offsets(self, filename, expected_length):
-        """Load offsets from file if available; otherwise, return zeros."""
-        try:
-            with open(filename, "r") as f:
-                offsets = [float(line.strip()) for line in f.readlines()]
-                if len(offsets) != expected_length:
-                    raise ValueError
-                print(f"{filename} offsets loaded:", offsets)
-                return offsets
-        except (OSError, ValueError):
-            print(f"No valid {filename} file found. Using default offsets.")
-            return [0.0] * expected_length
+        # Stored offsets (zeros until calibrated)
+        record = calstore.get_record()
+        self.gyro_offsets = list(record.gyro_bias)
+        self.tilt_offsets = list(record.tilt_offsets)
 
+    # Calibration
     def calibrate_gyro(self, samples=100):
         """Calibrate gyroscope by averaging multiple readings, then save offsets."""
         print("Calibrating gyroscope... Keep sensor still.")
@@ -48,7 +50,10 @@ class MPU6050:
         Gy_offset /= samples
         Gz_offset /= samples
         self.gyro_offsets = [Gx_offset, Gy_offset, Gz_offset]
-        self.save_offsets("gyro.txt", self.gyro_offsets)
+        record = calstore.get_record()
+        record.gyro_bias = self.gyro_offsets
+        record.temp_ref = self.get_temperature()  # The bias holds at this temperature; temp_coeff moves it from there
+        record.save()
         print("Gyro calibration complete:", self.gyro_offsets)
 
     def calibrate_tilt(self, samples=100):
@@ -63,10 +68,20 @@ class MPU6050:
         roll_offset /= samples
         pitch_offset /= samples
         self.tilt_offsets = [roll_offset, pitch_offset]
-        self.save_offsets("tilt.txt", self.tilt_offsets)
+        record = calstore.get_record()
+        record.tilt_offsets = self.tilt_offsets
+        record.save()
         print("Tilt calibration complete:", self.tilt_offsets)
 
     # Raw sensor readings
+    def read_all_raw(self):
+        """Read accel, temperature and gyro in one 14-byte burst: (Ax, Ay, Az, T, Gx, Gy, Gz).
+
+        All values come from the same sample, so derived accel and gyro readings are never skewed.
+        """
+        self.i2c.readfrom_mem_into(self.addr, 0x3B, self._raw)
+        return ustruct.unpack(">hhhhhhh", self._raw)
+
     def read_accel_raw(self):
         """Read raw accelerometer values (Ax, Ay, Az)."""
         raw = self.i2c.readfrom_mem(self.addr, 0x3B, 6)
@@ -83,10 +98,72 @@ class MPU6050:
         Gx, = ustruct.unpack(">h", raw)
         return Gx
 
+    def get_temperature(self, raw=None):
+        """Return die temperature in °C, from raw (a read_all_raw snapshot) or a fresh read."""
+        raw = raw or self.read_all_raw()
+        return raw[3] / 340 + 36.53
+
+    def get_motion(self):
+        """Return (get_avel(), get_tilt()) computed from a single burst read."""
+        raw = self.read_all_raw()
+        return self.get_avel(raw), self.get_tilt(raw)
+
+    # Hardware FIFO sampling
+    def start_fifo(self, rate=100, dlpf=3):
+        """Sample accel, temperature and gyro into the on-chip FIFO at rate Hz.
+
+        dlpf is the CONFIG low-pass setting (1-6; 0 disables it and the gyro runs at 8 kHz).
+        The achievable rate is the gyro rate divided by an integer, see fifo_rate.
+        """
+        self.i2c.writeto_mem(self.addr, CONFIG, bytes((dlpf,)))
+        gyro_rate = 8000 if dlpf in (0, 7) else 1000
+        divider = max(0, min(255, int(gyro_rate / rate + 0.5) - 1))
+        self.i2c.writeto_mem(self.addr, SMPLRT_DIV, bytes((divider,)))
+        self.fifo_rate = gyro_rate / (divider + 1)
+        self.i2c.writeto_mem(self.addr, FIFO_EN, b'\xF8')  # TEMP, XG, YG, ZG and ACCEL
+        self.reset_fifo()
+
+    def reset_fifo(self):
+        """Empty the FIFO and clear a pending overflow flag, leaving it running."""
+        self.i2c.writeto_mem(self.addr, USER_CTRL, b'\x04')  # FIFO_RESET
+        self.i2c.writeto_mem(self.addr, USER_CTRL, b'\x40')  # FIFO_EN
+        self.i2c.readfrom_mem(self.addr, INT_STATUS, 1)      # Reading clears FIFO_OFLOW_INT
+
+    def stop_fifo(self):
+        """Stop filling the FIFO."""
+        self.i2c.writeto_mem(self.addr, FIFO_EN, b'\x00')
+        self.i2c.writeto_mem(self.addr, USER_CTRL, b'\x04')
+        self.fifo_rate = 0
+
+    def read_fifo(self, callback):
+        """Drain every complete sample from the FIFO, calling callback(raw) for each; returns the count.
+
+        raw has the read_all_raw layout, so it can be passed to get_avel/get_tilt. After an
+        overflow the FIFO has lost bytes and is out of frame alignment, so it is reset instead
+        and fifo_overflows is incremented.
+        """
+        status = self.i2c.readfrom_mem(self.addr, INT_STATUS, 1)[0]
+        high, low = self.i2c.readfrom_mem(self.addr, FIFO_COUNT, 2)
+        count = high << 8 | low
+        if status & 0x10 or count >= FIFO_SIZE:
+            self.fifo_overflows += 1
+            self.reset_fifo()
+            return 0
+        frames = count // FIFO_FRAME
+        done = 0
+        while done < frames:
+            n = min(frames - done, FIFO_CHUNK)
+            self.i2c.readfrom_mem_into(self.addr, FIFO_R_W, self._fifo_mv[:n * FIFO_FRAME])
+            for i in range(n):
+                callback(ustruct.unpack_from(">hhhhhhh", self._fifo, i * FIFO_FRAME))
+            done += n
+        return frames
+
     # Processed gyro data
-    def get_gyro_calibrated(self):
+    def get_gyro_calibrated(self, raw=None):
         """Return calibrated gyro values (pitch, roll, yaw) and total angular velocity (spin)."""
-        pitch_rate, roll_rate, yaw_rate = self.read_gyro_raw()
+        raw = raw or self.read_all_raw()
+        pitch_rate, roll_rate, yaw_rate = raw[4], raw[5], raw[6]
         pitch_rate -= self.gyro_offsets[0]
         roll_rate  -= self.gyro_offsets[1]
         yaw_rate   -= self.gyro_offsets[2]
@@ -104,10 +181,10 @@ class MPU6050:
         
         return pitch_rate, roll_rate, yaw_rate, spin
 
-    def get_avel(self):
+    def get_avel(self, raw=None):
         """Return calibrated angular velocity (degrees per second) as a single measurement."""
-        pitch_rate, roll_rate, yaw_rate, spin = self.get_gyro_calibrated()
-        scale_factor = 131.0  # For ±250°/s mode
+        pitch_rate, roll_rate, yaw_rate, spin = self.get_gyro_calibrated(raw)
+        scale_factor = GYRO_SCALE  # For ±250°/s mode
         pitch_rate_dps = pitch_rate / scale_factor
         roll_rate_dps  = roll_rate  / scale_factor
         yaw_rate_dps   = yaw_rate   / scale_factor
@@ -118,36 +195,119 @@ class MPU6050:
         """Return pitch angular velocity (degrees per second) as a single measurement."""
         pitch_rate = self.read_gyro_x_raw()
         pitch_rate -= self.gyro_offsets[0]
-        scale_factor = 131.0
+        scale_factor = GYRO_SCALE
         return round(pitch_rate / scale_factor, 2)
 
     # Processed accelerometer data
-    def get_tilt_raw(self):
+    def get_tilt_raw(self, raw=None):
         """Compute raw roll and pitch angles (degrees) and total tilt using accelerometer."""
-        Ax, Ay, Az = self.read_accel_raw()
+        raw = raw or self.read_all_raw()
+        Ax, Ay, Az = raw[0], raw[1], raw[2]
         roll = math.atan2(Ax, math.sqrt(Ay**2 + Az**2)) * (180 / math.pi)
         pitch = math.atan2(Ay, math.sqrt(Ax**2 + Az**2)) * (180 / math.pi)
         tilt = math.sqrt(roll**2 + pitch**2)
         return roll, pitch, tilt
 
-    def get_tilt(self):
+    def get_tilt(self, raw=None):
         """Return roll and pitch angles with applied offsets, and total tilt, as a single measurement."""
-        roll, pitch, tilt = self.get_tilt_raw()
+        roll, pitch, tilt = self.get_tilt_raw(raw)
         roll -= self.tilt_offsets[0]
         pitch -= self.tilt_offsets[1]
         total = math.sqrt(roll**2 + pitch**2)
         return round(roll, 2), round(pitch, 2), round(total, 2)
 
-    def get_pitch_raw(self):
+    def get_pitch_raw(self, raw=None):
         """Return raw pitch angle (degrees) from accelerometer."""
-        Ax, Ay, Az = self.read_accel_raw()
+        raw = raw or self.read_all_raw()
+        Ax, Ay, Az = raw[0], raw[1], raw[2]
         pitch = math.atan2(Ay, math.sqrt(Ax**2 + Az**2)) * (180 / math.pi)
         return pitch
 
-    def get_pitch(self):
+    def get_pitch(self, raw=None):
         """Return pitch angle with applied offset, as a single measurement."""
-        pitch = self.get_pitch_raw() - self.tilt_offsets[1]
+        pitch = self.get_pitch_raw(raw) - self.tilt_offsets[1]
         return round(pitch, 2)
 
+class OrientationFilter:
+    """Streaming roll/pitch/yaw estimate fusing gyro rates with accelerometer tilt.
+
+    The filter tracks the "up" direction in the sensor frame. Each update rotates
+    it by the gyro rates and then nudges it toward the measured acceleration with
+    time constant tau, so tilt stays valid while the car spins (the accelerometer
+    only has to be right on average). Yaw integrates the rate about that up
+    direction. Roll and pitch use the same definitions and offsets as get_tilt.
+    """
+    def __init__(self, mpu, tau=0.5, rate=100):
+        self.mpu = mpu
+        self.tau = tau
+        self.dt = 1 / rate
+        self.reset()
+
+    def reset(self, raw=None):
+        """Start again from the current accelerometer reading, with yaw at zero."""
+        raw = raw or self.mpu.read_all_raw()
+        norm = math.sqrt(raw[0] ** 2 + raw[1] ** 2 + raw[2] ** 2) or 1
+        self.ux, self.uy, self.uz = raw[0] / norm, raw[1] / norm, raw[2] / norm
+        self.yaw = 0.0
+        self.updates = 0
+        self._angles()
+
+    def update(self, raw=None, dt=None):
+        """Advance the estimate by one sample (a read_all_raw snapshot, or a fresh read) taken dt seconds apart."""
+        raw = raw or self.mpu.read_all_raw()
+        dt = dt or self.dt
+        offsets = self.mpu.gyro_offsets
+        k = math.pi / 180 / GYRO_SCALE
+        wx = (raw[4] - offsets[0]) * k
+        wy = (raw[5] - offsets[1]) * k
+        wz = (raw[6] - offsets[2]) * k
+        ux, uy, uz = self.ux, self.uy, self.uz
+
+        # Gyro: world vectors turn the opposite way in the sensor frame, du/dt = -w x u
+        cx = wy * uz - wz * uy
+        cy = wz * ux - wx * uz
+        cz = wx * uy - wy * ux
+        ux -= cx * dt
+        uy -= cy * dt
+        uz -= cz * dt
+
+        # Accelerometer: pull toward measured gravity, skipping readings far from 1 g
+        ax, ay, az = raw[0], raw[1], raw[2]
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if 0.5 * 16384 < norm < 1.5 * 16384:
+            gain = dt / (self.tau + dt) / norm
+            ux += (ax - ux * norm) * gain
+            uy += (ay - uy * norm) * gain
+            uz += (az - uz * norm) * gain
+
+        norm = math.sqrt(ux * ux + uy * uy + uz * uz)
+        self.ux, self.uy, self.uz = ux / norm, uy / norm, uz / norm
+        self.yaw += (wx * self.ux + wy * self.uy + wz * self.uz) * dt * (180 / math.pi)
+        self.updates += 1
+        self._angles()
+
+    def poll(self):
+        """Apply every sample waiting in the MPU FIFO (see MPU6050.start_fifo); returns how many."""
+        if not self.mpu.fifo_rate:
+            raise RuntimeError("FIFO not running; call start_fifo() first (Odometry.stop() stops it)")
+        self.dt = 1 / self.mpu.fifo_rate
+        return self.mpu.read_fifo(self.update)
+
+    def _angles(self):
+        ux, uy, uz = self.ux, self.uy, self.uz
+        self.roll = math.atan2(ux, math.sqrt(uy * uy + uz * uz)) * (180 / math.pi) - self.mpu.tilt_offsets[0]
+        self.pitch = math.atan2(uy, math.sqrt(ux * ux + uz * uz)) * (180 / math.pi) - self.mpu.tilt_offsets[1]
+
+    def get_tilt(self):
+        """Return roll, pitch and total tilt, like MPU6050.get_tilt."""
+        return round(self.roll, 2), round(self.pitch, 2), round(math.sqrt(self.roll ** 2 + self.pitch ** 2), 2)
+
 # Instantiate MPU6050
-mpu = MPU6050(I2C(scl=Pin(16), sda=Pin(2)))
+_mpu = None
+
+def get_mpu():
+    """ Return the shared MPU6050, waking it and loading its offsets on first use. """
+    global _mpu
+    if _mpu is None:
+        _mpu = boottime.timed("MPU6050()", lambda: MPU6050(I2C(scl=Pin(16), sda=Pin(2))))
+    return _mpu
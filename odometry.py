@@ -0,0 +1,167 @@
+import math
+from pid import PID
+from scheduler import Clock, Periodic
+
+class Odometry:
+    def __init__(self, mpu, car, rate=200, dlpf=3, interval=20, speed=0.25, deadband=0.2, scheduler=None, clock=None):
+        """
+        Dead-reckoned pose: heading integrates the gyro yaw rate (MPU6050.get_avel), and
+        position moves along it at a speed estimated from the motor commands, since the
+        car has no wheel encoders. Axes as in sim.drive: heading in degrees counter-clockwise
+        and not wrapped, y ahead of the car at heading 0, x to its right, in metres.
+
+        The yaw rate ripples at the PWM frequency (5-100 Hz, following the duty), which
+        point samples from a timer alias into heading drift (at 20 ms, several degrees a
+        minute at half throttle). So every gyro sample goes through the FIFO, taken at rate
+        Hz behind the chip's low-pass (dlpf, see MPU6050.start_fifo), and interval only sets
+        how often the FIFO is drained.
+
+        car: The Car whose throttle and steering give the speed estimate.
+        interval: Drain period in milliseconds; None to run neither the FIFO nor a task,
+                  and call update() yourself.
+        speed: Ground speed (m/s) per unit of wheel command above the deadband.
+        deadband: Wheel command below which the motors stall (0 with calibrated motors).
+        scheduler: See scheduler.Periodic.
+        """
+        self.mpu = mpu
+        self.car = car
+        self.speed_scale = speed
+        self.deadband = deadband
+        self.clock = clock or (scheduler.clock if scheduler else Clock())
+        self.reset()
+
+        self.dt = 1 / rate  # Between FIFO samples
+
+        if interval:
+            mpu.start_fifo(rate, dlpf)
+            self.dt = 1 / mpu.fifo_rate
+        self.periodic = Periodic(interval, self.poll, "odometry", scheduler)
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        """ Start again from this pose. """
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.yaw_rate = 0.0  # °/s, counter-clockwise
+        self.speed = 0.0     # m/s, estimated
+        self.distance = 0.0  # Path length, m
+        self.updates = 0
+        self._last = self.clock.now()
+
+    def _wheel(self, command):
+        excess = abs(command) - self.deadband
+        return math.copysign(excess * self.speed_scale, command) if excess > 0 else 0.0
+
+    def update(self, raw=None, dt=None):
+        """ Advance by one gyro sample (a read_all_raw snapshot, or a fresh read) taken dt seconds
+        after the last; dt defaults to the time since the last update. Moves at the speed from
+        the last estimate_speed(), which poll() calls once per batch. """
+        if dt is None:
+            now = self.clock.now()
+            dt = self.clock.diff(now, self._last) / 1000000
+            self._last = now
+        self.yaw_rate = self.mpu.get_avel(raw)[2]
+
+        # Midpoint heading over the step, so turning while driving doesn't bias the position
+        h = math.radians(self.heading + self.yaw_rate * dt / 2)
+        self.x -= self.speed * math.sin(h) * dt
+        self.y += self.speed * math.cos(h) * dt
+        self.heading += self.yaw_rate * dt
+        self.distance += abs(self.speed) * dt
+        self.updates += 1
+
+    def estimate_speed(self):
+        """ Ground speed from the wheel commands, as Car.update_motors computes them. """
+        car = self.car
+        throttle, steering = car.throttle, car.steering
+        forward = throttle * (1 - abs(steering))
+        left = max(-1, min(1, forward + steering))
+        right = max(-1, min(1, forward - steering))
+        self.speed = (self._wheel(left) + self._wheel(right)) / 2
+        return self.speed
+
+    def poll(self):
+        """ Apply every sample waiting in the FIFO; returns how many. """
+        self.estimate_speed()
+        return self.mpu.read_fifo(self._sample)
+
+    def _sample(self, raw):
+        self.update(raw, self.dt)
+
+    def pose(self):
+        """ Return (x, y, heading), heading wrapped to [0, 360). """
+        return self.x, self.y, self.heading % 360
+
+    def stop(self):
+        """ Stops the FIFO, and the timer or scheduler task. """
+        self.periodic.stop()
+        if self.mpu.fifo_rate:
+            self.mpu.stop_fifo()
+
+class HeadingHold:
+    def __init__(self, car, odometry, Kp=0.02, Ki=0.02, Kd=0.0, limit=0.4, deadzone=0.02, interval=20, scheduler=None):
+        """
+        Zero steering means "keep the current heading": while the car drives with the
+        steering centred, a PID on the odometry heading steers it back onto the heading
+        it had when the steering was released, so mismatched motors don't pull it off line.
+        Any other steering, or stopping, hands control straight back.
+
+        Control updates go through set() instead of Car.set. The correction is written to
+        car.steering, so the failsafe, telemetry and the bias estimator see what is applied;
+        the hold lets go as soon as something else stops the car.
+
+        Kp, Ki, Kd: Gains, steering per degree (integral and derivative per second).
+        limit: Largest steering correction.
+        deadzone: |steering| up to this counts as centred.
+        interval: Control period in milliseconds; register after the Odometry so each tick sees a fresh heading.
+        scheduler: See scheduler.Periodic.
+        """
+        self.car = car
+        self.odometry = odometry
+        self.deadzone = deadzone
+        self.pid = PID(Kp, Ki, Kd, interval / 1000, -limit, limit)
+        self.throttle = 0     # Last command from the driver
+        self.steering = 0
+        self.target = None    # Heading held, or None when not holding
+        self.trim = 0.0       # Correction the last hold settled on (motor mismatch), to start the next from
+        self.engaged = 0      # Holds started
+
+        self.periodic = Periodic(interval, self.update, "heading hold", scheduler)
+
+    def set(self, throttle=None, steering=None):
+        """ Drive command, like Car.set; centred steering with throttle holds the heading. """
+        if throttle is not None:
+            self.throttle = max(-1, min(1, throttle))
+        if steering is not None:
+            self.steering = max(-1, min(1, steering))
+        if abs(self.steering) > self.deadzone or not self.throttle:
+            self._release()
+            self.car.set(self.throttle, self.steering)
+            return
+        if self.target is None:
+            self.target = self.odometry.heading
+            self.pid.reset(self.trim)
+            self.engaged += 1
+        self.car.set(self.throttle, self.pid.output)
+
+    def update(self):
+        """ One control step: steer back toward the held heading. """
+        if self.target is None:
+            return
+        car = self.car
+        if not car.throttle:
+            self._release()  # Stopped from elsewhere (failsafe, car.stop)
+            return
+        # Positive steering turns clockwise, i.e. toward lower heading
+        correction = self.pid.update(-self.target, -self.odometry.heading)
+        car.set(None, correction)
+
+    def _release(self):
+        if self.target is not None:
+            self.trim = self.pid.integral
+            self.target = None
+
+    def stop(self):
+        """ Stops the timer or removes the scheduler task. """
+        self._release()
+        self.periodic.stop()
@@ -0,0 +1,158 @@
+import math
+
+class PID:
+    def __init__(self, Kp=0.0, Ki=0.0, Kd=0.0, dt=0.05, out_min=-1.0, out_max=1.0, tf=None, b=1.0, c=0.0, tt=None):
+        """
+        PID controller with all state in plain attributes, so update() allocates nothing.
+
+        Kp, Ki, Kd: Gains (integral and derivative per second).
+        dt: Default sample period in seconds.
+        out_min, out_max: Output limits; the integrator is held back against them (back-calculation).
+                          With Ki = 0 there is no integrator and integral stays 0.
+        tf: Time constant of the derivative low-pass filter in seconds (default 2*dt).
+        b, c: Setpoint weights of the proportional and derivative terms. c=0 differentiates
+              the measurement only, so setpoint steps don't kick the output.
+        tt: Anti-windup tracking time constant in seconds (default sqrt(Ti*Td), Ti, or dt).
+        """
+        self.Kp = float(Kp)
+        self.Ki = float(Ki)
+        self.Kd = float(Kd)
+        self.dt = dt
+        self.out_min = out_min
+        self.out_max = out_max
+        self.tf = 2 * dt if tf is None else tf
+        self.b = b
+        self.c = c
+        self._tt = tt
+        self.reset()
+
+    def reset(self, output=0.0):
+        """ Clear the state; the integrator is preloaded so the next output starts near output. """
+        self.integral = output
+        self.derivative = 0.0
+        self.output = output
+        self._last_d_error = 0.0
+        self._last_p_error = 0.0
+        self._primed = False
+
+    def _tracking(self):
+        if self._tt:
+            return self._tt
+        if self.Kp and self.Ki and self.Kd:
+            return math.sqrt(self.Kd / self.Ki)  # sqrt(Ti * Td)
+        if self.Kp and self.Ki:
+            return self.Kp / self.Ki  # Ti
+        return self.dt
+
+    def update(self, setpoint, measurement, dt=None):
+        """ Advance one step and return the limited output. """
+        if dt is None:
+            dt = self.dt
+        p_error = self.b * setpoint - measurement
+        d_error = self.c * setpoint - measurement
+
+        # Filtered derivative; the first step has no history, so it contributes nothing
+        if self._primed:
+            alpha = self.tf / (self.tf + dt)
+            self.derivative = alpha * self.derivative + (1 - alpha) * self.Kd * (d_error - self._last_d_error) / dt
+        self._last_d_error = d_error
+        self._last_p_error = p_error
+        self._primed = True
+
+        # Integrate, then bleed off whatever the limits cut from the output (back-calculation).
+        # Without integral action there is nothing to wind up, so a P or PD controller keeps no integral
+        if self.Ki:
+            self.integral += self.Ki * (setpoint - measurement) * dt
+        else:
+            self.integral = 0.0
+        raw = self.Kp * p_error + self.integral + self.derivative
+        output = max(self.out_min, min(self.out_max, raw))
+        if self.Ki:
+            self.integral += (output - raw) * dt / self._tracking()
+        self.output = output
+        return output
+
+    def set_gains(self, Kp=None, Ki=None, Kd=None):
+        """ Change gains without a jump in the output. """
+        if Kp is not None:
+            # The integrator absorbs the change in the proportional term
+            Kp = float(Kp)
+            self.integral += (self.Kp - Kp) * self._last_p_error
+            self.Kp = Kp
+        if Ki is not None:
+            self.Ki = float(Ki)  # The integrator stores Ki * integral of error, so it carries over
+        if Kd is not None:
+            Kd = float(Kd)
+            if self.Kd:
+                self.derivative *= Kd / self.Kd
+            self.Kd = Kd
+
+class RelayAutotuner:
+    def __init__(self, setpoint, bias, amplitude, hysteresis=0.0, cycles=4):
+        """
+        Relay-feedback (Astrom-Hagglund) experiment: the output switches between
+        bias + amplitude and bias - amplitude as the measurement crosses the setpoint,
+        which makes the loop oscillate at its ultimate period.
+
+        bias: Output around which to switch, e.g. the steering that overcomes the motors' deadband.
+        hysteresis: Measurement band around the setpoint that doesn't switch the relay (noise immunity).
+        cycles: Full oscillations to measure once the first one has settled.
+        """
+        self.setpoint = setpoint
+        self.bias = bias
+        self.amplitude = amplitude
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.high = True
+        self.t = 0.0
+        self.done = False
+        self.periods = 0
+        self._period_sum = 0.0
+        self._swing_sum = 0.0
+        self._last_rise = None
+        self._peak = -math.inf
+        self._trough = math.inf
+
+    def update(self, measurement, dt):
+        """ Feed one measurement; returns the relay output. """
+        self.t += dt
+        if self.done:
+            return self.bias
+        self._peak = max(self._peak, measurement)
+        self._trough = min(self._trough, measurement)
+        if self.high and measurement > self.setpoint + self.hysteresis:
+            self.high = False
+        elif not self.high and measurement < self.setpoint - self.hysteresis:
+            self.high = True
+            # One full cycle ends at each switch back to high
+            if self._last_rise is not None:
+                self.periods += 1
+                if self.periods > 1:
+                    self._period_sum += self.t - self._last_rise
+                    self._swing_sum += self._peak - self._trough
+                    if self.periods > self.cycles:
+                        self.done = True
+            self._last_rise = self.t
+            self._peak = -math.inf
+            self._trough = math.inf
+        return self.bias + (self.amplitude if self.high else -self.amplitude)
+
+    def result(self):
+        """ Returns (Ku, Pu): ultimate gain and period, or None until done. """
+        if not self.done:
+            return None
+        n = self.periods - 1
+        a = self._swing_sum / n / 2
+        return 4 * self.amplitude / (math.pi * a), self._period_sum / n
+
+    def gains(self, rule="pi"):
+        """ Returns (Kp, Ki, Kd) from the ultimate gain and period: rule is "pi", "pid" (Ziegler-Nichols)
+        or "tl" (Tyreus-Luyben PI, less overshoot). """
+        Ku, Pu = self.result()
+        if rule == "pid":
+            Kp, Ti, Td = 0.6 * Ku, Pu / 2, Pu / 8
+        elif rule == "tl":
+            Kp, Ti, Td = Ku / 3.2, 2.2 * Pu, 0
+        else:
+            Kp, Ti, Td = 0.45 * Ku, Pu / 1.2, 0
+        return Kp, Kp / Ti, Kp * Td
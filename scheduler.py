@@ -0,0 +1,203 @@
+import time
+import asyncio
+import machine
+
+class Clock:
+    """ Microsecond clock on time.ticks_us (wraps, so always compare with diff). """
+    def now(self):
+        return time.ticks_us()
+
+    def diff(self, a, b):
+        return time.ticks_diff(a, b)
+
+    def add(self, t, delta):
+        return time.ticks_add(t, delta)
+
+    def sleep(self, us):
+        """ Block for us microseconds without spinning on the clock. """
+        if us >= 1000:
+            time.sleep_ms(us // 1000)
+            us %= 1000
+        if us:
+            time.sleep_us(us)
+
+    async def sleep_async(self, us):
+        await asyncio.sleep(us / 1000000)
+
+class Task:
+    """ A function run every period_us by a Scheduler, with timing counters. """
+    def __init__(self, func, period_us, deadline_us, phase_us, name):
+        self.func = func
+        self.period = period_us
+        self.deadline = deadline_us
+        self.phase = phase_us
+        self.name = name
+        self.due = 0
+        self.runs = 0
+        self.misses = 0        # Runs that finished after release + deadline
+        self.overruns = 0      # Releases skipped because a run went past them
+        self.max_jitter = 0    # Worst lateness of a start, in us
+        self.total_jitter = 0
+        self.max_duration = 0
+        self.errors = 0        # Runs that raised; the task keeps its slot
+        self.error = None      # The latest exception
+
+    def mean_jitter(self):
+        return self.total_jitter / self.runs if self.runs else 0
+
+class Periodic:
+    def __init__(self, interval, func, name=None, scheduler=None):
+        """
+        Calls func() every interval milliseconds until stop(): as a task of the scheduler
+        if one is given (the async server's loop), otherwise from a hardware Timer. With
+        interval None or 0 it never calls func, for owners that are driven from elsewhere.
+        """
+        self.func = func
+        self.scheduler = scheduler
+        self.task = None
+        self.timer = None
+        if not interval:
+            return
+        if scheduler:
+            self.task = scheduler.every(interval, func, name)
+        else:
+            self.timer = machine.Timer(-1)
+            self.timer.init(period=interval, mode=machine.Timer.PERIODIC, callback=self._callback)
+
+    def _callback(self, t):
+        self.func()
+
+    def stop(self):
+        """ Stops the timer or removes the scheduler task; calling it again does nothing. """
+        if self.timer:
+            self.timer.deinit()
+            self.timer = None
+        if self.task:
+            self.scheduler.remove(self.task)
+            self.task = None
+
+class Scheduler:
+    """ Cooperative fixed-rate scheduler.
+
+    Tasks are released every period on a fixed grid (no drift), and the most
+    overdue one runs first; on a tie the earlier-registered task wins. Between
+    releases the scheduler sleeps on its clock instead of busy-waiting. A task
+    that raises is counted and stays scheduled, so one failing sensor read
+    can't stop the others (the failsafe among them). Pass
+    sim.clock.SimClock to run on simulated time under CPython.
+    """
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.tasks = []
+        self.running = False
+        self.idle = 0  # Microseconds spent sleeping
+
+    def every(self, period_ms, func, name=None, deadline_ms=None, phase_ms=0):
+        """ Run func() every period_ms, first phase_ms after the start (deadline defaults to the period); returns the Task. """
+        period = int(period_ms * 1000)
+        deadline = int(deadline_ms * 1000) if deadline_ms else period
+        task = Task(func, period, deadline, int(phase_ms * 1000), name or getattr(func, "__name__", "task"))
+        task.due = self.clock.add(self.clock.now(), task.phase)
+        self.tasks.append(task)
+        return task
+
+    def remove(self, task):
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+    def stop(self):
+        """ Make run()/run_async() return after the current task. """
+        self.running = False
+
+    def step(self):
+        """ Run every task that is due; returns microseconds until the next release. """
+        clock = self.clock
+        while self.running:
+            now = clock.now()
+            task = None
+            for t in self.tasks:
+                if task is None or clock.diff(t.due, task.due) < 0:
+                    task = t
+            if task is None:
+                return 1000
+            wait = clock.diff(task.due, now)
+            if wait > 0:
+                return wait
+            self._run(task, now)
+        return 0
+
+    def _run(self, task, start):
+        clock = self.clock
+        release = task.due
+        lateness = clock.diff(start, release)
+        try:
+            task.func()
+        except Exception as e:
+            task.errors += 1
+            task.error = e
+            if task.errors == 1:
+                print("Task", task.name, "raised", repr(e), "(reported once; counted in report())")
+        end = clock.now()
+
+        task.runs += 1
+        task.total_jitter += lateness
+        if lateness > task.max_jitter:
+            task.max_jitter = lateness
+        duration = clock.diff(end, start)
+        if duration > task.max_duration:
+            task.max_duration = duration
+        if clock.diff(end, release) > task.deadline:
+            task.misses += 1
+
+        # Next release on the same grid, skipping any the run went past
+        task.due = clock.add(release, task.period)
+        behind = clock.diff(end, task.due)
+        if behind >= 0:
+            skipped = behind // task.period + 1
+            task.overruns += skipped
+            task.due = clock.add(task.due, skipped * task.period)
+
+    def _start(self, duration_ms):
+        self.running = True
+        now = self.clock.now()
+        for task in self.tasks:
+            task.due = self.clock.add(now, task.phase)
+        return None if duration_ms is None else self.clock.add(now, int(duration_ms * 1000))
+
+    def _wait(self, end):
+        # Run what is due and return how long to sleep; stops at end (exclusive), so a
+        # duration of D ms runs exactly the releases in [start, start + D)
+        if end is not None and self.clock.diff(end, self.clock.now()) <= 0:
+            self.running = False
+            return 0
+        wait = self.step()
+        if end is not None:
+            wait = min(wait, self.clock.diff(end, self.clock.now()))
+        return wait
+
+    def run(self, duration_ms=None):
+        """ Run tasks until stop() or duration_ms has passed. """
+        end = self._start(duration_ms)
+        while self.running:
+            wait = self._wait(end)
+            if wait > 0:
+                self.clock.sleep(wait)
+                self.idle += wait
+
+    async def run_async(self, duration_ms=None):
+        """ Like run(), but sleeps with asyncio so the web server keeps running. """
+        end = self._start(duration_ms)
+        while self.running:
+            wait = self._wait(end)
+            if wait > 0:
+                await self.clock.sleep_async(wait)
+                self.idle += wait
+            else:
+                await asyncio.sleep(0)
+
+    def report(self):
+        """ Print the timing counters of every task. """
+        for t in self.tasks:
+            print(f"{t.name}: runs {t.runs}, misses {t.misses}, overruns {t.overruns}, "
+                  f"jitter mean {t.mean_jitter():.0f} us max {t.max_jitter} us, max duration {t.max_duration} us"
+                  + (f", errors {t.errors} (last {t.error!r})" if t.errors else ""))
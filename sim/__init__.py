@@ -0,0 +1,64 @@
+""" Host-side (CPython) stand-ins for the MicroPython modules the car code imports.
+
+Call install() before importing any of the device modules:
+
+    import sim
+    sim.install()
+    import web
+
+sim.drive.Simulation then runs the car code against a differential-drive
+model on simulated time; sim.clock.SimClock drives a Scheduler on its own.
+"""
+import sys
+import time
+import json
+import re
+import struct
+import hashlib
+import binascii
+
+def _ticks_ms():
+    return int(time.monotonic() * 1000)
+
+def _ticks_us():
+    return int(time.monotonic() * 1000000)
+
+def _ticks_diff(new, old):
+    return new - old
+
+def _ticks_add(ticks, delta):
+    return ticks + delta
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+def _sleep_us(us):
+    time.sleep(us / 1000000)
+
+def install():
+    """ Register the stand-ins under their MicroPython names and add the ticks_* helpers to time. """
+    from sim import machine, network, ntptime
+    modules = {
+        "machine": machine,
+        "network": network,
+        "ntptime": ntptime,
+        "ure": re,
+        "ujson": json,
+        "ustruct": struct,
+        "uhashlib": hashlib,
+        "ubinascii": binascii,
+    }
+    for name, module in modules.items():
+        sys.modules.setdefault(name, module)
+
+    helpers = {
+        "ticks_ms": _ticks_ms,
+        "ticks_us": _ticks_us,
+        "ticks_diff": _ticks_diff,
+        "ticks_add": _ticks_add,
+        "sleep_ms": _sleep_ms,
+        "sleep_us": _sleep_us,
+    }
+    for name, func in helpers.items():
+        if not hasattr(time, name):
+            setattr(time, name, func)
@@ -0,0 +1,35 @@
+""" Simulated microsecond clock with the same interface as scheduler.Clock.
+
+Time only moves when something sleeps on it or calls advance(), so a
+Scheduler runs as fast as the host allows and its timing is deterministic.
+Code under test models its own execution time with advance().
+"""
+import asyncio
+
+class SimClock:
+    def __init__(self, start=0):
+        self.t = start
+        self.listeners = []  # Called with the elapsed microseconds whenever time moves, e.g. to step a plant model
+        self.sleeps = 0
+
+    def now(self):
+        return self.t
+
+    def diff(self, a, b):
+        return a - b
+
+    def add(self, t, delta):
+        return t + delta
+
+    def advance(self, us):
+        self.t += us
+        for listener in self.listeners:
+            listener(us)
+
+    def sleep(self, us):
+        self.sleeps += 1
+        self.advance(us)
+
+    async def sleep_async(self, us):
+        self.sleep(us)
+        await asyncio.sleep(0)
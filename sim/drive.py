@@ -0,0 +1,237 @@
+""" Differential-drive car model for running the car code faster than real time.
+
+Motor reads the PWM duty, PWM frequency and direction pins that
+Car.update_motor sets, and integrates wheel speed through every PWM pulse.
+The wheel sees full voltage while a pulse is on, and Coulomb friction
+against it, so low duty cycles stall (the deadband) and low PWM
+frequencies give harder kicks. DiffDrive turns the two wheel speeds into
+yaw, position and the raw readings an MPU6050 lying flat on the chassis
+would report on an inclined plane.
+
+Simulation wires a DiffDrive to a Car and an MPU6050 (through
+sim.mpu6050.FakeMPU6050 on the sim I2C bus) and swaps the time module's
+clock and sleeps for a SimClock while it is active. Sleeping advances the
+physics instead of waiting, so aim_up or spin_at_rate take seconds of
+simulated time and a fraction of that in wall time:
+
+    with Simulation(car, mpu, incline=10, uphill=90) as world:
+        main.aim_up()
+        print(world.drive.heading)
+"""
+import math
+import time
+import random
+from sim import machine
+from sim.clock import SimClock
+from sim.mpu6050 import FakeMPU6050
+
+G = 9.81
+ACCEL_SCALE = 16384  # LSB per g, ±2 g
+GYRO_SCALE = 131.0   # LSB per °/s, ±250 °/s
+
+class Motor:
+    """ One side: wheel ground speed in m/s driven by a PWM channel and two direction pins. """
+    def __init__(self, motor, top_speed=0.25, tau=0.05, deadband=0.2, stiction=1.5):
+        self.pwm, self.in1, self.in2 = motor
+        self.top_speed = top_speed            # Ground speed at 100% duty
+        self.tau = tau                        # Mechanical time constant in seconds
+        self.friction = deadband * top_speed / tau  # Coulomb deceleration that makes duty < deadband stall
+        self.stiction = stiction              # Breakaway force from rest, relative to friction
+        self.speed = 0.0
+
+    def drive(self, t):
+        """ Instantaneous voltage as a fraction of supply: -1, 0 or 1 depending on direction and PWM phase. """
+        mode = self.in1.value() | (self.in2.value() << 1)
+        if mode not in (1, 2):
+            return 0
+        on = (t * self.pwm.freq()) % 1 < self.pwm.duty() / 1023
+        return (1 if mode == 1 else -1) if on else 0
+
+    def step(self, t, dt):
+        accel = (self.drive(t) * self.top_speed - self.speed) / self.tau
+        if self.speed:
+            accel -= math.copysign(self.friction, self.speed)
+            new = self.speed + accel * dt
+            self.speed = 0.0 if new * self.speed < 0 else new  # Friction stops the wheel, it doesn't reverse it
+        elif abs(accel) > self.friction * self.stiction:
+            self.speed = (accel - math.copysign(self.friction, accel)) * dt
+
+class DiffDrive:
+    """ Chassis kinematics and IMU readings for a left/right Motor pair.
+
+    Body axes as in mpu6050.py: x right, y forward, z up. heading is the world
+    azimuth of +y in degrees, counter-clockwise; the plane rises toward
+    uphill degrees at incline degrees.
+    """
+    def __init__(self, left, right, track=0.14, incline=0.0, uphill=0.0, heading=0.0, vibration=0.0, gyro_noise=0.0, seed=0):
+        self.left = left
+        self.right = right
+        self.track = track
+        self.incline = incline
+        self.uphill = uphill
+        self.heading = heading
+        self.x = 0.0
+        self.y = 0.0
+        self.speed = 0.0
+        self.yaw_rate = 0.0       # °/s, counter-clockwise
+        self.accel = 0.0          # Forward acceleration, m/s²
+        self.vibration = vibration
+        self.gyro_noise = gyro_noise
+        self.rng = random.Random(seed)
+
+    def step(self, t, dt):
+        self.left.step(t, dt)
+        self.right.step(t, dt)
+        speed = (self.left.speed + self.right.speed) / 2
+        self.accel = (speed - self.speed) / dt
+        self.speed = speed
+        self.yaw_rate = math.degrees((self.right.speed - self.left.speed) / self.track)
+        self.heading = (self.heading + self.yaw_rate * dt) % 360
+        h = math.radians(self.heading)
+        self.x -= speed * math.sin(h) * dt
+        self.y += speed * math.cos(h) * dt
+
+    def up(self):
+        """ World up as a unit vector in body axes. """
+        a = math.radians(self.incline)
+        rel = math.radians(self.uphill - self.heading)
+        return -math.sin(a) * math.sin(rel), math.sin(a) * math.cos(rel), math.cos(a)
+
+    def imu_raw(self):
+        """ (Ax, Ay, Az, T, Gx, Gy, Gz) raw counts for the current state. """
+        ux, uy, uz = self.up()
+        uy += self.accel / G
+        shake = self.vibration * (abs(self.left.speed) + abs(self.right.speed)) / (self.left.top_speed + self.right.top_speed)
+        noise = self.rng.gauss if shake or self.gyro_noise else None
+        ax, ay, az = ux, uy, uz
+        gz = self.yaw_rate
+        gx = gy = 0.0
+        if noise:
+            ax += noise(0, shake)
+            ay += noise(0, shake)
+            az += noise(0, shake)
+            gx += noise(0, self.gyro_noise)
+            gy += noise(0, self.gyro_noise)
+            gz += noise(0, self.gyro_noise)
+        temp = int((25 - 36.53) * 340)
+        return (_clamp(ax * ACCEL_SCALE), _clamp(ay * ACCEL_SCALE), _clamp(az * ACCEL_SCALE), temp,
+                _clamp(gx * GYRO_SCALE), _clamp(gy * GYRO_SCALE), _clamp(gz * GYRO_SCALE))
+
+def _clamp(value):
+    return max(-32768, min(32767, int(value)))
+
+class Simulation:
+    """ Runs car code against a DiffDrive on simulated time; use as a context manager.
+
+    While active, time.sleep/sleep_ms/sleep_us advance the simulation,
+    time.time/ticks_ms/ticks_us read its clock (each read costs read_us of
+    simulated CPU time, so polling loops still make progress), and
+    machine.Timer callbacks fire on simulated time. The MPU's stored offsets
+    are zeroed for the run, since the model has no bias or mounting tilt.
+    left and right are Motor keyword arguments, to model mismatched motors.
+    """
+    def __init__(self, car, mpu, step_us=1000, read_us=20, left=None, right=None, **drive):
+        self.car = car
+        self.mpu = mpu
+        self.clock = SimClock()
+        self.clock.listeners.append(self._advance)
+        self.step_us = step_us
+        self.read_us = read_us
+        self.drive = DiffDrive(Motor(car.MtrA, **(left or {})), Motor(car.MtrB, **(right or {})), **drive)
+        self._raw = self.drive.imu_raw()
+        self.imu = FakeMPU6050(lambda t: self._raw)
+        self._pending = 0
+        self._stepping = False
+        self._timers = []
+        self._saved = {}
+
+    @property
+    def elapsed(self):
+        """ Simulated seconds since the start. """
+        return self.clock.now() / 1000000
+
+    def _advance(self, us):
+        self._pending += us
+        if self._stepping:
+            return  # A timer callback read the clock; the outer loop picks the time up
+        self._stepping = True
+        try:
+            self._steps()
+        finally:
+            self._stepping = False
+
+    def _steps(self):
+        while self._pending >= self.step_us:
+            self._pending -= self.step_us
+            t = (self.clock.now() - self._pending) / 1000000
+            self.drive.step(t, self.step_us / 1000000)
+            self._raw = self.drive.imu_raw()
+            self.imu.advance(self.step_us / 1000000)
+            self._fire_timers(t)
+
+    def _fire_timers(self, t):
+        now = t * 1000
+        for timer in list(self._timers):
+            entry = timer._virtual
+            if entry and now >= entry[0]:
+                due, period, mode, callback = entry
+                timer._virtual = (due + period, period, mode, callback) if mode == machine.Timer.PERIODIC else None
+                if timer._virtual is None:
+                    self._timers.remove(timer)
+                callback(timer)
+
+    def add_timer(self, timer, period, mode, callback):
+        timer._virtual = (self.clock.now() / 1000 + period, period, mode, callback)
+        if timer not in self._timers:
+            self._timers.append(timer)
+
+    def remove_timer(self, timer):
+        timer._virtual = None
+        if timer in self._timers:
+            self._timers.remove(timer)
+
+    def _sleep(self, us):
+        # One physics step at a time, so timer callbacks during a long sleep see the time they fire at
+        self.clock.sleeps += 1
+        while us > self.step_us:
+            self.clock.advance(self.step_us)
+            us -= self.step_us
+        self.clock.advance(us)
+
+    def _read(self):
+        self.clock.advance(self.read_us)
+        return self.clock.now()
+
+    def __enter__(self):
+        patches = {
+            "time": lambda: self._read() / 1000000,
+            "ticks_ms": lambda: self._read() // 1000,
+            "ticks_us": self._read,
+            "ticks_diff": lambda new, old: new - old,
+            "ticks_add": lambda ticks, delta: ticks + delta,
+            "sleep": lambda s: self._sleep(int(s * 1000000)),
+            "sleep_ms": lambda ms: self._sleep(int(ms * 1000)),
+            "sleep_us": lambda us: self._sleep(int(us)),
+        }
+        for name, func in patches.items():
+            self._saved[name] = getattr(time, name)
+            setattr(time, name, func)
+        self._saved["offsets"] = (self.mpu.gyro_offsets, self.mpu.tilt_offsets, self.mpu.i2c.devices.get(self.mpu.addr))
+        self.mpu.gyro_offsets = [0.0, 0.0, 0.0]
+        self.mpu.tilt_offsets = [0.0, 0.0]
+        self.mpu.i2c.attach(self.mpu.addr, self.imu)
+        machine.Timer.simulation = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        machine.Timer.simulation = None
+        for timer in list(self._timers):
+            self.remove_timer(timer)
+        gyro, tilt, device = self._saved.pop("offsets")
+        self.mpu.gyro_offsets = gyro
+        self.mpu.tilt_offsets = tilt
+        if device is not None:
+            self.mpu.i2c.attach(self.mpu.addr, device)
+        for name, func in self._saved.items():
+            setattr(time, name, func)
+        self._saved = {}
@@ -0,0 +1,159 @@
+""" Minimal stand-ins for machine.Pin/PWM/Timer/WDT/I2C. """
+import time
+import threading
+
+# Timer callbacks run holding this lock, so disable_irq() keeps them out like on the device
+_irq_lock = threading.RLock()
+
+def disable_irq():
+    _irq_lock.acquire()
+    return 0
+
+def enable_irq(state=0):
+    _irq_lock.release()
+
+class Pin:
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode=-1, value=0):
+        self.id = id
+        self.mode = mode
+        self._value = value
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = v
+
+class PWM:
+    def __init__(self, pin, freq=1000, duty=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        pass
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+    simulation = None  # Set by sim.drive.Simulation to fire callbacks on simulated time instead of a thread
+
+    def __init__(self, id=-1):
+        self.id = id
+        self._thread = None
+        self._stop = None
+        self._virtual = None
+
+    def init(self, period=1000, mode=PERIODIC, callback=None):
+        self.deinit()
+        if Timer.simulation:
+            Timer.simulation.add_timer(self, period, mode, callback)
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(period / 1000):
+                with _irq_lock:
+                    callback(self)
+                if mode == Timer.ONE_SHOT:
+                    break
+
+        self._stop = stop
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def deinit(self):
+        if self._virtual and Timer.simulation:
+            Timer.simulation.remove_timer(self)
+        if self._stop:
+            self._stop.set()
+            self._stop = None
+
+class WDT:
+    """ Watchdog that never resets: it records feeds and the longest gap between them, in ms.
+
+    Like the ESP8266 port its timeout is fixed, and any other is refused.
+    """
+    TIMEOUT = 5000
+
+    def __init__(self, id=0, timeout=None):
+        if timeout is not None and timeout != WDT.TIMEOUT:
+            raise ValueError("WDT timeout is fixed at %d ms on this port" % WDT.TIMEOUT)
+        self.timeout = WDT.TIMEOUT
+        self.feeds = 0
+        self.max_gap = 0
+        self._last = time.ticks_ms()
+
+    def feed(self):
+        now = time.ticks_ms()
+        self.max_gap = max(self.max_gap, time.ticks_diff(now, self._last))
+        self._last = now
+        self.feeds += 1
+
+    def starved(self):
+        """ Whether a real watchdog would have reset the board by now. """
+        return self.max_gap > self.timeout or time.ticks_diff(time.ticks_ms(), self._last) > self.timeout
+
+class I2C:
+    """ I2C bus of register-mapped devices that counts transactions.
+
+    Each device is a 128-byte register file; reads and writes auto-increment
+    the register address like the MPU6050 does. An address that was never
+    attached reads as a blank register file. Subclass devices override
+    read/write to model side effects.
+    """
+    def __init__(self, id=-1, scl=None, sda=None, freq=400000):
+        self.scl = scl
+        self.sda = sda
+        self.freq = freq
+        self.devices = {}
+        self.transactions = 0
+        self.bytes = 0
+
+    def attach(self, addr, device=None):
+        """ Put a device (anything with read(reg, n) and write(reg, data)) at addr; returns it. """
+        self.devices[addr] = device or RegisterDevice()
+        return self.devices[addr]
+
+    def _device(self, addr):
+        if addr not in self.devices:
+            self.attach(addr)
+        return self.devices[addr]
+
+    def writeto_mem(self, addr, reg, buf):
+        self.transactions += 1
+        self.bytes += len(buf)
+        self._device(addr).write(reg, bytes(buf))
+
+    def readfrom_mem(self, addr, reg, nbytes):
+        self.transactions += 1
+        self.bytes += nbytes
+        return self._device(addr).read(reg, nbytes)
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        self.transactions += 1
+        self.bytes += len(buf)
+        buf[:] = self._device(addr).read(reg, len(buf))
+
+class RegisterDevice:
+    """ Plain register file for I2C. """
+    def __init__(self, size=128):
+        self.registers = bytearray(size)
+
+    def read(self, reg, nbytes):
+        return bytes(self.registers[reg:reg + nbytes])
+
+    def write(self, reg, data):
+        self.registers[reg:reg + len(data)] = data
@@ -0,0 +1,97 @@
+""" Register-level model of an MPU6050, including the sample-rate divider and FIFO. """
+import math
+import struct
+from sim.machine import RegisterDevice
+
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+FIFO_EN = 0x23
+INT_STATUS = 0x3A
+ACCEL_XOUT = 0x3B
+USER_CTRL = 0x6A
+PWR_MGMT_1 = 0x6B
+FIFO_COUNT = 0x72
+FIFO_R_W = 0x74
+FIFO_SIZE = 1024
+DLPF_HZ = (256, 188, 98, 42, 20, 10, 5)  # Gyro bandwidth per CONFIG DLPF setting
+
+class FakeMPU6050(RegisterDevice):
+    """ Produces samples from signal(t) -> (Ax, Ay, Az, T, Gx, Gy, Gz) raw counts as time advances.
+
+    With the digital low-pass on (CONFIG 1-6) the signal is filtered at the
+    1 kHz gyro rate before sampling, first order at the setting's bandwidth.
+
+    Samples land in the data registers and, when enabled, in a 1024-byte FIFO
+    that behaves like the chip's: on overflow the oldest bytes are lost and
+    FIFO_OFLOW_INT is set until INT_STATUS is read.
+    """
+    def __init__(self, signal=None):
+        super().__init__()
+        self.signal = signal or (lambda t: (0, 0, 16384, 0, 0, 0, 0))
+        self.registers[PWR_MGMT_1] = 0x40  # Sleeping until woken
+        self.time = 0.0
+        self.next_sample = 0.0
+        self.next_tick = 0.0   # Next 1 kHz step of the low-pass, while DLPF is on
+        self.filtered = None
+        self.samples = 0
+        self.fifo = bytearray()
+        self._set_sample(self.signal(0.0))
+
+    @property
+    def sample_period(self):
+        dlpf = self.registers[CONFIG] & 0x07
+        gyro_rate = 8000 if dlpf in (0, 7) else 1000
+        return (self.registers[SMPLRT_DIV] + 1) / gyro_rate
+
+    def advance(self, seconds):
+        """ Move time forward, producing every sample due in the interval. """
+        end = self.time + seconds
+        dlpf = self.registers[CONFIG] & 0x07
+        if dlpf in (0, 7):
+            while self.next_sample <= end:
+                self._set_sample(self.signal(self.next_sample))
+                self.samples += 1
+                self.next_sample += self.sample_period
+        else:
+            # The low-pass runs at the 1 kHz gyro rate; the divider picks every (SMPLRT_DIV + 1)th output
+            alpha = 1 - math.exp(-2 * math.pi * DLPF_HZ[dlpf] / 1000)
+            self.next_tick = max(self.next_tick, self.time)
+            while self.next_tick <= end:
+                values = self.signal(self.next_tick)
+                if self.filtered is None:
+                    self.filtered = list(values)
+                else:
+                    for i in range(7):
+                        self.filtered[i] += alpha * (values[i] - self.filtered[i])
+                if self.next_sample <= self.next_tick:
+                    self._set_sample([int(round(v)) for v in self.filtered])
+                    self.samples += 1
+                    self.next_sample += self.sample_period
+                self.next_tick += 0.001
+        self.time = end
+
+    def _set_sample(self, values):
+        self.registers[ACCEL_XOUT:ACCEL_XOUT + 14] = struct.pack(">hhhhhhh", *values)
+        if self.registers[USER_CTRL] & 0x40 and self.registers[FIFO_EN] & 0xF8 == 0xF8:
+            self.fifo += self.registers[ACCEL_XOUT:ACCEL_XOUT + 14]
+            if len(self.fifo) > FIFO_SIZE:
+                del self.fifo[:len(self.fifo) - FIFO_SIZE]
+                self.registers[INT_STATUS] |= 0x10
+
+    def read(self, reg, nbytes):
+        if reg == FIFO_R_W:
+            data = bytes(self.fifo[:nbytes]).ljust(nbytes, b"\x00")
+            del self.fifo[:nbytes]
+            return data
+        if reg == FIFO_COUNT:
+            return struct.pack(">H", len(self.fifo))[:nbytes]
+        data = super().read(reg, nbytes)
+        if reg <= INT_STATUS < reg + nbytes:
+            self.registers[INT_STATUS] = 0
+        return data
+
+    def write(self, reg, data):
+        super().write(reg, data)
+        if reg == USER_CTRL and data[0] & 0x04:
+            self.fifo = bytearray()
+            self.registers[USER_CTRL] &= ~0x04 & 0xFF
@@ -0,0 +1,143 @@
+""" Stand-in for network.WLAN: joins instantly, or follows a scripted radio environment (Air). """
+STA_IF = 0
+AP_IF = 1
+AUTH_OPEN = 0
+AUTH_WPA_WPA2_PSK = 4
+
+# WLAN.status() values, numbered like the ESP8266 port
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = 2
+STAT_NO_AP_FOUND = 3
+STAT_CONNECT_FAIL = 4
+STAT_GOT_IP = 5
+
+class AccessPoint:
+    def __init__(self, ssid, bssid, channel=1, rssi=-60, password=""):
+        self.ssid = ssid
+        self.bssid = bssid
+        self.channel = channel
+        self.rssi = rssi
+        self.password = password
+        self.up = True
+
+class Air:
+    """ Access points in range and how long joining them takes, on a scheduler-style clock (us).
+
+    A join that names a BSSID on a known channel takes bssid_join_ms; one
+    that has to find the network first takes scan_ms more. drop() takes an
+    access point down, disconnecting whoever is on it.
+    """
+    def __init__(self, clock, access_points=(), scan_ms=2000, bssid_join_ms=600, auth_ms=900):
+        self.clock = clock
+        self.access_points = list(access_points)
+        self.scan_ms = scan_ms
+        self.bssid_join_ms = bssid_join_ms
+        self.auth_ms = auth_ms
+
+    def find(self, ssid, bssid=None):
+        """ The strongest access point that is up with this SSID (and BSSID, if given). """
+        found = [ap for ap in self.access_points if ap.up and ap.ssid == ssid and bssid in (None, ap.bssid)]
+        return max(found, key=lambda ap: ap.rssi) if found else None
+
+    def drop(self, bssid, up=False):
+        for ap in self.access_points:
+            if ap.bssid == bssid:
+                ap.up = up
+
+    def ms(self):
+        return self.clock.now() // 1000
+
+class WLAN:
+    def __init__(self, interface=STA_IF, air=None):
+        self.interface = interface
+        self.air = air
+        self._active = False
+        self._connected = False
+        self._config = {"ssid": "", "essid": ""}
+        self._join = None  # (ready at ms, AccessPoint or None, status if it fails)
+        self._ap = None    # AccessPoint joined
+        self._status = STAT_IDLE
+        self.connects = 0
+        self.scans = 0
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = is_active
+        if not is_active:
+            self.disconnect()
+
+    def connect(self, ssid=None, password=None, bssid=None):
+        self._config["ssid"] = ssid
+        self.connects += 1
+        if self.air is None:
+            self._connected = True
+            return
+        air = self.air
+        self._connected = False
+        self._ap = None
+        self._status = STAT_CONNECTING
+        ap = air.find(ssid, bssid)
+        if ap is None:
+            # Nothing to join (or not the named BSSID): the driver gives up after a scan for it
+            self._join = (air.ms() + air.scan_ms, None, STAT_NO_AP_FOUND)
+        elif ap.password != (password or ""):
+            self._join = (air.ms() + air.scan_ms + air.auth_ms, None, STAT_WRONG_PASSWORD)
+        else:
+            took = air.bssid_join_ms if bssid is not None else air.scan_ms + air.auth_ms
+            self._join = (air.ms() + took, ap, STAT_GOT_IP)
+
+    def disconnect(self):
+        self._connected = False
+        self._join = None
+        self._ap = None
+        self._status = STAT_IDLE
+
+    def _update(self):
+        if self.air is None:
+            return
+        if self._join and self.air.ms() >= self._join[0]:
+            _, ap, status = self._join
+            self._join = None
+            self._status = status
+            self._ap = ap if ap and ap.up else None
+            self._connected = self._ap is not None
+            if ap and not ap.up:
+                self._status = STAT_NO_AP_FOUND
+        if self._connected and not self._ap.up:
+            self._connected = False
+            self._ap = None
+            self._status = STAT_IDLE
+
+    def isconnected(self):
+        self._update()
+        return self._connected
+
+    def status(self, param=None):
+        if param == "rssi" and self.interface == STA_IF:
+            self._update()
+            return self._ap.rssi if self._ap else 0
+        if param is not None:
+            raise ValueError("unknown status param")  # Like the ESP8266 port, which has no "stations"
+        self._update()
+        return self._status if self.air else (STAT_GOT_IP if self._connected else STAT_IDLE)
+
+    def scan(self):
+        """ (ssid, bssid, channel, RSSI, authmode, hidden) per access point in range; blocks for a scan. """
+        self.scans += 1
+        if self.air is None:
+            return []
+        self.air.clock.sleep(self.air.scan_ms * 1000)
+        return [(ap.ssid.encode(), ap.bssid, ap.channel, ap.rssi, AUTH_WPA_WPA2_PSK if ap.password else AUTH_OPEN, False)
+                for ap in self.air.access_points if ap.up]
+
+    def ifconfig(self):
+        if self.interface == AP_IF:
+            return ("192.168.4.1", "255.255.255.0", "192.168.4.1", "192.168.4.1")
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config.get(args[0])
+        self._config.update(kwargs)
@@ -0,0 +1,4 @@
+""" Stand-in for ntptime; the host clock is already synced. """
+
+def settime():
+    pass
@@ -0,0 +1,107 @@
+import time
+import asyncio
+import ustruct
+
+# One record: seq, ticks_ms, gyro x/y/z (centi-dps), roll/pitch (centi-degrees),
+# throttle/steering (thousandths), signed left/right duty (0-1023, negative in reverse)
+RECORD_FORMAT = "<HIhhhhhhhhh"
+RECORD_SIZE = ustruct.calcsize(RECORD_FORMAT)
+FIELDS = ("seq", "ms", "gx", "gy", "gz", "roll", "pitch", "throttle", "steering", "left", "right")
+SCALES = (1, 1, 100, 100, 100, 100, 100, 1000, 1000, 1, 1)
+
+def _clamp16(value):
+    return max(-32768, min(32767, int(value)))
+
+def _signed_duty(motor):
+    """ Duty of a Car motor tuple, negated when its direction pins select reverse. """
+    pwm, in1, in2 = motor
+    return -pwm.duty() if in2.value() and not in1.value() else pwm.duty()
+
+class Telemetry:
+    """ Samples IMU and motor state into a fixed-size ring of packed binary records.
+
+    The sampler never waits on readers: once the ring is full the oldest record
+    is overwritten, and each TelemetryReader notices the gap and counts it as
+    dropped. Readers copy records out, so a slow client only loses history.
+    """
+    def __init__(self, mpu, car, capacity=128):
+        self.mpu = mpu
+        self.car = car
+        self.capacity = capacity
+        self.ring = bytearray(capacity * RECORD_SIZE)
+        self.view = memoryview(self.ring)
+        self.written = 0  # Total records ever written; slot is written % capacity
+
+    def sample(self):
+        """ Take one sample and pack it into the next ring slot. """
+        avel, tilt = self.mpu.get_motion()  # One I2C burst for both
+        gx, gy, gz, _ = avel
+        roll, pitch, _ = tilt
+        car = self.car
+        ustruct.pack_into(RECORD_FORMAT, self.ring, (self.written % self.capacity) * RECORD_SIZE,
+                          self.written & 0xFFFF, time.ticks_ms() & 0xFFFFFFFF,
+                          _clamp16(gx * 100), _clamp16(gy * 100), _clamp16(gz * 100),
+                          _clamp16(roll * 100), _clamp16(pitch * 100),
+                          _clamp16(car.throttle * 1000), _clamp16(car.steering * 1000),
+                          _signed_duty(car.MtrA), _signed_duty(car.MtrB))
+        self.written += 1
+
+    async def run(self, interval=20):
+        """ Sample every interval milliseconds, as an asyncio task. """
+        while True:
+            self.sample()
+            await asyncio.sleep(interval / 1000)
+
+    def reader(self):
+        """ Return a reader positioned at the oldest record still in the ring. """
+        return TelemetryReader(self)
+
+    async def stream(self, ws, request, interval=50, batch=16):
+        """ WebSocket handler: send batches of records as binary messages until the client leaves. """
+        reader = self.reader()
+        out = bytearray(batch * RECORD_SIZE)
+        mv = memoryview(out)
+        # One task reads the socket for the whole connection, answering pings and noticing the
+        # close; a recv() cancelled by a timeout partway through a frame would leave it out of step
+        incoming = asyncio.create_task(self._discard(ws))
+        try:
+            while not ws.closed:
+                count = reader.read_into(out)
+                if count:
+                    await ws.send(mv[:count * RECORD_SIZE])
+                else:
+                    await asyncio.sleep(interval / 1000)  # Caught up
+        finally:
+            incoming.cancel()
+
+    async def _discard(self, ws):
+        # Clients have nothing to say on this socket; recv() handles pings and the close
+        while await ws.recv() is not None:
+            pass
+
+class TelemetryReader:
+    """ Independent read position into a Telemetry ring. """
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self.pos = max(0, telemetry.written - telemetry.capacity)
+        self.dropped = 0
+
+    def read_into(self, buf):
+        """ Copy as many unread records as fit into buf, oldest first; returns the record count. """
+        tel = self.telemetry
+        oldest = tel.written - tel.capacity
+        if self.pos < oldest:
+            # The sampler lapped us: skip what was overwritten
+            self.dropped += oldest - self.pos
+            self.pos = oldest
+        count = min(tel.written - self.pos, len(buf) // RECORD_SIZE)
+
+        # At most two contiguous copies: up to the end of the ring, then from its start
+        out = memoryview(buf)
+        start = self.pos % tel.capacity
+        first = min(count, tel.capacity - start)
+        out[:first * RECORD_SIZE] = tel.view[start * RECORD_SIZE:(start + first) * RECORD_SIZE]
+        if count > first:
+            out[first * RECORD_SIZE:count * RECORD_SIZE] = tel.view[:(count - first) * RECORD_SIZE]
+        self.pos += count
+        return count
@@ -0,0 +1,132 @@
+""" PWM/pin register writes and CPU time per control update: old Car.update_motors against change detection.
+
+A control update is what main does per received command: the old code set
+throttle, then steering (two full motor updates, each logging two lines);
+the new code calls car.set() once and skips unchanged writes. Counting
+PWM and Pin stand-ins record every write. Command streams: the UI's 1 s
+heartbeat resending the same values, a joystick sweep, and random jumps.
+Also checks that both leave the outputs in the same state.
+
+Usage: python tools/bench_car.py [--updates 2000]
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import car as car_module
+from car import Car, set_mode, set_speed
+
+class CountingPWM:
+    writes = 0
+
+    def __init__(self, pin, freq=1000, duty=0):
+        self._freq = freq
+        self._duty = duty
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        CountingPWM.writes += 1
+        self._freq = f
+
+    def duty(self, d=None):
+        if d is None:
+            return self._duty
+        CountingPWM.writes += 1
+        self._duty = d
+
+class CountingPin:
+    OUT = 1
+
+    def __init__(self, id, mode=-1, value=0):
+        self._value = value
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        CountingPWM.writes += 1
+        self._value = v
+
+class OldCar(Car):
+    """ Car.update_motors/update_motor before change detection. """
+    def update_motors(self):
+        left_speed = max(-1, min(1, self._throttle * (1 - abs(self._steering)) + self._steering))
+        right_speed = max(-1, min(1, self._throttle * (1 - abs(self._steering)) - self._steering))
+        self.update_motor(self.MtrA, left_speed)
+        self.update_motor(self.MtrB, right_speed)
+
+    def update_motor(self, motor, throttle, force_freq=False):
+        speed = abs(throttle)
+        mode = 0 if throttle == 0 else (1 if throttle > 0 else 2)
+        new_freq = max(self.min_freq, int(self.max_freq * speed))
+        motor[0].freq(new_freq)
+        set_mode(mode, motor)
+        set_speed(speed, motor)
+        print("left" if motor == self.MtrA else "right", "speed:", speed, "mode:", mode, "freq:", new_freq)
+
+def old_update(car, t, s):
+    car.throttle = t
+    car.steering = s
+
+def new_update(car, t, s):
+    car.set(t, s)
+
+def streams(n, rng):
+    heartbeat = [(0.5, 0.2)] * n
+    sweep = [(round(0.6 * ((i // 50) % 2), 3), round((i % 200) / 100 - 1, 2)) for i in range(n)]
+    jumps = [(round(rng.uniform(-1, 1), 3), round(rng.uniform(-1, 1), 3)) for _ in range(n)]
+    return (("heartbeat (same command)", heartbeat), ("joystick sweep", sweep), ("random jumps", jumps))
+
+def outputs(car):
+    return [(m[0]._freq, m[0]._duty, m[1]._value, m[2]._value) for m in (car.MtrA, car.MtrB)]
+
+def run(make, update, commands):
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        car = make()
+        constructed = log.tell()  # Only count what the updates log
+        counted = car.writes
+        CountingPWM.writes = 0
+        start = time.perf_counter()
+        for t, s in commands:
+            update(car, t, s)
+        elapsed = time.perf_counter() - start
+    if not isinstance(car, OldCar):
+        assert car.writes - counted == CountingPWM.writes, "Car.writes should match the counted writes"
+    lines = log.getvalue()[constructed:].count("\n")
+    return CountingPWM.writes / len(commands), elapsed / len(commands) * 1e6, lines / len(commands), outputs(car)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+    car_module.PWM = CountingPWM
+    car_module.Pin = CountingPin
+
+    print("%-26s %-6s %14s %10s %14s" % ("commands", "car", "writes/update", "us/update", "lines logged"))
+    for name, commands in streams(args.updates, random.Random(1)):
+        old = run(OldCar, old_update, commands)
+        new = run(Car, new_update, commands)
+        for label, result in (("old", old), ("new", new)):
+            print("%-26s %-6s %14.2f %10.1f %14.1f" % (name, label, result[0], result[1], result[2]))
+        assert old[3] == new[3], "final outputs differ: %r vs %r" % (old[3], new[3])
+        assert new[0] < old[0] / 2 and new[2] == 0
+
+    # Pins driven directly (motor_test) are rewritten by stop()
+    with contextlib.redirect_stdout(io.StringIO()):
+        car = Car()
+        car.set(0.5, 0)
+        set_mode(2, car.MtrA)
+        set_speed(0.9, car.MtrA)
+        car.stop()
+    assert outputs(car)[0][1:] == (0, 0, 0), outputs(car)
+    print("outputs match; stop() rewrites outputs driven outside Car")
+
+if __name__ == "__main__":
+    main()
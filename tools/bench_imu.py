@@ -0,0 +1,86 @@
+""" Bus transactions per fused IMU sample: separate accel/gyro reads against the 14-byte burst.
+
+A fake MPU6050 on a transaction-counting I2C bus produces a new sample after
+every transaction, so the benchmark also shows whether the accel and gyro
+halves of a fused sample came from the same measurement.
+
+Usage: python tools/bench_imu.py [--samples 1000]
+"""
+import os
+import sys
+import time
+import struct
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+from sim.machine import I2C, RegisterDevice
+from mpu6050 import MPU6050
+
+class SteppingMPU(RegisterDevice):
+    """ Writes sample number n into every accel and gyro axis, and advances n after each read. """
+    def __init__(self):
+        super().__init__()
+        self.n = 0
+        self._fill()
+
+    def _fill(self):
+        self.registers[0x3B:0x49] = struct.pack(">hhhhhhh", self.n, self.n, 16384, 0, self.n, self.n, self.n)
+
+    def read(self, reg, nbytes):
+        data = super().read(reg, nbytes)
+        self.n += 1
+        self._fill()
+        return data
+
+def bus_time_us(transactions, nbytes, freq=400000):
+    """ Approximate I2C time: start, address+W, register, restart, address+R, data, stop. """
+    bits = transactions * (4 * 9 + 2) + nbytes * 9
+    return bits * 1e6 / freq
+
+def run(name, mpu, bus, fused, samples):
+    bus.transactions = bus.bytes = 0
+    skewed = 0
+    start = time.perf_counter()
+    for _ in range(samples):
+        accel_n, gyro_n = fused(mpu)
+        skewed += accel_n != gyro_n
+    elapsed = time.perf_counter() - start
+    print("%-28s %8.2f %8.1f %12.1f %9d %10.1f" % (name, bus.transactions / samples, bus.bytes / samples,
+                                                   bus_time_us(bus.transactions, bus.bytes) / samples,
+                                                   skewed, elapsed / samples * 1e6))
+
+def separate_raw(mpu):
+    ax, _, _ = mpu.read_accel_raw()
+    gx, _, _ = mpu.read_gyro_raw()
+    return ax, gx
+
+def separate_getters(mpu):
+    # get_avel() then get_tilt(): each does its own burst
+    mpu.get_avel()
+    mpu.get_tilt()
+    return mpu.i2c.devices[0x68].n - 2, mpu.i2c.devices[0x68].n - 1
+
+def burst(mpu):
+    raw = mpu.read_all_raw()
+    mpu.get_avel(raw)
+    mpu.get_tilt(raw)
+    return raw[0], raw[4]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    bus = I2C()
+    bus.attach(0x68, SteppingMPU())
+    mpu = MPU6050(bus)
+
+    print("%-28s %8s %8s %12s %9s %10s" % ("fused sample via", "xfers", "bytes", "bus (us est)", "skewed", "cpu (us)"))
+    run("read_accel_raw+read_gyro_raw", mpu, bus, separate_raw, args.samples)
+    run("get_avel() + get_tilt()", mpu, bus, separate_getters, args.samples)
+    run("read_all_raw (get_motion)", mpu, bus, burst, args.samples)
+
+if __name__ == "__main__":
+    main()
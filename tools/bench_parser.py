@@ -0,0 +1,139 @@
+""" Microbenchmark: HttpRequest against the old regex-based parse_http_request.
+
+The corpus mirrors requests captured from the joystick UI (Chrome and Firefox
+fetches, with and without both parameters) plus a few odd ones. Also checks
+that header names match in any case, including a Content-Length behind a
+header whose name ends in "length".
+
+Usage: python tools/bench_parser.py [--rounds 2000]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import web
+
+CHROME = ("GET /ctrl?{q} HTTP/1.1\r\n"
+          "Host: 192.168.137.36\r\n"
+          "Connection: keep-alive\r\n"
+          "User-Agent: Mozilla/5.0 (Linux; Android 14; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Mobile Safari/537.36\r\n"
+          "Accept: */*\r\n"
+          "Origin: null\r\n"
+          "Accept-Encoding: gzip, deflate\r\n"
+          "Accept-Language: en-US,en;q=0.9\r\n\r\n")
+FIREFOX = ("GET /ctrl?{q} HTTP/1.1\r\n"
+           "Host: 192.168.137.36\r\n"
+           "User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0\r\n"
+           "Accept: */*\r\n"
+           "Accept-Language: en-US,en;q=0.5\r\n"
+           "Accept-Encoding: gzip, deflate\r\n"
+           "Origin: null\r\n"
+           "Connection: keep-alive\r\n\r\n")
+QUERIES = ["t=0.25&s=0", "s=-0.1", "t=-0.5", "s=0.35&t=0.1", "t=1&s=-1", "t=0"]
+CORPUS = [tmpl.format(q=q).encode() for tmpl in (CHROME, FIREFOX) for q in QUERIES]
+CORPUS.append(b"GET /ctrl?t=0.3 HTTP/1.1\n\n")
+CORPUS.append(b"GET /missing HTTP/1.1\r\nHost: car\r\n\r\n")
+
+def old_parse_http_request(http_request):
+    """ The regex-based parser as it was before HttpRequest. """
+    parts = http_request.split('\n\n', 1)
+    headers = parts[0]
+    body = parts[1] if len(parts) > 1 else ''
+    method_match = re.search(r'^(\w+)', headers)
+    endpoint_match = re.search(r'^\w+\s+([^?\s]+)', headers)
+    params_match = re.search(r'\?([^?\s]+)\s', headers)
+    params_string = params_match.group(1) if params_match else None
+    params = {}
+    if params_string:
+        for param in params_string.split('&'):
+            key, value = param.split('=')
+            params[key] = value
+    return {
+        'method': method_match.group(1) if method_match else None,
+        'endpoint': endpoint_match.group(1) if endpoint_match else None,
+        'params': params,
+        'body': body if body != '' else None
+    }
+
+def run_old(data):
+    request = old_parse_http_request(data.decode())
+    params = request['params']
+    return float(params.get('t', 0)), float(params.get('s', 0))
+
+def make_run_new():
+    request = web.HttpRequest()
+
+    def run_new(data):
+        request.reset()
+        request.feed(data)
+        return request.param_float(b't', 0), request.param_float(b's', 0)
+    return run_new
+
+def bench(func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in CORPUS:
+            func(data)
+    return (time.perf_counter() - start) / (rounds * len(CORPUS))
+
+def allocations(func):
+    tracemalloc.start()
+    for data in CORPUS:
+        func(data)
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    for data in CORPUS:
+        func(data)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+def check_split(run_new):
+    """ Feeding each request one byte at a time must give the same result. """
+    request = web.HttpRequest()
+    for data in CORPUS:
+        request.reset()
+        complete = False
+        for i in range(len(data)):
+            complete = request.feed(data[i:i + 1])
+        assert complete, data
+        assert (request.param_float(b't', 0), request.param_float(b's', 0)) == run_new(data), data
+
+def check_headers():
+    """ Header names in any case; only a whole Content-Length name counts, wherever it is. """
+    request = web.HttpRequest()
+    pipelined = (b"POST /ctrl?t=0.1 HTTP/1.1\r\nX-Max-Length: 5\r\ncontent-LENGTH: 2\r\n\r\nokGET /ctrl?t=0.2 HTTP/1.1\r\n\r\n")
+    assert request.feed(pipelined) and request.body == "ok", request.body
+    assert request.header(b"X-MAX-LENGTH") == b"5" and request.header(b"Content-Length") == b"2"
+    assert request.next() and request.param_float(b't') == 0.2, "pipelined request after the body"
+    request.reset()
+    request.feed(b"GET /ws HTTP/1.1\r\nHost: car\r\nUpgrade: websocket\r\nSec-Websocket-Key: abc==\r\n\r\n")
+    assert request.header(b"Sec-WebSocket-Key") == b"abc==" and request.header(b"upgrade") == b"websocket"
+    assert request.header(b"Key") is None and request.header(b"Host:") is None and request.end == request.header_end
+    print("headers ok: names in any case, Content-Length found past X-Max-Length")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    run_new = make_run_new()
+    for data in CORPUS:
+        assert run_old(data) == run_new(data), data
+    check_split(run_new)
+    check_headers()
+
+    old = bench(run_old, args.rounds)
+    new = bench(run_new, args.rounds)
+    print("%-22s %12s %16s" % ("parser", "us/request", "peak alloc (B)"))
+    print("%-22s %12.2f %16d" % ("regex (old)", old * 1e6, allocations(run_old)))
+    print("%-22s %12.2f %16d" % ("HttpRequest", new * 1e6, allocations(run_new)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+""" Allocation and throughput benchmark for the ctrl endpoint response path.
+
+Compares the old string-concatenation response (ujson.dumps plus str
+headers) with web.Response, for the same parsed ctrl requests.
+
+Usage: python tools/bench_response.py [--rounds 20000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import web
+
+REQUESTS = [("GET /ctrl?t=%.2f&s=%.2f HTTP/1.1\r\nHost: car\r\n\r\n" % (t / 20, -t / 40)).encode() for t in range(-20, 21)]
+state = {"t": 0.0, "s": 0.0}
+
+def receive_state(r):
+    state["t"] = r.param_float(b't', state["t"])
+    state["s"] = r.param_float(b's', state["s"])
+    return {"t": state["t"], "s": state["s"]}
+
+endpoints = {"ctrl": receive_state}
+
+def old_response(request):
+    """ The response path as it was before web.Response. """
+    result = endpoints[request.find_endpoint(endpoints)](request)
+    body = json.dumps(result)
+    response = ("HTTP/1.1 200 OK\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Connection: keep-alive\r\n"
+                "Content-Length: " + str(len(body)) + "\r\n\r\n" +
+                body)
+    return response.encode()
+
+def make_new_response():
+    response = web.Response()
+
+    def new_response(request):
+        return web.handle_request(request, endpoints, response)
+    return new_response
+
+def parsed_requests():
+    parsed = []
+    for data in REQUESTS:
+        request = web.HttpRequest()
+        request.feed(data)
+        parsed.append(request)
+    return parsed
+
+def throughput(func, requests, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for request in requests:
+            func(request)
+    return rounds * len(requests) / (time.perf_counter() - start)
+
+def allocations(func, requests):
+    """ Largest transient heap growth (bytes) while building a single response. """
+    tracemalloc.start()
+    worst = 0
+    for request in requests:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(request)
+        worst = max(worst, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000 // len(REQUESTS))
+    args = parser.parse_args()
+
+    requests = parsed_requests()
+    new_response = make_new_response()
+    for request in requests:
+        old = old_response(request).split(b"\r\n\r\n")[1]
+        new = bytes(new_response(request)).split(b"\r\n\r\n")[1]
+        assert json.loads(old) == json.loads(new), (old, new)
+
+    # Long keys with the longest values: must fit exactly or fall back to ujson, never overrun the buffer
+    for size in range(web._BODY + 2, 400):
+        response = web.Response(size)
+        for n in range(1, 12):
+            result = {"k%015d" % i: -999999999.9999 if i % 2 else -999999999 for i in range(n)}
+            body = bytes(response.write(result)).split(b"\r\n\r\n")[1]
+            assert json.loads(body) == result, (size, n, body)
+            assert len(response.buf) == size
+
+    print("%-22s %14s %18s" % ("response path", "responses/s", "alloc/resp (B)"))
+    for name, func in (("str + ujson (old)", old_response), ("web.Response", new_response)):
+        print("%-22s %14.0f %18d" % (name, throughput(func, requests, args.rounds), allocations(func, requests)))
+
+if __name__ == "__main__":
+    main()
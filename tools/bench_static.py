@@ -0,0 +1,167 @@
+""" Bytes on the wire and peak heap for a page load of the packed UI from the car's web server.
+
+Serves ui/index_packed.html three ways over loopback: read whole into RAM
+and returned by a handler (what an endpoint returning the page would do),
+streamed as www/ui.html.gz by web.StaticFile, and revalidated with
+If-None-Match (304). Bytes are counted by a loopback client. Peak heap is
+traced around the server's own response path (handle_request, or
+StaticFile.serve into a writer that discards), since CPython's socket
+transport reads into a 256 KiB buffer that would hide it; both StaticFile
+rows include the ~5 KB of the asyncio.run that drives serve(). Also checks the
+blocking server's StaticFile path, and that the body unzips to the page.
+Host heap numbers are CPython's; on the ESP8266 the whole-file path needs
+the page plus the response as contiguous blocks, more than its free heap.
+
+Usage: python tools/bench_static.py [--loads 20]
+"""
+import os
+import sys
+import gzip
+import socket
+import asyncio
+import argparse
+import threading
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+import sim
+sim.install()
+import web
+
+PAGE = "ui/index_packed.html"
+ARTIFACT = "www/ui.html.gz"
+
+def whole_page(request):
+    with open(PAGE, "rb") as f:
+        return f.read()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def load(port, path, headers=b"", keep=False):
+    """ GET path; returns (bytes received, header block, body if keep). """
+    buf = bytearray(4096)
+    mv = memoryview(buf)
+    body = bytearray() if keep else None
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: car\r\nAccept-Encoding: gzip, deflate\r\n" + headers + b"\r\n")
+        received = 0
+        head = b""
+        length = None
+        while length is None or received < len(head) + length:
+            n = s.recv_into(buf)
+            if not n:
+                break
+            if length is None:
+                head += bytes(mv[:n])
+                end = head.find(b"\r\n\r\n")
+                if end >= 0:
+                    length = 0
+                    for line in head[:end].split(b"\r\n"):
+                        if line.lower().startswith(b"content-length:"):
+                            length = int(line[15:])
+                    if keep:
+                        body += head[end + 4:]
+                    head = head[:end + 4]
+            elif keep:
+                body += mv[:n]
+            received += n
+    return received, head, body
+
+class NullWriter:
+    """ asyncio StreamWriter that drops what it's given. """
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+def parse(path, headers=b""):
+    request = web.HttpRequest()
+    assert request.feed(b"GET " + path + b" HTTP/1.1\r\nHost: car\r\nAccept-Encoding: gzip, deflate\r\n" + headers + b"\r\n")
+    return request
+
+def peak_heap(endpoints, path, headers=b"", loads=20):
+    """ Largest heap peak (bytes) of the server producing one response. """
+    request = parse(path, headers)
+    response = web.Response()
+    handler = endpoints[request.find_endpoint(endpoints)]
+    writer = NullWriter()
+
+    def serve():
+        if isinstance(handler, web.StaticFile):
+            asyncio.run(handler.serve(writer, request))
+        else:
+            handle_request(request, endpoints, response)
+
+    serve()  # Warm up
+    tracemalloc.start()
+    peak = 0
+    for _ in range(loads):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        serve()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return peak
+
+def handle_request(request, endpoints, response):
+    # Keep the response alive until it has been "sent", like the server does
+    return bytes(web.handle_request(request, endpoints, response))
+
+def serve_async(endpoints, port):
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(web.start_async_webserver(endpoints, "127.0.0.1", port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loads", type=int, default=20)
+    args = parser.parse_args()
+
+    static = web.StaticFile(ARTIFACT)
+    endpoints = {"": static, "page": whole_page}
+    rows = (("whole page in RAM, uncompressed", b"/page", b""),
+            ("StaticFile, gzip, 512 B chunks", b"/", b""),
+            ("StaticFile, If-None-Match (304)", b"/", b"If-None-Match: " + static.etag + b"\r\n"))
+    # Heap first, while no server thread is allocating alongside
+    peaks = [peak_heap(endpoints, path, headers, args.loads) for _, path, headers in rows]
+    port = free_port()
+    serve_async(endpoints, port)
+
+    with open(PAGE, "rb") as f:
+        page = f.read()
+    _, head, body = load(port, b"/", keep=True)
+    assert b"Content-Encoding: gzip" in head and static.etag in head and b"max-age=" in head
+    assert gzip.decompress(body) == page, "www/ui.html.gz is stale; run ui/html_packer.py"
+    etag = rows[2][2]
+
+    print("%-34s %12s %16s" % ("page load", "bytes sent", "peak heap (B)"))
+    results = []
+    for (name, path, headers), peak in zip(rows, peaks):
+        received, head, _ = load(port, path, headers)
+        results.append((received, peak, head))
+        print("%-34s %12d %16d" % (name, received, peak))
+    (whole, whole_peak, _), (gz, gz_peak, _), (cached, _, cached_head) = results
+    assert cached_head.startswith(b"HTTP/1.1 304") and cached == len(cached_head)
+    assert gz < whole / 3 and gz_peak < whole_peak / 4
+
+    # The blocking server streams through StaticFile.send
+    port = free_port()
+    threading.Thread(target=web.start_webserver, args=(endpoints, port), daemon=True).start()
+    for _ in range(100):
+        try:
+            _, head, body = load(port, b"/", keep=True)
+            break
+        except OSError:
+            threading.Event().wait(0.01)
+    assert gzip.decompress(body) == page
+    assert load(port, b"/", etag)[1].startswith(b"HTTP/1.1 304")
+    print("blocking server serves the same artifact; static serving ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+""" Per-sample cost of averager.StreamingStats against the old MeasurementAverager accumulator.
+
+Feeds scalar samples (yaw rate) and 4-tuples (get_avel) through both, and
+also checks the new statistics against a direct computation.
+
+Usage: python tools/bench_stats.py [--samples 100000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+from averager import StreamingStats
+
+class OldAccumulator:
+    """ The accumulation step of MeasurementAverager before StreamingStats. """
+    def __init__(self):
+        self._sum = None
+        self._count = 0
+
+    def add(self, sample):
+        if self._sum is None:
+            self._sum = sample
+        else:
+            if isinstance(sample, tuple):
+                self._sum = tuple(s + v for s, v in zip(self._sum, sample))
+            else:
+                self._sum += sample
+        self._count += 1
+
+def per_sample(acc, samples):
+    start = time.perf_counter()
+    for sample in samples:
+        acc.add(sample)
+    return (time.perf_counter() - start) / len(samples) * 1e6
+
+def alloc_per_sample(make, samples):
+    acc = make()
+    for sample in samples[:10]:
+        acc.add(sample)
+    tracemalloc.start()
+    worst = 0
+    for sample in samples[10:1000]:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        acc.add(sample)
+        worst = max(worst, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return worst
+
+def check(samples):
+    stats = StreamingStats(1, window=50, alpha=0.2)
+    for x in samples:
+        stats.add(x)
+    assert abs(stats.mean() - statistics.fmean(samples)) < 1e-3
+    assert abs(stats.variance() - statistics.variance(samples)) < 1e-2 * statistics.variance(samples)
+    assert stats.min() == min(samples) or abs(stats.min() - min(samples)) < 1e-5
+    assert abs(stats.window_mean() - statistics.fmean(samples[-50:])) < 1e-3
+    ema = samples[0]
+    for x in samples[1:]:
+        ema += 0.2 * (x - ema)
+    assert abs(stats.ema() - ema) < 1e-3
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=100000)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    scalars = [rng.gauss(9, 3) for _ in range(args.samples)]
+    tuples = [(rng.gauss(0, 1), rng.gauss(0, 1), x, abs(x)) for x in scalars]
+    check(scalars[:5000])
+
+    print("%-40s %10s %14s" % ("accumulator", "us/sample", "alloc/sample"))
+    rows = [
+        ("old, scalar (sum only)", OldAccumulator, scalars),
+        ("old, 4-tuple (sum only)", OldAccumulator, tuples),
+        ("StreamingStats, scalar (all stats)", lambda: StreamingStats(1), scalars),
+        ("StreamingStats, 4-tuple (all stats)", lambda: StreamingStats(4), tuples),
+        ("StreamingStats, 4-tuple + 50 window", lambda: StreamingStats(4, window=50), tuples),
+    ]
+    for name, make, samples in rows:
+        print("%-40s %10.2f %13dB" % (name, per_sample(make(), samples), alloc_per_sample(make, samples)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+""" Host-side boot profile: import cost, lazy hardware construction and startup-to-first-control time.
+
+Imports every device module the way boot.py and main.py do, checks that none
+of them touches hardware at import (no Car, MPU6050, WLAN or server socket
+until first use), then runs main.main() on a loopback port and sends one
+ctrl request, so the boottime report covers the hardware constructors, Wi-Fi,
+the server starting to listen and the first control packet. Host timings only
+show relative cost; run boot.py on the car for real numbers.
+
+Usage: python tools/boot_profile.py
+"""
+import os
+import sys
+import time
+import socket
+import threading
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # wifi.txt and calib.bin are opened relative to the working directory
+import sim
+sim.install()
+import boottime
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def main():
+    for name in ("instrument", "scheduler", "averager", "calibration", "calstore", "car", "mpu6050", "telemetry", "pid", "failsafe", "gyrobias", "odometry", "main"):
+        boottime.timed_import(name)
+    import car
+    import mpu6050
+    import main as app
+    assert car._car is None and mpu6050._mpu is None, "importing main must not construct hardware"
+    assert "web" not in sys.modules, "main should import web only when the server starts"
+    print("lazy imports ok: no hardware constructed and web not imported by 'import main'")
+
+    # Serve on a loopback port instead of 80 (main's own import of web is then free)
+    web = boottime.timed_import("web")
+    assert web._wlan is None and web.server_socket is None
+    port = free_port()
+    run_webserver = web.run_webserver
+    web.run_webserver = lambda endpoints, tasks=(), port=port: run_webserver(endpoints, tasks, port)
+    decoded = []  # Requests turned into strings, e.g. to print them: the ctrl path must not
+    to_str = web.HttpRequest.__str__
+    web.HttpRequest.__str__ = lambda request: decoded.append(1) or to_str(request)
+    threading.Thread(target=app.main, daemon=True).start()
+
+    for _ in range(200):
+        try:
+            urllib.request.urlopen("http://127.0.0.1:%d/ctrl?t=0&s=0.1" % port, timeout=1).read()
+            break
+        except OSError:
+            time.sleep(0.01)
+    else:
+        raise AssertionError("server never answered")
+    assert car._car is not None and car._car.steering == 0.1
+    assert not decoded, "ctrl requests must not be decoded for logging unless main.LOG_CONTROL is set"
+    assert not boottime.first("control"), "the first control packet should have been recorded"
+    print("first control packet ok")
+
+if __name__ == "__main__":
+    main()
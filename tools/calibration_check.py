@@ -0,0 +1,143 @@
+""" Motor calibration: table lookup, fitting and persistence, then main.calibrate_motors on the simulator.
+
+Unit checks cover MotorCurve interpolation, the inverse fit and the
+motors.txt round trip. The simulated car gets mismatched motors (the right
+one weaker, with a wider deadband); calibrate_motors measures them through
+the IMU like on the car, and the check compares uncalibrated and calibrated
+driving: the in-place spin rate against steering (deadband and linearity),
+drift when driving straight (per-side gain), and how fast and how closely
+spin_at_rate holds its target with the same PI gains.
+
+Usage: python tools/calibration_check.py [--verbose]
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import main as app
+from car import get_car
+from mpu6050 import get_mpu
+from calibration import MotorCurve, MotorCalibration
+import calstore
+from sim.drive import Simulation
+
+LEFT = dict(top_speed=0.25, deadband=0.2)
+RIGHT = dict(top_speed=0.21, deadband=0.28)
+STEERING = [i / 10 for i in range(1, 11)]
+
+def check_curves():
+    identity = MotorCurve.identity()
+    for speed in (0, 0.01, 0.3, 0.55, 0.999, 1, 1.5):
+        assert abs(identity(speed) - min(speed, 1)) < 1 / 1023, speed
+
+    # A deadband of 0.2 then a linear rise to 100 at full duty
+    levels = [i / 20 for i in range(1, 21)]
+    rates = [max(0.0, (l - 0.2) * 125) for l in levels]
+    rates[10] -= 3  # A noisy dip must not fold the inverse back
+    curve = MotorCurve.fit(levels, rates, top=80, threshold=1)
+    assert curve.table[0] == round(0.208 * 1023), curve.table[0]
+    assert list(curve.table) == sorted(curve.table)
+    for speed in (0.25, 0.5, 0.75):
+        duty = curve(speed)
+        assert abs((duty - 0.2) * 125 - speed * 80) < 3, (speed, duty)
+    assert abs(curve(1) - 0.84) < 1 / 1023 and curve(0) == 0
+
+    calibration = MotorCalibration(curve, identity, identity, curve)
+    path = os.path.join(tempfile.mkdtemp(), "motors.txt")
+    with contextlib.redirect_stdout(io.StringIO()):
+        calibration.save(path)
+        loaded = MotorCalibration.load(path)
+        with open(path, "a") as f:
+            f.write("left_fwd 1 2 3\n")
+        broken = MotorCalibration.load(path)
+        missing = MotorCalibration.load(path + ".missing")
+    assert [list(c.table) for c in loaded.curves()] == [list(c.table) for c in calibration.curves()]
+    assert loaded.curve(True, True) is loaded.left_fwd and loaded.curve(False, False) is loaded.right_rev
+    assert broken is None and missing is None
+    print("curve lookup, fit and motors.txt round trip ok")
+
+def steady_yaw(simulation, car, throttle, steering, settle=1.0, duration=1.0):
+    """ Mean true yaw rate (°/s, clockwise positive like spin_at_rate) at a fixed command. """
+    car.set(throttle, steering)
+    time.sleep(settle)
+    total = 0.0
+    for _ in range(100):
+        time.sleep(duration / 100)
+        total -= simulation.drive.yaw_rate
+    car.stop()
+    time.sleep(0.5)
+    return total / 100
+
+def linearity(rates):
+    """ Worst deviation from the least-squares line through the origin, as a fraction of the top rate. """
+    slope = sum(s * r for s, r in zip(STEERING, rates)) / sum(s * s for s in STEERING)
+    return max(abs(r - slope * s) for s, r in zip(STEERING, rates)) / max(rates)
+
+def characterise(car, mpu, label):
+    with Simulation(car, mpu, left=LEFT, right=RIGHT) as simulation:
+        spins = [steady_yaw(simulation, car, 0, s) for s in STEERING]
+        drift = steady_yaw(simulation, car, 0.6, 0)
+    print("%-13s spin °/s at steering 0.1..1: %s" % (label, " ".join("%5.1f" % r for r in spins)))
+    print("%-13s linearity error %.0f%%, drift at throttle 0.6: %.1f °/s" % ("", 100 * linearity(spins), drift))
+    return spins, drift
+
+def spin_error(car, mpu, dps=18, window=0.5):
+    """ spin_at_rate's true yaw rate averaged over windows: seconds until a window is within 3 °/s, and mean |error| (°/s). """
+    samples = []
+    with Simulation(car, mpu, left=LEFT, right=RIGHT) as simulation:
+        def listener(us):
+            if len(samples) <= simulation.elapsed / 0.02:
+                samples.append(-simulation.drive.yaw_rate)
+        simulation.clock.listeners.append(listener)
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.spin_at_rate(dps=dps, timeout=10, dt=0.02, Kp=0.002, Ki=0.01, Kd=0, limit=0.5, sample_rate=5)
+    # Samples are 20 ms apart; the spin runs from 5 s (after the countdown) to 15 s
+    n = int(window / 0.02)
+    errors = [abs(sum(samples[i:i + n]) / n - dps) for i in range(250, 750, n)]
+    reached = next((i * window for i, e in enumerate(errors) if e < 3), 10)
+    return reached, sum(errors) / len(errors)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="show calibrate_motors' output")
+    args = parser.parse_args()
+    check_curves()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        car, mpu = get_car(), get_mpu()
+    car.calibration = None
+    spins, drift = characterise(car, mpu, "uncalibrated")
+    before = spin_error(car, mpu)
+
+    path = os.path.join(tempfile.mkdtemp(), "calib.bin")
+    start = time.perf_counter()
+    with Simulation(car, mpu, left=LEFT, right=RIGHT) as simulation:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            app.calibrate_motors(filename=path)
+    print("calibrate_motors: %.0f s simulated in %.1f s, tables %s"
+          % (simulation.elapsed, time.perf_counter() - start, " | ".join(" ".join(str(d) for d in c.table[:4]) + " .." for c in car.calibration.curves())))
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert calstore.CalibrationRecord.load(path).motors is not None
+
+    cal_spins, cal_drift = characterise(car, mpu, "calibrated")
+    after = spin_error(car, mpu)
+    for label, (reached, error) in (("uncalibrated", before), ("calibrated", after)):
+        print("%-13s spin_at_rate(18 °/s): within 3 °/s after %.1f s, mean |error| %.1f °/s" % (label, reached, error))
+    car.calibration = None
+
+    # Below the deadband only the PWM kicks move the car: uncalibrated, steering 0.1 gets a third of its share
+    assert spins[0] < spins[-1] / 30 and abs(cal_spins[0] - cal_spins[-1] / 10) < cal_spins[-1] / 20
+    assert linearity(cal_spins) < linearity(spins) / 2 and linearity(cal_spins) < 0.1
+    assert abs(cal_drift) < abs(drift) / 3
+    assert after[0] <= before[0] and after[1] < before[1] / 2
+    print("motor calibration ok")
+
+if __name__ == "__main__":
+    main()
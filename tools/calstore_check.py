@@ -0,0 +1,207 @@
+""" Binary calibration record: round trip, injected corruption, interrupted writes and migration from the text files.
+
+Every single-bit flip and every truncation of a saved record must be
+rejected rather than loaded as offsets. Power cuts are injected at each
+step of save(): while the temporary file is being written, before the
+rename, and (as on a filesystem that deletes the old file before renaming)
+between the delete and the rename. Afterwards load() must return either
+the old record or the new one, never a mix. Migration reads gyro.txt,
+tilt.txt and motors.txt once, then get_record() reads only calib.bin.
+Also compares the cost of loading the binary record with parsing the
+text files.
+
+Usage: python tools/calstore_check.py
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import contextlib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import sim
+sim.install()
+import calstore
+from calstore import CalibrationRecord
+from calibration import MotorCurve, MotorCalibration, POINTS
+
+def sample(offset=0.0):
+    curve = MotorCurve([200 + 50 * i for i in range(POINTS)])
+    motors = MotorCalibration(curve, MotorCurve.identity(), curve, MotorCurve.identity())
+    return CalibrationRecord([-265.75 + offset, -84.527, -3.141], [12.0, -7.5, 30.25], [1.01, 0.99, 1.0],
+                             [3.95212, 28.4515], [0.5, -0.25, 1.5], 31.0, motors)
+
+def same(a, b):
+    """ Equal up to float32 rounding. """
+    for x, y in zip(a.gyro_bias + a.accel_bias + a.accel_scale + a.tilt_offsets + a.temp_coeff + [a.temp_ref],
+                    b.gyro_bias + b.accel_bias + b.accel_scale + b.tilt_offsets + b.temp_coeff + [b.temp_ref]):
+        if abs(x - y) > 1e-4 * max(1, abs(x)):
+            return False
+    if (a.motors is None) != (b.motors is None):
+        return False
+    return a.motors is None or [list(c.table) for c in a.motors.curves()] == [list(c.table) for c in b.motors.curves()]
+
+def quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+def check_round_trip(work):
+    record = sample()
+    data = record.pack()
+    assert len(data) == calstore.SIZE
+    assert same(CalibrationRecord.unpack(data), record)
+    assert CalibrationRecord.unpack(CalibrationRecord().pack()).motors is None
+    path = os.path.join(work, "calib.bin")
+    record.save(path)
+    assert same(quiet(CalibrationRecord.load, path), record)
+    assert not os.path.exists(path + ".tmp")
+    print("round trip ok: %d byte record, one struct.unpack" % calstore.SIZE)
+
+def check_corruption(work):
+    data = sample().pack()
+    path = os.path.join(work, "corrupt.bin")
+    rejected = 0
+    for bit in range(len(data) * 8):
+        bad = bytearray(data)
+        bad[bit // 8] ^= 1 << (bit % 8)
+        with open(path, "wb") as f:
+            f.write(bad)
+        assert quiet(CalibrationRecord.load, path) is None, "bit %d flipped and still loaded" % bit
+        rejected += 1
+    for length in range(len(data)):
+        with open(path, "wb") as f:
+            f.write(data[:length])
+        assert quiet(CalibrationRecord.load, path) is None, "truncated to %d bytes and still loaded" % length
+        rejected += 1
+    with open(path, "wb") as f:
+        f.write(data + b"\0")
+    assert quiet(CalibrationRecord.load, path) is None
+
+    # A future version, with a valid CRC, is not read as this one
+    future = bytearray(data[:-4])
+    future[4] = calstore.VERSION + 1
+    with open(path, "wb") as f:
+        f.write(future + calstore.ustruct.pack("<I", calstore.ubinascii.crc32(future)))
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        assert CalibrationRecord.load(path) is None
+    assert "version" in log.getvalue()
+    print("corruption ok: %d bit flips and truncations rejected" % rejected)
+
+class PowerCut(Exception):
+    pass
+
+def check_interrupted_writes(work):
+    path = os.path.join(work, "calib.bin")
+    old, new = sample(), sample(offset=10.0)
+    rename = os.rename
+
+    def cut_rename(src, dst):
+        raise PowerCut
+
+    # Cut while the temporary file is half written
+    old.save(path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(new.pack()[:100])
+    assert same(quiet(CalibrationRecord.load, path), old)
+
+    # Cut after the temporary file is complete but before the rename
+    os.rename = cut_rename
+    try:
+        new.save(path)
+    except PowerCut:
+        pass
+    finally:
+        os.rename = rename
+    assert same(quiet(CalibrationRecord.load, path), old)
+
+    # Cut between deleting the old file and renaming the new one
+    os.remove(path)
+    assert same(quiet(CalibrationRecord.load, path), new), "the complete .tmp must be used"
+
+    # The next save clears it up
+    new.save(path)
+    assert same(quiet(CalibrationRecord.load, path), new) and not os.path.exists(path + ".tmp")
+    print("interrupted writes ok: the old or the new record, never a mix")
+
+def check_migration(work):
+    folder = os.path.join(work, "migrate")
+    os.mkdir(folder)
+    for name in ("gyro.txt", "tilt.txt"):
+        shutil.copy(os.path.join(ROOT, name), folder)
+    quiet(sample().motors.save, os.path.join(folder, "motors.txt"))
+    old = os.getcwd()
+    os.chdir(folder)
+    try:
+        calstore._record = None
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            record = calstore.get_record()
+        assert "Migrated gyro.txt, tilt.txt, motors.txt to calib.bin" in log.getvalue(), log.getvalue()
+        with open("gyro.txt") as f:
+            assert record.gyro_bias == [float(line) for line in f]
+        assert [list(c.table) for c in record.motors.curves()] == [list(c.table) for c in sample().motors.curves()]
+
+        # From now on only calib.bin is read, even when the text files change
+        with open("gyro.txt", "w") as f:
+            f.write("1\n2\n3\n")
+        calstore._record = None
+        assert same(quiet(calstore.get_record), record)
+
+        # A corrupt record falls back to defaults, not to the stale text files
+        with open("calib.bin", "r+b") as f:
+            f.seek(10)
+            f.write(b"\xff")
+        calstore._record = None
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            record = calstore.get_record()
+        assert record.gyro_bias == [0.0, 0.0, 0.0] and "invalid (crc)" in log.getvalue(), log.getvalue()
+
+        # A truncated text file is skipped on migration, not read as zeros
+        os.remove("calib.bin")
+        with open("gyro.txt", "w") as f:
+            f.write("-265.75\n-84.5")
+        calstore._record = None
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            record = calstore.get_record()
+        assert "gyro.txt is malformed" in log.getvalue() and "Migrated tilt.txt, motors.txt" in log.getvalue()
+    finally:
+        calstore._record = None
+        os.chdir(old)
+    print("migration ok: text files read once, corrupt records not replaced by them")
+
+def check_cost(n=2000):
+    folder = os.path.join(ROOT)
+    start = time.perf_counter()
+    for _ in range(n):
+        quiet(calstore._read_floats, os.path.join(folder, "gyro.txt"), 3)
+        quiet(calstore._read_floats, os.path.join(folder, "tilt.txt"), 2)
+    text = (time.perf_counter() - start) / n * 1e6
+    path = os.path.join(tempfile.mkdtemp(), "calib.bin")
+    sample().save(path)
+    start = time.perf_counter()
+    for _ in range(n):
+        quiet(CalibrationRecord.load, path)
+    binary = (time.perf_counter() - start) / n * 1e6
+    shutil.rmtree(os.path.dirname(path))
+    print("load (host): gyro.txt + tilt.txt %.1f us, calib.bin with motor tables %.1f us" % (text, binary))
+
+def main():
+    work = tempfile.mkdtemp()
+    try:
+        check_round_trip(work)
+        check_corruption(work)
+        check_interrupted_writes(work)
+        check_migration(work)
+    finally:
+        shutil.rmtree(work)
+    check_cost()
+    print("calibration store ok")
+
+if __name__ == "__main__":
+    main()
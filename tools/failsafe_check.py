@@ -0,0 +1,170 @@
+""" Command-lease failsafe and watchdog hook on the differential-drive simulator.
+
+A simulated client sends 6-byte control frames (the UI's lease-carrying
+format) every 250 ms, decoded through web.decode_control/decode_lease like
+main's WebSocket handler. Scenarios: random packet loss (the lease must
+ride out short gaps and expire on long ones), the link going dead (the
+motors must ramp to zero within lease + ramp time), and the control loop
+stalling (the scheduler-run check stops feeding the watchdog, which would
+reset the board; the timer-run check of the blocking server keeps stopping
+the car, and refuses a watchdog it would keep feeding through the stall).
+Checks that client-supplied leases are bounded, and times renew() against
+the rest of a control update.
+
+Usage: python tools/failsafe_check.py
+"""
+import io
+import os
+import sys
+import time
+import random
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import machine
+import web
+from car import get_car
+from mpu6050 import get_mpu
+from failsafe import Failsafe
+from scheduler import Scheduler
+from sim.clock import SimClock
+from sim.drive import Simulation
+
+LEASE = 900  # Tolerates two lost frames in a row at 250 ms, not three
+RAMP = 300
+SEND = 250
+
+with contextlib.redirect_stdout(io.StringIO()):
+    car, mpu = get_car(), get_mpu()
+
+def run(duration=8, loss=0.0, dead_at=None, stall=None, use_scheduler=True, seed=1):
+    """ Drive at (0.5, 0.2) under the failsafe; returns the trace, received frame times, the failsafe and whether the watchdog starved. """
+    rng = random.Random(seed)
+    trace = []
+    received = []
+    with Simulation(car, mpu) as simulation:
+        scheduler = Scheduler()
+        wdt = machine.WDT() if use_scheduler else None
+        failsafe = Failsafe(car, LEASE, RAMP, scheduler=scheduler if use_scheduler else None, wdt=wdt)
+
+        def client():
+            t = simulation.elapsed
+            if (dead_at is not None and t >= dead_at) or rng.random() < loss:
+                return
+            payload = web.encode_control(0.5, 0.2, LEASE)
+            car.set(*web.decode_control(payload))
+            failsafe.renew(web.decode_lease(payload))
+            received.append(t)
+
+        def handler():
+            if stall and stall[0] <= simulation.elapsed < stall[0] + 0.02:
+                time.sleep(stall[1])  # A blocking call holds up the whole loop
+
+        # Sampled from a timer on simulated time, so the trace carries on through stalls
+        def record(timer):
+            trace.append((simulation.elapsed, car.throttle, car.steering, simulation.drive.speed))
+        recorder = machine.Timer(-1)
+        recorder.init(period=20, mode=machine.Timer.PERIODIC, callback=record)
+
+        scheduler.every(SEND, client, "client")
+        scheduler.every(20, handler, "handler")
+        try:
+            scheduler.run(duration * 1000)
+            starved = wdt.starved() if wdt else None  # While the simulated clock is still in place
+        finally:
+            recorder.deinit()
+            failsafe.stop()
+            car.stop()
+    return trace, received, failsafe, wdt, starved
+
+def check_loss():
+    for loss in (0.1, 0.3, 0.5):
+        trace, received, failsafe, wdt, starved = run(loss=loss, duration=20)
+        gaps = [b - a for a, b in zip(received, received[1:])]
+        expected = sum(1 for g in gaps if g * 1000 > LEASE)
+        stopped = sum(1 for _, t, _, _ in trace if t == 0) * 20 / 1000
+        print("loss %2.0f%%: %2d frames received, longest gap %.2f s, %d leases expired (%d gaps > lease), stopped %.1f s of 20"
+              % (100 * loss, len(received), max(gaps), failsafe.expirations, expected, stopped))
+        assert failsafe.expirations == expected
+        assert wdt.feeds and not starved
+
+def check_dead_link():
+    trace, received, failsafe, wdt, starved = run(duration=6, dead_at=3)
+    last = received[-1]
+    after = [(t, throttle, steering, speed) for t, throttle, steering, speed in trace if t > last]
+    zero = next(t for t, throttle, steering, _ in after if throttle == 0 and steering == 0)
+    still = next(t for t, throttle, _, speed in after if throttle == 0 and abs(speed) < 1e-3)
+    throttles = [throttle for _, throttle, _, _ in after]
+    print("link dead after %.2f s: ramp from %.2f s, commands zero at %.2f s, car still at %.2f s (bound %.2f s)"
+          % (last, last + LEASE / 1000, zero, still, last + (LEASE + RAMP + 50) / 1000))
+    assert throttles == sorted(throttles, reverse=True), "the ramp must only go down"
+    assert zero - last <= (LEASE + RAMP + 50) / 1000 + 0.02
+    assert still - zero < 0.5
+    assert failsafe.parked(), "parked once the ramp is done (the Wi-Fi manager may scan then)"
+
+def check_stall():
+    # The ESP8266 watchdog's timeout is fixed at 5 s, so a shorter stall (a Wi-Fi scan) passes and a longer one resets
+    _, _, _, wdt, starved = run(duration=5, stall=(2, 2.5))
+    print("loop stalled 2.5 s, scheduler-run check: longest watchdog gap %d ms, starved: %s" % (wdt.max_gap, starved))
+    assert not starved, "a 2.5 s stall is within the fixed 5 s timeout"
+    _, _, _, wdt, starved = run(duration=9, stall=(2, 6))
+    print("loop stalled 6 s, scheduler-run check: longest watchdog gap %d ms, starved: %s" % (wdt.max_gap, starved))
+    assert starved, "a stalled loop must starve the watchdog"
+    try:
+        machine.WDT(timeout=500)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("the ESP8266 port refuses any watchdog timeout but its own")
+
+    trace, received, failsafe, wdt, starved = run(duration=4, stall=(2, 1.5), use_scheduler=False)
+    stalled = [throttle for t, throttle, _, _ in trace if 2.02 < t < 3.5]
+    print("loop stalled 1.5 s, timer-run check: %d expiration, throttle during the stall %.2f -> %.2f"
+          % (failsafe.expirations, stalled[0], stalled[-1]))
+    assert failsafe.expirations == 1 and stalled[-1] == 0
+    try:
+        Failsafe(car, LEASE, RAMP, wdt=machine.WDT())
+    except ValueError:
+        print("timer-run check refuses a watchdog (it would feed it through the stall)")
+    else:
+        raise AssertionError("a timer-run failsafe must not take a watchdog")
+
+def check_lease_bounds():
+    clock = SimClock()
+    failsafe = Failsafe(car, LEASE, RAMP, scheduler=Scheduler(clock))
+    for asked, granted in ((None, LEASE), (0, LEASE), (-5, LEASE), (float("nan"), LEASE), (300, 300),
+                           (2 * LEASE, 2 * LEASE), (65535, 2 * LEASE), (1e12, 2 * LEASE)):
+        failsafe.renew(asked)
+        assert failsafe.deadline - clock.now() == granted * 1000, (asked, failsafe.deadline - clock.now())
+        assert not failsafe.parked()
+    failsafe.stop()
+    print("client leases capped at %d ms; missing, zero, negative and nan ones get the default %d ms" % (2 * LEASE, LEASE))
+
+def check_cost(n=20000):
+    failsafe = Failsafe(car, LEASE, RAMP, scheduler=Scheduler())
+    payload = web.encode_control(0.5, 0.2, LEASE)
+    start = time.perf_counter()
+    for _ in range(n):
+        car.set(*web.decode_control(payload))
+    update = (time.perf_counter() - start) / n * 1e6
+    start = time.perf_counter()
+    for _ in range(n):
+        failsafe.renew(web.decode_lease(payload))
+    renew = (time.perf_counter() - start) / n * 1e6
+    failsafe.stop()
+    car.stop()
+    print("per control update: decode + car.set %.2f us, decode_lease + renew %.2f us (host)" % (update, renew))
+    assert renew < update
+
+def main():
+    check_loss()
+    check_dead_link()
+    check_stall()
+    check_lease_bounds()
+    check_cost()
+    print("failsafe ok")
+
+if __name__ == "__main__":
+    main()
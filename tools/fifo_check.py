@@ -0,0 +1,116 @@
+""" Checks for MPU6050 FIFO sampling against the register-level fake.
+
+Verifies that draining in bulk returns every sample in order at the
+configured rate, that the divider maths matches the datasheet, and that an
+overflow is detected and recovered from without returning misaligned data.
+Also compares I2C transactions and wakeups with timer polling, and checks
+that OrientationFilter.poll refuses to run without the FIFO.
+
+Usage: python tools/fifo_check.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+from sim.machine import I2C
+from sim.mpu6050 import FakeMPU6050
+from mpu6050 import MPU6050, OrientationFilter
+
+def make(rate=100):
+    # Gz carries the sample index so order and gaps are visible
+    device = FakeMPU6050(lambda t: (0, 0, 16384, 0, 0, 0, int(round(t * rate)) & 0x7FFF))
+    bus = I2C()
+    bus.attach(0x68, device)
+    return device, bus, MPU6050(bus)
+
+def check_rates():
+    device, bus, mpu = make()
+    for rate, dlpf, expected in ((100, 3, 100), (200, 3, 200), (333, 3, 1000 / 3), (50, 1, 50), (1000, 0, 1000), (4, 3, 1000 / 250)):
+        mpu.start_fifo(rate, dlpf)
+        assert abs(mpu.fifo_rate - expected) < 1e-9, (rate, dlpf, mpu.fifo_rate)
+        assert abs(device.sample_period - 1 / expected) < 1e-12
+    print("rates ok")
+
+def check_every_sample(seconds=10, drain_interval=0.25):
+    device, bus, mpu = make()
+    mpu.start_fifo(100)
+    seen = []
+    wakeups = 0
+    bus.transactions = 0
+    for _ in range(int(seconds / drain_interval)):
+        device.advance(drain_interval)
+        mpu.read_fifo(lambda raw: seen.append(raw[6]))
+        wakeups += 1
+    assert seen == list(range(len(seen))), "samples missing or out of order"
+    assert len(seen) == device.samples - 1 or len(seen) == device.samples, (len(seen), device.samples)
+    fifo_xfers = bus.transactions
+
+    # Timer polling at the same rate: one wakeup and one burst read per sample
+    polled = int(seconds * 100)
+    print("every sample ok: %d samples, %d wakeups and %d I2C transactions (timer polling: %d and %d)"
+          % (len(seen), wakeups, fifo_xfers, polled, polled))
+
+def check_overflow():
+    device, bus, mpu = make()
+    mpu.start_fifo(100)
+
+    # 1.2 s at 100 Hz is 1680 bytes: more than the 1024-byte FIFO holds
+    device.advance(1.2)
+    got = []
+    assert mpu.read_fifo(got.append) == 0 and not got
+    assert mpu.fifo_overflows == 1
+    assert len(device.fifo) == 0 and device.registers[0x3A] & 0x10 == 0
+
+    # After the reset, samples are frame-aligned again
+    start = device.samples
+    device.advance(0.5)
+    seen = []
+    mpu.read_fifo(lambda raw: seen.append(raw[6]))
+    assert seen == list(range(start, start + len(seen))) and len(seen) >= 49, seen
+
+    # 73 frames (1022 bytes) still fit; the 74th overflows
+    while len(device.fifo) < 73 * 14:
+        device.advance(0.01)
+    assert mpu.read_fifo(got.append) == 73 and mpu.fifo_overflows == 1
+    while len(device.fifo) < 73 * 14:
+        device.advance(0.01)
+    device.advance(0.01)
+    assert mpu.read_fifo(got.append) == 0 and mpu.fifo_overflows == 2
+    print("overflow ok: %d overflows detected and recovered" % mpu.fifo_overflows)
+
+def check_accel_alignment():
+    device, bus, mpu = make()
+    mpu.start_fifo(100)
+    device.advance(0.3)
+    frames = []
+    mpu.read_fifo(frames.append)
+    assert frames and all(f[2] == 16384 for f in frames), "accel Z should be 1 g in every frame"
+    print("frame layout ok")
+
+def check_filter_needs_fifo():
+    device, bus, mpu = make()
+    estimator = OrientationFilter(mpu)
+    for setup in (lambda: None, lambda: (mpu.start_fifo(100), mpu.stop_fifo())):
+        setup()
+        try:
+            estimator.poll()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("poll() without the FIFO must say so")
+    mpu.start_fifo(100)
+    device.advance(0.1)
+    assert estimator.poll() == 10 and estimator.dt == 1 / 100
+    print("OrientationFilter.poll needs the FIFO: clear error before start and after stop")
+
+def main():
+    check_rates()
+    check_every_sample()
+    check_overflow()
+    check_accel_alignment()
+    check_filter_needs_fifo()
+
+if __name__ == "__main__":
+    main()
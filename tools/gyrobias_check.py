@@ -0,0 +1,123 @@
+""" Offline check of gyrobias.GyroBiasEstimator on a synthetic warm-up drive.
+
+The trace is a car that warms up from 25 °C toward 45 °C over half an hour
+(motor driver and regulator heat), while the gyro bias follows the die
+temperature linearly. The drive alternates driving with turns and stops,
+with motor vibration on the accelerometer while driving. The yaw rate goes
+through MPU6050.get_avel like on the car, and the integrated heading error
+(measured minus true heading) is compared for three ways of setting the
+offsets:
+- a boot calibration held forever (calibrate_gyro, gyro.txt);
+- online estimation of the bias alone;
+- online estimation with the temperature model.
+A last stretch drives without stopping while the temperature still climbs,
+where only the temperature model can follow the bias.
+
+Usage: python tools/gyrobias_check.py [--minutes 30] [--seed 1]
+"""
+import os
+import sys
+import math
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import calstore
+calstore._record = calstore.CalibrationRecord()  # Start uncalibrated, whatever calib.bin holds
+from sim.machine import I2C
+from mpu6050 import MPU6050, GYRO_SCALE
+from gyrobias import GyroBiasEstimator
+
+RATE = 50     # Samples per second
+G = 16384
+BIAS = (-265.0, -84.0, -40.0)  # Raw LSB at 25 °C, like gyro.txt
+COEFF = (-2.0, 1.5, -3.0)      # LSB per °C: the yaw bias moves 0.46 °/s over the warm-up
+
+class Command:
+    """ Stands in for Car: only throttle and steering are read. """
+    throttle = 0
+    steering = 0
+
+def temperature(t, minutes):
+    return 25 + 20 * (1 - math.exp(-t / (minutes * 60 / 3)))
+
+def trace(minutes, rng):
+    """ Yields (t, raw sample, commanded, true yaw rate °/s). """
+    final = minutes * 60 * 0.8  # After this, drive without stopping
+    for n in range(int(minutes * 60 * RATE)):
+        t = n / RATE
+        phase = t % 80
+        driving = t >= 10 and (phase >= 20 or t >= final)
+        rate = 40 * math.sin(t / 3) if driving else 0.0
+        shake = 0.08 if driving else 0.003
+        temp = temperature(t, minutes)
+        gyro = [BIAS[i] + COEFF[i] * (temp - 25) + rng.gauss(0, 6) for i in range(3)]
+        gyro[2] += rate * GYRO_SCALE
+        raw = (int(rng.gauss(0, shake) * G), int(rng.gauss(0, shake) * G), int((1 + rng.gauss(0, shake)) * G),
+               int((temp - 36.53) * 340), int(gyro[0]), int(gyro[1]), int(gyro[2]))
+        yield t, raw, driving, rate
+
+def run(minutes, seed, mode):
+    """ Integrated heading error over the trace; returns (t, error) pairs once a second and the estimator. """
+    rng = random.Random(seed)
+    mpu = MPU6050(I2C())
+    car = Command()
+    estimator = None
+    boot = []
+    heading_error = 0.0
+    errors = []
+    for t, raw, driving, rate in trace(minutes, rng):
+        car.throttle = 0.5 if driving else 0
+        if mode == "boot":
+            if len(boot) < 100:  # calibrate_gyro: 100 samples with the car held still at power-on
+                boot.append(raw)
+                if len(boot) == 100:
+                    mpu.gyro_offsets = [sum(s[4 + i] for s in boot) / 100 for i in range(3)]
+        elif estimator is None:
+            estimator = GyroBiasEstimator(mpu, car, interval=None, temperature=mode == "temperature")
+        if estimator:
+            estimator.update(raw)
+        heading_error += (mpu.get_avel(raw)[2] - rate) / RATE
+        if t % 1 == 0:
+            errors.append((t, heading_error))
+    return errors, estimator
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = {mode: run(args.minutes, args.seed, mode) for mode in ("boot", "bias", "temperature")}
+    final = args.minutes * 60 * 0.8
+    print("%d min warm-up, %.0f -> %.0f °C; yaw bias drifts %.2f °/s\n"
+          % (args.minutes, temperature(0, args.minutes), temperature(args.minutes * 60, args.minutes),
+             COEFF[2] * (temperature(args.minutes * 60, args.minutes) - 25) / GYRO_SCALE))
+    print("%-32s %14s %14s %18s" % ("offsets", "final (°)", "max |err| (°)", "non-stop drive (°)"))
+    summary = {}
+    for mode, label in (("boot", "boot calibration (gyro.txt)"), ("bias", "online, bias only"),
+                        ("temperature", "online, temperature model")):
+        errors, _ = results[mode]
+        at_final = next(e for t, e in errors if t >= final)
+        worst = max(abs(e) for _, e in errors)
+        nonstop = errors[-1][1] - at_final
+        summary[mode] = (abs(errors[-1][1]), worst, abs(nonstop))
+        print("%-32s %14.1f %14.1f %18.1f" % (label, errors[-1][1], worst, nonstop))
+
+    estimator = results["temperature"][1]
+    print("\nfitted yaw model: bias %.1f LSB at %.0f °C + %.2f LSB/°C (true %.1f + %.2f), %d stationary blocks, %d skipped"
+          % (estimator.b[2], estimator.temp_ref, estimator.k[2], BIAS[2], COEFF[2], estimator.fits, estimator.rejected))
+    print("%.1f s for three runs (host)" % (time.perf_counter() - start))
+
+    boot, bias, temp = summary["boot"], summary["bias"], summary["temperature"]
+    assert temp[1] < boot[1] / 5, "online estimation must cut the heading error"
+    assert temp[2] < bias[2] / 2, "the temperature model must carry the bias through a non-stop drive"
+    assert abs(estimator.k[2] - COEFF[2]) < 0.5 and abs(estimator.b[2] - BIAS[2]) < 10
+    print("gyro bias estimation ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+""" Odometry and heading hold (odometry.py) on the differential-drive simulator.
+
+The car's motors are mismatched (the right one is weaker and stalls
+later), and the PWM frequency follows the duty as on the car, so driving
+with the steering centred pulls it off line. A simulated driver sends
+commands every 100 ms like the UI. Every run is done open loop (Car.set)
+and with HeadingHold, and compared with ground truth from the model:
+1. Straight line: heading drift and lateral error after 10 s.
+2. Slalom: straight, turn, straight, turn back, straight. The heading
+   held on each straight must be the one at release, and the car must
+   track it; the odometry pose is compared with the true one.
+3. The link dies while holding: the failsafe stops the car, and the hold
+   must let go instead of steering a stopped car.
+
+Usage: python tools/heading_check.py [--verbose]
+"""
+import io
+import os
+import sys
+import math
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+from car import get_car
+from mpu6050 import get_mpu
+from scheduler import Scheduler
+from failsafe import Failsafe
+from odometry import Odometry, HeadingHold
+from sim.drive import Simulation
+
+with contextlib.redirect_stdout(io.StringIO()):
+    car, mpu = get_car(), get_mpu()
+
+# Right motor weaker, with a wider deadband
+WORLD = dict(left={"top_speed": 0.25}, right={"top_speed": 0.23, "deadband": 0.24}, gyro_noise=0.3, vibration=0.05)
+
+def straight(t):
+    return 0.5, 0.0
+
+def slalom(t):
+    if 3 <= t < 3.8:
+        return 0.5, 0.6   # Right
+    if 8 <= t < 8.8:
+        return 0.5, -0.6  # Back left
+    return 0.5, 0.0
+
+class Run:
+    """ One drive under the simulator, sampling truth and estimate every 20 ms. """
+    def __init__(self, script, seconds, hold, lease_ms=None, link_until=None, verbose=False):
+        self.samples = []  # (t, true x, true y, true heading, odometry x, y, heading, held target or None)
+        start = time.perf_counter()
+        with Simulation(car, mpu, **WORLD) as simulation:
+            with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                self._drive(simulation, script, seconds, hold, lease_ms, link_until)
+        car.stop()
+        self.wall = time.perf_counter() - start
+
+    def _drive(self, simulation, script, seconds, use_hold, lease_ms, link_until):
+        scheduler = Scheduler(simulation.clock)
+        odometry = Odometry(mpu, car, scheduler=scheduler)
+        hold = HeadingHold(car, odometry, scheduler=scheduler) if use_hold else None
+        failsafe = Failsafe(car, lease_ms, scheduler=scheduler) if lease_ms else None
+        drive = simulation.drive
+        truth = [0.0, drive.heading]  # Unwrapped true heading, last wrapped one
+
+        def driver():
+            t = simulation.elapsed
+            if link_until is not None and t >= link_until:
+                return
+            throttle, steering = script(t)
+            (hold or car).set(throttle, steering)
+            if failsafe:
+                failsafe.renew()
+
+        def sample():
+            step = (drive.heading - truth[1] + 180) % 360 - 180
+            truth[0] += step
+            truth[1] = drive.heading
+            self.samples.append((simulation.elapsed, drive.x, drive.y, truth[0], odometry.x, odometry.y,
+                                 odometry.heading, hold.target if hold else None))
+
+        scheduler.every(100, driver, "driver")
+        scheduler.every(20, sample, "truth")
+        try:
+            scheduler.run(seconds * 1000)
+        finally:
+            for service in (hold, odometry, failsafe):
+                if service:
+                    service.stop()
+        self.hold = hold
+        self.failsafe = failsafe
+        self.odometry = odometry
+        self.elapsed = simulation.elapsed
+        self.speed = drive.speed
+        self.steering = car.steering
+
+    def at(self, t):
+        return next(s for s in self.samples if s[0] >= t)
+
+    def last(self):
+        return self.samples[-1]
+
+def check_straight(verbose):
+    print("1. straight line, throttle 0.5 for 10 s")
+    print("   %-14s %14s %16s" % ("", "heading (°)", "off line (cm)"))
+    results = {}
+    for name, hold in (("open loop", False), ("heading hold", True)):
+        run = Run(straight, 10, hold, verbose=verbose)
+        _, x, y, heading, _, _, _, _ = run.last()
+        results[name] = (heading, x)
+        print("   %-14s %14.1f %16.1f   (%.1f s simulated in %.2f s)" % (name, heading, x * 100, run.elapsed, run.wall))
+    open_heading, open_x = results["open loop"]
+    hold_heading, hold_x = results["heading hold"]
+    assert abs(open_heading) > 20, "the mismatched motors should pull the open-loop car off line"
+    assert abs(hold_heading) < 2 and abs(hold_x) < abs(open_x) / 5, results
+
+def check_slalom(verbose):
+    print("\n2. slalom: straights at 0.5, turns of 0.8 s at steering ±0.6")
+    straights = ((0.0, 1.5, 3.0), (3.8, 5.0, 8.0), (8.8, 10.0, 14.0))  # Release, then the settled part
+    open_run = Run(slalom, 14, False, verbose=verbose)
+    run = Run(slalom, 14, True, verbose=verbose)
+    print("   %-24s %12s %12s %12s" % ("straight", "target (°)", "rms err (°)", "open drift"))
+    for release, start, end in straights:
+        part = [s for s in run.samples if release + 0.1 <= s[0] < end]
+        target = part[0][7]
+        assert target is not None and all(s[7] == target for s in part), "target must stay put on a straight"
+        assert abs(run.at(release)[3] - target) < 2, "held heading must be the one at release"
+        settled = [s for s in part if s[0] >= start]
+        rms = math.sqrt(sum((s[3] - target) ** 2 for s in settled) / len(settled))
+        opened = [s for s in open_run.samples if start <= s[0] < end]
+        drift = opened[-1][3] - opened[0][3]
+        print("   %-24s %12.1f %12.2f %12.1f" % ("%.1f-%.1f s" % (start, end), target, rms, drift))
+        assert rms < 2, rms
+    assert run.hold.engaged == 3
+
+    t, x, y, heading, ox, oy, oheading, _ = run.last()
+    error = math.hypot(ox - x, oy - y)
+    print("   odometry after %.1f m: heading error %.2f°, position error %.1f cm (%.1f%% of distance)"
+          % (run.odometry.distance, oheading - heading, error * 100, 100 * error / run.odometry.distance))
+    assert abs(oheading - heading) < 2
+    assert error < 0.15 * run.odometry.distance
+
+def check_failsafe(verbose):
+    print("\n3. link lost at 3 s while holding, lease 500 ms")
+    run = Run(straight, 6, True, lease_ms=500, link_until=3.0, verbose=verbose)
+    print("   failsafe expirations %d, hold target %s, final speed %.3f m/s, steering %.2f"
+          % (run.failsafe.expirations, run.hold.target, run.speed, run.steering))
+    assert run.failsafe.expirations == 1 and run.hold.target is None
+    assert run.speed == 0 and run.steering == 0
+    for s in run.samples[-50:]:
+        assert s[1:3] == run.last()[1:3], "the stopped car must not move"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="show the car code's console output")
+    args = parser.parse_args()
+    check_straight(args.verbose)
+    check_slalom(args.verbose)
+    check_failsafe(args.verbose)
+    print("heading hold ok")
+
+if __name__ == "__main__":
+    main()
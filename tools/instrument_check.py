@@ -0,0 +1,175 @@
+""" Instrumentation layer (instrument.py): zero cost when off, correct counts when on, and /stats.
+
+1. Disabled: timed() hands back the function itself and span() a shared
+   no-op, so nothing is wrapped and nothing is recorded.
+2. Stat bins and percentiles on known values.
+3. Enabled before the car modules are imported (as boot.py does): every
+   call of Car.update_motors and, under the simulator, spin_at_rate's PID
+   tick and the averager's samples is counted, with allocations from
+   tracemalloc standing in for gc.mem_alloc. Prints the wrapper's host
+   overhead per call.
+4. main.main() on a loopback port: drive it through /ctrl, including a
+   request split across two sends and one pipelined behind it, so the
+   parser (HttpRequest.feed and next) is counted on the servers' own path;
+   then read /stats as JSON and clear it with ?reset=1.
+
+Host timings only show relative cost; enable INSTRUMENT in boot.py and read
+/stats on the car for real numbers.
+
+Usage: python tools/instrument_check.py
+"""
+import io
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import contextlib
+import tracemalloc
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # wifi.txt and calib.bin are opened relative to the working directory
+import sim
+sim.install()
+import instrument
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def per_call(func, n=100000):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n * 1e9
+
+def check_disabled():
+    print("1. disabled")
+    assert not instrument.ENABLED, "instrumentation must be off by default"
+
+    def work():
+        return 1
+
+    assert instrument.timed("work")(work) is work, "disabled timed() must return the function itself"
+    with instrument.span("block"):
+        pass
+    assert instrument.span("block") is instrument._NO_SPAN
+    assert instrument.stats() == {}, instrument.stats()
+    print("   timed() returns the function unchanged, span() a shared no-op; nothing recorded")
+
+def check_histogram():
+    print("2. histogram")
+    stat = instrument.Stat("values")
+    for us, alloc in ((0, 0), (1, 16), (2, 16), (3, 48), (1000, 100), (10 ** 9, -64)):
+        stat.add(us, alloc)
+    s = stat.summary()
+    assert s["us"][:3] == [1, 1, 2] and s["us"][10] == 1 and s["us"][-1] == 1, s["us"]
+    assert sum(s["us"]) == sum(s["alloc"]) == s["n"] == 6
+    assert s["alloc"][0] == 2 and s["alloc"][5] == 2 and s["alloc"][6] == 1 and s["alloc"][7] == 1, s["alloc"]
+    assert s["max_us"] == 10 ** 9 and s["max_alloc"] == 100 and s["gc"] == 1
+    assert s["p50_us"] == 4 and s["p99_us"] == 1 << (instrument.BINS - 1), s
+    assert abs(s["mean_alloc"] - 180 / 6) < 1e-9
+    stat.reset()
+    assert stat.summary()["n"] == 0 and not any(stat.summary()["us"])
+    print("   bins, percentiles, gc count and reset ok")
+
+def check_enabled():
+    print("3. enabled before import")
+    instrument.enable()
+    tracemalloc.start()
+    import car
+    import web
+    import main as app
+    from mpu6050 import get_mpu
+    from sim.drive import Simulation
+    assert {"MeasurementAverager._sample", "Car.update_motors", "HttpRequest.feed", "HttpRequest.next",
+            "handle_request"} <= set(instrument._stats)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        c, mpu = car.get_car(), get_mpu()
+    instrument.reset()
+    for i in range(1000):
+        c.set(i % 3 / 3, (i % 5 - 2) / 4)
+    with c:
+        c.throttle = 0
+        c.steering = 0
+    motors = instrument.get("Car.update_motors").summary()
+    assert motors["n"] == 1001, motors["n"]
+
+    with Simulation(c, mpu) as simulation:
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.spin_at_rate(dps=18, timeout=2, dt=0.02, Kp=0.002, Ki=0.01, sample_rate=5)
+    pid = instrument.get("spin_at_rate pid").summary()
+    sample = instrument.get("MeasurementAverager._sample").summary()
+    # 100 ticks in 2 s; the averager takes 5 samples per tick plus one when each tick reads it
+    assert pid["n"] == 100 and 590 <= sample["n"] <= 610, (pid["n"], sample["n"])
+    assert pid["max_us"] > 0  # Simulated time: each clock read inside the tick costs read_us
+
+    print("   %-36s %6s %9s %8s %8s %11s" % ("", "calls", "mean (us)", "p99", "max", "alloc (B)"))
+    for name in ("Car.update_motors", "spin_at_rate pid", "MeasurementAverager._sample"):
+        s = instrument.get(name).summary()
+        print("   %-36s %6d %9.1f %8d %8d %11.0f" % (name, s["n"], s["mean_us"], s["p99_us"], s["max_us"], s["mean_alloc"]))
+    print("   (pid and sample in simulated us)")
+
+    def noop():
+        pass
+
+    wrapped = instrument.timed("noop")(noop)
+    tracemalloc.stop()
+    plain, timed = per_call(noop), per_call(wrapped)
+    print("   wrapper overhead on this host: %.0f ns per call (%.0f ns -> %.0f ns)" % (timed - plain, plain, timed))
+    return web, app
+
+def check_endpoint(web, app):
+    print("4. /stats from main.main()")
+    port = free_port()
+    run_webserver = web.run_webserver
+    web.run_webserver = lambda endpoints, tasks=(), port=port: run_webserver(endpoints, tasks, port)
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=app.main, daemon=True).start()
+        for _ in range(200):
+            try:
+                urllib.request.urlopen("http://127.0.0.1:%d/ctrl?t=0&s=0" % port, timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.01)
+        else:
+            raise AssertionError("server never answered")
+        time.sleep(0.05)  # The server calls next() after the response is out; let it, before and after the counted part
+        instrument.reset()
+        for _ in range(20):
+            urllib.request.urlopen("http://127.0.0.1:%d/ctrl?t=0.2&s=0" % port, timeout=1).read()
+        # One request in two sends, with a second pipelined behind it: two feeds, two requests handled
+        with socket.create_connection(("127.0.0.1", port), timeout=1) as s:
+            s.sendall(b"GET /ctrl?t=0.1")
+            time.sleep(0.05)
+            s.sendall(b"&s=0 HTTP/1.1\r\nHost: car\r\n\r\nGET /ctrl?t=0&s=0 HTTP/1.1\r\nHost: car\r\n\r\n")
+            received = b""
+            while received.count(b"HTTP/1.1 200") < 2:
+                received += s.recv(1024)
+        time.sleep(0.05)
+        stats = json.loads(urllib.request.urlopen("http://127.0.0.1:%d/stats?reset=1" % port, timeout=1).read())
+        after = json.loads(urllib.request.urlopen("http://127.0.0.1:%d/stats" % port, timeout=1).read())
+    handled = stats["handle_request"]
+    assert handled["n"] == 22 and sum(handled["us"]) == 22 and len(handled["us"]) == instrument.BINS, handled
+    # The /stats request itself was fed and parsed before it read the counters
+    assert stats["HttpRequest.feed"]["n"] == 20 + 2 + 1 and stats["HttpRequest.next"]["n"] == 22, stats
+    assert stats["Car.update_motors"]["n"] >= 22
+    assert after["handle_request"]["n"] == 1, "?reset=1 should clear after reading (this read counts itself)"
+    feed = stats["HttpRequest.feed"]
+    print("   22 ctrl requests: HttpRequest.feed mean %.0f us, handle_request mean %.0f us, p99 <= %d us; reset ok"
+          % (feed["mean_us"], handled["mean_us"], handled["p99_us"]))
+
+def main():
+    check_disabled()
+    check_histogram()
+    web, app = check_enabled()
+    check_endpoint(web, app)
+    print("instrumentation ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+""" Loopback load generator for the web server, runnable under CPython.
+
+Starts the server from web.py on 127.0.0.1 and drives it with N concurrent
+keep-alive clients sending ctrl requests, then prints p50/p99 latency.
+
+Usage: python tools/loadgen.py [--requests 200] [--clients 1,4,16] [--legacy]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import web
+
+state = {"t": 0.0, "s": 0.0}
+
+def receive_state(r):
+    state["t"] = r.param_float(b't', state["t"])
+    state["s"] = r.param_float(b's', state["s"])
+    return {"t": state["t"], "s": state["s"]}
+
+endpoints = {"ctrl": receive_state}
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def read_response(reader):
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("server closed connection")
+        if line == b"\r\n":
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line[15:])
+    return await reader.readexactly(length)
+
+async def client(port, count, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for i in range(count):
+            t = (i % 21 - 10) / 10
+            request = "GET /ctrl?t=%.2f&s=%.2f HTTP/1.1\r\nHost: car\r\nConnection: keep-alive\r\n\r\n" % (t, -t)
+            start = time.perf_counter()
+            writer.write(request.encode())
+            await writer.drain()
+            await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+async def run_clients(port, clients, count, timeout):
+    latencies = []
+    tasks = [asyncio.create_task(client(port, count, latencies)) for _ in range(clients)]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    return latencies, len(pending)
+
+async def bench_async(client_counts, count, timeout):
+    server = await web.start_async_webserver(endpoints, host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    results = []
+    for clients in client_counts:
+        results.append((clients,) + await run_clients(port, clients, count, timeout))
+    server.close()
+    await server.wait_closed()
+    return results
+
+def bench_legacy(client_counts, count, timeout):
+    port = 8080
+    threading.Thread(target=web.start_webserver, args=(endpoints, port), daemon=True).start()
+    time.sleep(0.2)
+    return [(clients,) + asyncio.run(run_clients(port, clients, count, timeout)) for clients in client_counts]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--clients", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds allowed per concurrency level")
+    parser.add_argument("--legacy", action="store_true", help="benchmark the serial start_webserver instead")
+    args = parser.parse_args()
+    client_counts = [int(c) for c in args.clients.split(",")]
+
+    if args.legacy:
+        results = bench_legacy(client_counts, args.requests, args.timeout)
+    else:
+        results = asyncio.run(bench_async(client_counts, args.requests, args.timeout))
+
+    print("%8s %10s %10s %10s %8s" % ("clients", "requests", "p50 (ms)", "p99 (ms)", "stalled"))
+    for clients, latencies, stalled in results:
+        if latencies:
+            p50 = "%.3f" % (percentile(latencies, 50) * 1000)
+            p99 = "%.3f" % (percentile(latencies, 99) * 1000)
+        else:
+            p50 = p99 = "-"
+        print("%8d %10d %10s %10s %8d" % (clients, len(latencies), p50, p99, stalled))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+""" Checks for ui/html_packer.py: minifier edge cases, token-for-token equivalence, incremental rebuilds and watch mode.
+
+Every script the page ships (the linked files and the page's own inline
+block) must minify to the same token stream it started with, and, when a
+node binary is on PATH, still parse (node --check). Incremental builds run
+on a copy of ui/ in a temporary directory: a second build reads nothing,
+a touched file is re-read but not re-minified, an edited one rebuilds to
+the same page a --force build gives, and --watch picks up an edit.
+
+Usage: python tools/packer_check.py
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import contextlib
+import io
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+UI = os.path.join(ROOT, "ui")
+sys.path.insert(0, UI)
+import html_packer as packer
+
+def js_tokens(js):
+    """ The minifier's own token stream minus whitespace and comments, regex literals included. """
+    tokens = []
+    pos = 0
+    while pos < len(js):
+        if js[pos] == "/" and js[pos + 1:pos + 2] not in ("/", "*") and (not tokens or tokens[-1] in packer._REGEX_AFTER):
+            match = packer._JS_REGEX.match(js, pos)
+            if match:
+                tokens.append(match.group())
+                pos = match.end()
+                continue
+        match = packer._JS_TOKEN.match(js, pos)
+        pos = match.end()
+        if match.lastgroup not in ("space", "comment"):
+            tokens.append(match.group())
+    return tokens
+
+def check_minifiers():
+    js = packer.minify_js
+    assert js("a\n(b)") == "a\n(b)", "a line break before ( can end a statement"
+    assert js("return\nx") == "return\nx"
+    assert js("let a = b + +c - -d;") == "let a=b+ +c- -d;"
+    assert js("s.replace(/ \\/ /g, '//')  // note") == "s.replace(/ \\/ /g,'//')"
+    assert js("x = a / b / c") == "x=a/b/c"
+    assert js("u = `${a}//${b}`; /* gone */ f()") == "u=`${a}//${b}`;f()"
+    assert js("if (a) {\n  b();\n}\nc = 1.5e-3") == "if(a){b();}\nc=1.5e-3"
+    assert js("/*!\n * (c) keep\n */\nvar a") == "/*!\n * (c) keep\n */\nvar a"
+    assert js("typeof x === 'y' ? 1 : 2") == "typeof x==='y'?1:2"
+
+    css = packer.minify_css
+    assert css("a  >  b { color : red ; }") == "a>b{color :red}"
+    assert css('p::before { content: "a , b; }" } /* x */') == 'p::before{content:"a , b; }"}'
+    assert css("@media screen and (max-width: 600px) { .x { margin: 0 auto; } }") == "@media screen and (max-width:600px){.x{margin:0 auto}}"
+
+    html = packer.minify_html("<div>\n    <!-- gone -->\n    <p>hi</p>\n\n</div>\n<script>\n  // c\n  go( 1 );\n</script>")
+    assert html == "<div>\n<p>hi</p>\n</div>\n<script>go(1);</script>", html
+    print("minifier edge cases ok")
+
+def node_check(js):
+    node = shutil.which("node")
+    if not node:
+        return None
+    with tempfile.NamedTemporaryFile("w", suffix=".js", delete=False) as f:
+        f.write(js)
+    try:
+        return subprocess.run([node, "--check", f.name], capture_output=True, text=True).returncode == 0
+    finally:
+        os.unlink(f.name)
+
+def check_equivalence():
+    scripts = {}
+    for name in ("joy.js", "script.js"):
+        with open(os.path.join(UI, name), encoding="utf-8") as f:
+            scripts[name] = f.read()
+    with open(os.path.join(UI, "index.html"), encoding="utf-8") as f:
+        for i, body in enumerate(re.findall(r"<script>([\s\S]*?)</script>", f.read())):
+            scripts["index.html inline %d" % i] = body
+    for name, source in scripts.items():
+        minified = packer.minify_js(source)
+        assert js_tokens(minified) == js_tokens(source), name + ": token stream changed"
+        assert packer.minify_js(minified) == minified, name + ": not idempotent"
+        parsed = node_check(minified)
+        assert parsed is not False, name + ": node --check failed on the minified script"
+        print("%-22s %6d -> %6d bytes, same tokens%s" % (name, len(source), len(minified),
+                                                         ", node --check ok" if parsed else " (node not found)"))
+
+def build(cwd, *args):
+    out = io.StringIO()
+    old = os.getcwd()
+    os.chdir(cwd)
+    try:
+        with contextlib.redirect_stdout(out):
+            packer.build("index.html", "index_packed.html", "ui.html.gz", *args)
+    finally:
+        os.chdir(old)
+    return out.getvalue()
+
+def check_incremental():
+    work = tempfile.mkdtemp()
+    for name in ("index.html", "joy.js", "script.js", "style.css"):
+        shutil.copy(os.path.join(UI, name), work)
+    page = os.path.join(work, "index_packed.html")
+
+    log = build(work)
+    assert "3 asset(s) read, 0 cached" in log, log
+    sizes = re.search(r"source\s+(\d+)\s+(\d+)\s+shipped\s+(\d+)\s+(\d+)", log)
+    source, source_gz, shipped, shipped_gz = map(int, sizes.groups())
+    print("size: %d -> %d bytes, gzipped %d -> %d" % (source, shipped, source_gz, shipped_gz))
+    assert shipped < source * 0.7 and shipped_gz < source_gz * 0.8
+
+    written = os.stat(page).st_mtime_ns
+    assert "Up to date (0 asset(s) read, 3 cached" in build(work)
+    os.utime(os.path.join(work, "joy.js"))
+    assert "Up to date (1 asset(s) read, 2 cached" in build(work)
+    assert os.stat(page).st_mtime_ns == written, "an unchanged page must not be rewritten"
+
+    with open(os.path.join(work, "style.css"), "a", encoding="utf-8") as f:
+        f.write("\n.added { color: blue; }\n")
+    log = build(work)
+    assert "Written" in log and "1 asset(s) read, 2 cached" in log, log
+    with open(page, encoding="utf-8") as f:
+        incremental = f.read()
+    build(work, True, True)
+    with open(page, encoding="utf-8") as f:
+        assert f.read() == incremental, "incremental and forced builds differ"
+    assert ".added{color:blue}" in incremental
+    print("incremental builds ok: unchanged 0 reads, touched 1 read, edited 1 rebuilt, same page as --force")
+    return work
+
+def check_watch(work):
+    shutil.copy(os.path.join(UI, "html_packer.py"), work)
+    proc = subprocess.Popen([sys.executable, os.path.join(work, "html_packer.py"), "index.html", "index_packed.html",
+                             "ui.html.gz", "--watch"], stdout=subprocess.PIPE, text=True)
+    try:
+        assert "Watching" in "".join(proc.stdout.readline() for _ in range(2))
+        time.sleep(0.2)
+        with open(os.path.join(work, "script.js"), "a", encoding="utf-8") as f:
+            f.write("\nvar watched = 1;\n")
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            line = proc.stdout.readline()
+            if line.startswith("Written"):
+                break
+        else:
+            raise AssertionError("watch mode didn't rebuild")
+    finally:
+        proc.terminate()
+        proc.wait()
+    with open(os.path.join(work, "index_packed.html"), encoding="utf-8") as f:
+        assert "var watched=1;" in f.read()
+    print("watch mode rebuilt after an edit")
+
+def main():
+    check_minifiers()
+    check_equivalence()
+    work = check_incremental()
+    check_watch(work)
+    shutil.rmtree(work)
+    print("packer ok")
+
+if __name__ == "__main__":
+    main()
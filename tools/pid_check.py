@@ -0,0 +1,207 @@
+""" Closed-loop checks for pid.PID and pid.RelayAutotuner on spin_analysis's yaw plant (host-side, needs NumPy).
+
+The plant is spin_analysis.Fopdt: first order with a steering deadband and
+a transport delay. First the controller's unit behaviours (no derivative
+kick, bumpless gain changes, anti-windup, no integrator without Ki) are
+checked. Then, on the known plant of spin_analysis's self-test, the old
+closure from spin_at_rate (integral clamped at ±100, raw derivative) is
+compared with PID at the logged gains and at gains from a relay autotune.
+That plant is not the car: it shows what the controller does, not which
+gains suit the car.
+
+For that the spin logs are fitted with spin_analysis.fit_fopdt, and the fit
+is put through its replay check. Only a model that passes is autotuned and
+ranked; otherwise the reasons are printed and no gains are offered, as
+spin_analysis does. A synthetic log from the known plant goes through the
+same gate and must pass it.
+
+Usage: python tools/pid_check.py [--log logs/spins.txt] [--seed 1]
+"""
+import io
+import os
+import sys
+import math
+import random
+import argparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import sim
+sim.install()
+from pid import PID, RelayAutotuner
+from spin_analysis import Fopdt, TRUE, read_log, fit_fopdt, replay_mismatch, synthetic_log
+
+DT = 0.02  # The dt of the runs in logs/spins.txt and in the synthetic log
+
+class YawPlant:
+    """ A Fopdt stepped one tick at a time, so that any controller can close the loop around it. """
+    def __init__(self, model, noise=0.0, rng=None):
+        self.gain = model.gain
+        self.deadband = model.deadband
+        self.k = 1 - math.exp(-model.dt / model.tau)
+        self.pending = [0.0] * model.delay
+        self.noise = noise
+        self.rng = rng or random.Random(0)
+        self.rate = 0.0
+
+    def step(self, steering):
+        """ Apply steering for one tick; returns the measured yaw rate at the end of it. """
+        self.pending.append(steering)
+        u = self.pending.pop(0)
+        drive = math.copysign(max(0.0, abs(u) - self.deadband), u) * self.gain
+        self.rate += (drive - self.rate) * self.k
+        return self.rate + (self.rng.gauss(0, self.noise) if self.noise else 0.0)
+
+def fit(runs):
+    """ spin_analysis's model of the runs and its verdict on it: (model, reasons it isn't trusted). """
+    model = fit_fopdt(runs)
+    if model is None:
+        return None, ["no runs with both steering and a response"]
+    problems = []
+    for run in runs:
+        mismatch = replay_mismatch(model, run)
+        if mismatch:
+            problems.append("%s: %s" % (run.name, mismatch))
+    return model, problems
+
+def legacy(dps, dt, Kp, Ki, Kd, limit):
+    """ The closure spin_at_rate used before pid.PID, as a step function. """
+    state = {"integral": 0, "last_error": 0}
+
+    def step(yaw_rate):
+        error = dps - yaw_rate
+        state["integral"] = max(-100, min(100, state["integral"] + error * dt))
+        derivative = (error - state["last_error"]) / dt
+        state["last_error"] = error
+        return max(-limit, min(limit, Kp * error + Ki * state["integral"] + Kd * derivative))
+    return step
+
+def closed_loop(model, step, dps=18, seconds=10, noise=0.0, seed=1, stall=0):
+    """ Returns (rms error over the second half, overshoot, seconds the output stays pinned at its
+    maximum after the first stall seconds, during which the car is held still). """
+    plant = YawPlant(model, noise=noise, rng=random.Random(seed))
+    gain = plant.gain
+    yaw = 0.0
+    trace = []
+    outputs = []
+    for i in range(int(seconds / DT)):
+        plant.gain = 0 if i * DT < stall else gain
+        outputs.append(step(yaw))
+        yaw = plant.step(outputs[-1])
+        trace.append(yaw)
+    settled = trace[len(trace) // 2:]
+    rms = math.sqrt(sum((y - dps) ** 2 for y in settled) / len(settled))
+    pinned = 0
+    for u in outputs[int(stall / DT):]:
+        if u < 0.9 * max(outputs):
+            break
+        pinned += DT
+    return rms, max(trace) - dps, pinned
+
+def autotune(model, dps, bias, amplitude, noise, seed):
+    plant = YawPlant(model, noise=noise, rng=random.Random(seed))
+    tuner = RelayAutotuner(dps, bias, amplitude, hysteresis=2 * noise, cycles=4)
+    yaw = 0.0
+    while not tuner.done and tuner.t < 60:
+        yaw = plant.step(tuner.update(yaw, DT))
+    assert tuner.done, "relay experiment did not oscillate"
+    return tuner
+
+def check_units():
+    # Derivative on the measurement: a setpoint step must not kick the output
+    pid = PID(Kp=0.01, Ki=0.05, Kd=0.002, dt=DT)
+    pid.update(0, 0)
+    jump = pid.update(20, 0)
+    assert abs(jump - 0.01 * 20 - 0.05 * 20 * DT) < 1e-9, jump
+
+    # Bumpless: changing gains mid-run leaves the output where it was
+    pid = PID(Kp=0.01, Ki=0.05, Kd=0.002, dt=DT)
+    for y in (0, 2, 5, 9, 12):
+        pid.update(18, y)
+    before = pid.Kp * pid._last_p_error + pid.integral + pid.derivative
+    pid.set_gains(Kp=0.03, Ki=0.2)
+    after = pid.Kp * pid._last_p_error + pid.integral + pid.derivative
+    assert abs(before - after) < 1e-9, (before, after)
+
+    # Anti-windup: a long saturated stretch leaves the integrator near the limit, not far past it
+    pid = PID(Ki=0.1, dt=DT, out_min=-0.5, out_max=0.5)
+    for _ in range(500):
+        pid.update(18, 0)
+    assert pid.integral <= 0.5 + 1e-9, pid.integral
+    assert pid.update(18, 40) < 0.5, "output should come off the limit as soon as the error turns"
+
+    # Without Ki there is no integrator to wind up: P and PD outputs follow the error alone after saturating
+    for Kd in (0, 0.1):
+        pid = PID(Kp=1, Kd=Kd, dt=DT, out_min=-0.5, out_max=0.5)
+        for _ in range(50):
+            pid.update(2, 0)
+        for _ in range(50):
+            out = pid.update(2, 1.7)
+        assert pid.integral == 0 and abs(out - 0.3) < 1e-6, (Kd, pid.integral, out)
+    print("units ok: no derivative kick, bumpless gain change, integrator held at the limit, none without Ki")
+
+def compare(model, noise, seed, dps=18, limit=0.5):
+    """ Autotune on the model, then print the closed loop of each controller, with and without a 3 s stall;
+    returns {(stall, controller): (rms, overshoot, pinned s)}. """
+    tuner = autotune(model, dps, bias=model.deadband + 0.05, amplitude=0.1, noise=noise, seed=seed)
+    Ku, Pu = tuner.result()
+    print("  relay autotune: Ku %.4f, Pu %.2f s after %.1f s" % (Ku, Pu, tuner.t))
+    print("  %-52s %8s %10s %9s" % ("controller (dps %d, dt %g)" % (dps, model.dt), "rms °/s", "overshoot", "pinned s"))
+    cases = [
+        ("legacy closure, Ki 0.1 Kd 0.00015", lambda: legacy(dps, model.dt, 0, 0.1, 0.00015, limit)),
+        ("PID, Ki 0.1 Kd 0.00015", lambda: pid_step(PID(0, 0.1, 0.00015, model.dt, -limit, limit))),
+    ]
+    for rule in ("pi", "tl"):
+        Kp, Ki, Kd = tuner.gains(rule)
+        cases.append(("PID, autotuned %s (%.4f %.4f %.4f)" % (rule, Kp, Ki, Kd),
+                      lambda Kp=Kp, Ki=Ki, Kd=Kd: pid_step(PID(Kp, Ki, Kd, model.dt, -limit, limit))))
+    results = {}
+    for stall in (0, 3):
+        for name, make in cases:
+            rms, overshoot, over = closed_loop(model, make(), dps, noise=noise, seed=seed, stall=stall)
+            results[stall, name.split(" (")[0]] = (rms, overshoot, over)
+            print("  %-52s %8.2f %10.2f %9.2f" % (name + (", 3 s stall" if stall else ""), rms, overshoot, over))
+    return results
+
+def describe(model):
+    text = "gain %.0f °/s, deadband %.2f, tau %.3f s, delay %d ticks" % (model.gain, model.deadband, model.tau, model.delay)
+    return text + (" (one-step rms %.1f °/s)" % model.rms if model.rms == model.rms else "")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", default=os.path.join(ROOT, "logs", "spins.txt"))
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    check_units()
+
+    known = Fopdt(dt=DT, **TRUE)
+    print("known plant (spin_analysis.TRUE): " + describe(known))
+    results = compare(known, noise=1.0, seed=args.seed)
+    legacy_rms = results[0, "legacy closure, Ki 0.1 Kd 0.00015"][0]
+    assert min(results[0, "PID, autotuned pi"][0], results[0, "PID, autotuned tl"][0]) < legacy_rms, "autotuned gains should track better"
+    # Held still, the old closure winds its integral up and then stays saturated long after release;
+    # with back-calculation the output comes off the limit as soon as the car moves
+    assert results[3, "PID, Ki 0.1 Kd 0.00015"][2] < results[3, "legacy closure, Ki 0.1 Kd 0.00015"][2] / 2, "anti-windup should cut the time spent saturated"
+    print("closed loop ok")
+
+    # The gate: a log of the known plant must yield a model the replay check trusts
+    model, problems = fit(list(read_log(io.StringIO(synthetic_log(6, args.seed)), "synthetic", DT)))
+    assert not problems, problems
+
+    with open(args.log, encoding="utf-8", errors="replace") as f:
+        runs = list(read_log(f, args.log, DT))
+    model, problems = fit(runs)
+    print("plant fitted from %d runs / %d samples: %s" % (len(runs), sum(len(run.yaw) for run in runs),
+                                                         describe(model) if model else "none"))
+    if problems:
+        print("  not trusted by spin_analysis's replay check, so no gains are tuned or ranked for the car:")
+        for problem in problems:
+            print("    " + problem)
+        return
+    compare(model, noise=model.rms / 2, seed=args.seed)
+def pid_step(pid, dps=18):
+    return lambda yaw: pid.update(dps, yaw)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+""" Checks for the cooperative Scheduler on a simulated clock.
+
+Tasks model their CPU time by advancing the SimClock, so every release,
+start and finish time is known exactly. Checks drift-free release times,
+priority on shared ticks, jitter when a slow task blocks a fast one, overrun
+and deadline-miss counting, that idle time is spent sleeping, and that a
+task raising doesn't stop the others; and that Periodic runs its function
+as a task or from a Timer and stops either. Finishes with a short run on
+the real clock to show host-side jitter.
+
+Usage: python tools/scheduler_check.py
+"""
+import io
+import os
+import sys
+import time
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+from sim.clock import SimClock
+from scheduler import Scheduler, Periodic
+
+def recorder(clock, log, name, cost_us=0):
+    def run():
+        log.append((name, clock.now()))
+        clock.advance(cost_us)
+    return run
+
+def check_fixed_rate():
+    clock = SimClock()
+    s = Scheduler(clock)
+    log = []
+    fast = s.every(10, recorder(clock, log, "fast", 300), "fast")
+    slow = s.every(50, recorder(clock, log, "slow", 700), "slow")
+    s.run(10000)
+
+    assert fast.runs == 1000 and slow.runs == 200, (fast.runs, slow.runs)
+    # Releases stay on the 10 ms grid: lateness never accumulates
+    fast_starts = [t for n, t in log if n == "fast"]
+    assert all(t == i * 10000 for i, t in enumerate(fast_starts)), fast_starts[:5]
+    # On shared ticks the earlier-registered task runs first, so slow starts after fast's 300 us
+    assert slow.max_jitter == 300 and fast.max_jitter == 0
+    assert fast.misses == fast.overruns == slow.misses == slow.overruns == 0
+    # Everything else is spent asleep, in one sleep per idle gap
+    busy = 1000 * 300 + 200 * 700
+    assert s.idle == 10000000 - busy, s.idle
+    assert clock.sleeps <= fast.runs + slow.runs
+    print("fixed rate ok: %d + %d runs, %.1f%% idle, %d sleeps" % (fast.runs, slow.runs, s.idle / 1e5, clock.sleeps))
+
+def check_blocking_jitter():
+    clock = SimClock()
+    s = Scheduler(clock)
+    fast = s.every(5, recorder(clock, [], "fast", 100), "fast")
+    blocker = s.every(100, recorder(clock, [], "blocker", 3000), "blocker", phase_ms=4)
+    s.run(1000)
+    # The fast release at 5 ms waits for the blocker that started at 4 ms and runs 3 ms
+    assert fast.max_jitter == 2000, fast.max_jitter
+    assert fast.total_jitter == 2000 * blocker.runs
+    assert fast.misses == fast.overruns == 0
+    print("blocking jitter ok: fast task max jitter %d us, mean %.0f us" % (fast.max_jitter, fast.mean_jitter()))
+
+def check_overruns():
+    clock = SimClock()
+    s = Scheduler(clock)
+    n = [0]
+
+    def sometimes_slow():
+        n[0] += 1
+        # Every 10th run takes 2.5 periods: it misses its deadline and skips two releases
+        clock.advance(25000 if n[0] % 10 == 0 else 1000)
+
+    task = s.every(10, sometimes_slow, "control")
+    s.run(1000)
+    # Each slow run finishes 15 ms past the next release, so it skips exactly two
+    assert task.misses == task.overruns / 2, (task.misses, task.overruns)
+    assert task.max_duration == 25000
+    assert task.due % 10000 == 0, "releases must stay on the original grid"
+    assert task.runs + task.overruns >= 99, (task.runs, task.overruns)
+    print("overruns ok: %d runs, %d deadline misses, %d skipped releases" % (task.runs, task.misses, task.overruns))
+
+    # A deadline shorter than the period counts misses without skipping releases
+    clock = SimClock()
+    s = Scheduler(clock)
+    task = s.every(10, lambda: clock.advance(3000), "tight", deadline_ms=2)
+    s.run(100)
+    assert task.misses == task.runs == 10 and task.overruns == 0, (task.misses, task.runs, task.overruns)
+    print("deadlines ok: %d of %d runs past a 2 ms deadline" % (task.misses, task.runs))
+
+def check_stop():
+    clock = SimClock()
+    s = Scheduler(clock)
+    runs = []
+
+    def until_five():
+        runs.append(clock.now())
+        if len(runs) == 5:
+            s.stop()
+
+    s.every(20, until_five)
+    s.run()
+    assert len(runs) == 5 and clock.now() == 80000
+    print("stop ok")
+
+def check_errors():
+    clock = SimClock()
+    s = Scheduler(clock)
+    runs = []
+
+    def flaky():
+        runs.append(clock.now())
+        if len(runs) % 3 == 0:
+            raise OSError(19)  # ENODEV, as from an I2C read
+
+    bad = s.every(10, flaky, "flaky")
+    good = s.every(10, lambda: None, "failsafe")
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        s.run(1000)
+        s.report()
+    assert good.runs == 100 and bad.runs == 100 and bad.errors == 33, (good.runs, bad.runs, bad.errors)
+    assert isinstance(bad.error, OSError) and good.errors == 0
+    assert out.getvalue().count("raised") == 1 and "errors 33" in out.getvalue(), out.getvalue()
+    print("errors ok: a raising task is counted and the others keep running")
+
+def check_periodic():
+    clock = SimClock()
+    s = Scheduler(clock)
+    runs = []
+    on_task = Periodic(10, lambda: runs.append("task"), "periodic", s)
+    assert on_task.timer is None and s.tasks == [on_task.task]
+    s.run(100)
+    on_task.stop()
+    on_task.stop()
+    assert runs == ["task"] * 10 and s.tasks == []
+
+    on_timer = Periodic(10, lambda: runs.append("timer"))
+    time.sleep(0.1)
+    on_timer.stop()
+    fired = runs.count("timer")
+    time.sleep(0.05)
+    assert on_timer.task is None and fired >= 3 and runs.count("timer") == fired, fired
+
+    never = Periodic(None, lambda: runs.append("never"), scheduler=s)
+    s.run(100)
+    never.stop()
+    assert "never" not in runs and s.tasks == []
+    print("periodic ok: as a task or from a Timer, stopped either way; interval None runs nothing")
+
+def check_real_clock():
+    s = Scheduler()
+    task = s.every(10, lambda: None, "noop")
+    s.run(500)
+    print("real clock (host, informational): %d runs in 500 ms, jitter mean %.0f us max %d us, %d overruns"
+          % (task.runs, task.mean_jitter(), task.max_jitter, task.overruns))
+    assert 35 <= task.runs <= 51, task.runs
+
+def main():
+    check_fixed_rate()
+    check_blocking_jitter()
+    check_overruns()
+    check_stop()
+    check_errors()
+    check_periodic()
+    check_real_clock()
+
+if __name__ == "__main__":
+    main()
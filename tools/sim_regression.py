@@ -0,0 +1,90 @@
+""" Regression runs of main.spin_at_rate and main.aim_up against the differential-drive simulator.
+
+Each scenario runs the unmodified car code under sim.drive.Simulation, which
+drives a physics model from the car's PWM and pin writes and feeds the MPU6050
+register model from it, all on simulated time. Console output of the car code
+is captured and summarised, and the outcome is checked against ground truth
+from the model.
+
+Usage: python tools/sim_regression.py [--verbose]
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import main as app
+from car import get_car
+from mpu6050 import get_mpu
+from sim.drive import Simulation
+
+with contextlib.redirect_stdout(io.StringIO()):
+    car, mpu = get_car(), get_mpu()
+
+def run(name, func, verbose=False, **world):
+    log = io.StringIO()
+    start = time.perf_counter()
+    with Simulation(car, mpu, **world) as simulation:
+        with contextlib.redirect_stdout(sys.stdout if verbose else log):
+            result = func(simulation)
+    wall = time.perf_counter() - start
+    print("%-36s %6.1f s simulated in %5.2f s (%4.0fx)" % (name, simulation.elapsed, wall, simulation.elapsed / wall))
+    return simulation, result, log.getvalue()
+
+def yaw_sampler(simulation, samples):
+    # Ground-truth yaw rate every simulated 20 ms, clockwise positive like spin_at_rate's Y
+    next_t = [0.0]
+
+    def listener(us):
+        if simulation.elapsed >= next_t[0]:
+            samples.append((simulation.elapsed, -simulation.drive.yaw_rate))
+            next_t[0] += 0.02
+    simulation.clock.listeners.append(listener)
+
+def check_spin(verbose):
+    samples = []
+
+    def spin(simulation):
+        yaw_sampler(simulation, samples)
+        app.spin_at_rate(dps=18, timeout=10, dt=0.02, Kp=0.002, Ki=0.01, Kd=0, limit=0.5, sample_rate=5)
+
+    simulation, _, log = run("spin_at_rate(dps=18, PI)", spin, verbose)
+    # Skip the 5 s countdown and the first 4 s of spin-up
+    settled = [y for t, y in samples if t > 9]
+    mean = sum(settled) / len(settled)
+    logged = [float(line.split()[1].rstrip(",")) for line in log.splitlines() if line.startswith("Y: ")]
+    print("    true yaw rate after spin-up: mean %.1f °/s (target 18), min %.1f, max %.1f; %d control ticks logged"
+          % (mean, min(settled), max(settled), len(logged)))
+    assert abs(mean - 18) < 4, mean
+    assert 480 <= len(logged) <= 500, len(logged)
+    assert "pid: runs" in log and "overruns 0" in log, "scheduler report missing or overruns on simulated time"
+
+def check_aim_up(verbose, start_heading, timeout=30000):
+    def aim(simulation):
+        app.aim_up(timeout=timeout)
+
+    simulation, _, log = run("aim_up(10° slope, start %d°)" % start_heading, aim, verbose,
+                             incline=10, uphill=0, heading=start_heading, vibration=0.05, gyro_noise=0.2)
+    error = (simulation.drive.heading - simulation.drive.uphill + 180) % 360 - 180
+    start = (start_heading + 180) % 360 - 180
+    print("    heading error from uphill: %.1f° -> %.1f°" % (start, error))
+    # Steering is proportional to total - pitch, which shrinks like 1 - cos(error), so the last
+    # few tens of degrees sit near the motor deadband: aim_up closes in slowly but must not overshoot
+    assert abs(error) < abs(start) / 2 and error * start > 0, error
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="show the car code's console output")
+    args = parser.parse_args()
+    check_spin(args.verbose)
+    for heading in (90, -120, 150):
+        check_aim_up(args.verbose, heading)
+    print("simulation regression ok")
+
+if __name__ == "__main__":
+    main()
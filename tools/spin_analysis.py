@@ -0,0 +1,450 @@
+""" Spin log analytics and yaw-plant identification (host-side, needs NumPy).
+
+Reads the console output of main.spin_at_rate in both print formats it
+has had ("Yaw: 9.35°/s, Target: 9°/s, Error: -0.35, Steering: 0.25" and
+the later "Y: 9.35, T: 9, E: -0.35, S: 0.25"), with the ">>> spin_at_rate(...)"
+line that starts each run, and binary telemetry captures saved with
+tools/telemetry_decode.py --save. Lines are streamed and each run becomes
+one NumPy array.
+
+Per run: rise time (10-90% of the target), overshoot, steady-state error
+over the last quarter, and the dominant oscillation frequency once risen.
+
+Then, for all runs that share a sample period, a first-order-plus-dead-time
+model with the motors' steering deadband is fitted by least squares:
+    yaw[k+1] = a * yaw[k] + (1 - a) * K * dz(S[k - d]),  a = exp(-dt / tau)
+where dz() subtracts the deadband. Each run's own gains are replayed on
+the model as a check, and PI gains are suggested with the SIMC rules, with
+their predicted response. Every replay is also compared with its log (mean
+yaw second by second, and mean tracking error), and if any is too far off
+the suggestion is withheld with a warning: such a model doesn't describe
+the car, and gains tuned on it mean nothing.
+
+Usage:
+    python tools/spin_analysis.py logs/spin1.txt logs/spin2.txt logs/spins.txt
+    python tools/spin_analysis.py capture.bin --target 18 --dt 0.02
+    python tools/spin_analysis.py --selftest [--runs 2000]
+"""
+import io
+import os
+import re
+import sys
+import math
+import time
+import random
+import struct
+import argparse
+import tempfile
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+from pid import PID
+from telemetry import RECORD_FORMAT, RECORD_SIZE, FIELDS, SCALES
+
+# Both spin_at_rate formats; the degree sign is often mangled in captured logs, so units are skipped
+LINE = re.compile(r"(?:Y|Yaw): *(-?[\d.]+)[^,]*, *(?:T|Target): *(-?[\d.]+)[^,]*, *(?:E|Error): *-?[\d.]+, *(?:S|Steering): *(-?[\d.]+)")
+PARAM = re.compile(r"(\w+) *= *(-?[\d.]+(?:[eE]-?\d+)?)")
+LIMIT = 0.5  # spin_at_rate's default output limit
+
+# How far a replay on the model may be from its log for the model to be trusted, as fractions of the target
+WINDOW_TOLERANCE = 0.35  # Mean yaw over any one second
+ERROR_TOLERANCE = 0.25   # Mean absolute tracking error over the run (the log's noise alone adds about 0.1)
+
+class SpinRun:
+    """ One spin_at_rate run: yaw rate (°/s, clockwise positive), target and steering per control tick. """
+    def __init__(self, source, index, params, dt, data):
+        self.source = source
+        self.index = index
+        self.params = params
+        self.dt = dt
+        self.yaw = data[:, 0]
+        self.target = data[:, 1]
+        self.steering = data[:, 2]
+
+    @property
+    def name(self):
+        return "%s:%d" % (os.path.basename(self.source), self.index)
+
+    def gains(self):
+        p = self.params
+        limit = p.get("limit") or max(LIMIT, float(np.abs(self.steering).max()))
+        return p.get("Kp", 0.0), p.get("Ki", 0.0), p.get("Kd", 0.0), limit
+
+# Reading
+def _run_dt(params, default):
+    if "dt" in params:
+        return params["dt"]
+    if "interval" in params:
+        return params["interval"] / 1000  # The first spin_at_rate took its period in ms
+    return default
+
+def read_log(stream, source="log", dt=None):
+    """ Yield a SpinRun per run in a console log (an iterable of lines) as each run ends.
+    dt is the control period for runs whose header doesn't give one (default 0.05 s). """
+    params = {}
+    lines = []
+    chunks = []
+    index = 0
+
+    def convert():
+        values = LINE.findall("\n".join(lines))
+        if values:
+            chunks.append(np.array(values, dtype=float))
+        del lines[:]
+
+    def flush():
+        convert()
+        if chunks:
+            data = np.concatenate(chunks)
+            del chunks[:]
+            return SpinRun(source, index, params, _run_dt(params, dt or 0.05), data)
+
+    for line in stream:
+        if line.startswith(">>>"):
+            run = flush()
+            if run:
+                yield run
+                index += 1
+            params = {k: float(v) for k, v in PARAM.findall(line)} if "spin_at_rate" in line else {}
+            line = line[3:]  # The prompt sometimes runs into the first line of output
+        lines.append(line)
+        if len(lines) >= 1024:
+            convert()  # Regex over a block at a time, so a long run doesn't pile up as text
+    run = flush()
+    if run:
+        yield run
+
+def read_telemetry(path, target, dt=None, chunk=4096):
+    """ One SpinRun from a binary telemetry capture, read chunk records at a time. """
+    codes = {"H": "<u2", "I": "<u4", "h": "<i2"}
+    dtype = np.dtype([(name, codes[code]) for name, code in zip(FIELDS, RECORD_FORMAT[1:])])
+    parts = []
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk * RECORD_SIZE)
+            whole = len(data) - len(data) % RECORD_SIZE
+            if whole:
+                parts.append(np.frombuffer(data[:whole], dtype))
+            if len(data) < chunk * RECORD_SIZE:
+                break
+    records = np.concatenate(parts)
+    scale = dict(zip(FIELDS, SCALES))
+    if dt is None:
+        dt = float(np.median(np.diff(records["ms"].astype(np.int64)))) / 1000
+    yaw = -records["gz"] / scale["gz"]  # spin_at_rate's sign: clockwise positive
+    steering = records["steering"] / scale["steering"]
+    data = np.column_stack((yaw, np.full(len(yaw), float(target)), steering))
+    return SpinRun(path, 0, {"dps": float(target)}, dt, data)
+
+def read_runs(paths, dt=None, target=None):
+    """ SpinRuns from console logs and .bin telemetry captures, one file at a time. """
+    for path in paths:
+        if path.endswith(".bin"):
+            yield read_telemetry(path, target, dt)
+        else:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield from read_log(f, path, dt)
+
+# Step-response metrics
+def metrics(yaw, target, dt):
+    """ (rise time s, overshoot %, steady-state error °/s, oscillation Hz, oscillation rms °/s); nan where undefined. """
+    n = len(yaw)
+    rise = overshoot = nan = float("nan")
+    above10 = np.flatnonzero(yaw >= 0.1 * target)
+    above90 = np.flatnonzero(yaw >= 0.9 * target)
+    risen = above90[0] if len(above90) else None
+    if risen is not None and len(above10):
+        rise = (risen - above10[0]) * dt
+        overshoot = max(0.0, (float(yaw[risen:].max()) - target) / target * 100)
+    steady = float(target - yaw[n - n // 4:].mean()) if n >= 4 else nan
+
+    segment = yaw[risen if risen is not None else n // 2:]
+    freq = amplitude = nan
+    if len(segment) >= 16:
+        segment = segment - segment.mean()
+        spectrum = np.abs(np.fft.rfft(segment * np.hanning(len(segment))))
+        peak = int(np.argmax(spectrum[1:])) + 1
+        freq = float(np.fft.rfftfreq(len(segment), dt)[peak])
+        amplitude = float(segment.std())
+    return rise, overshoot, steady, freq, amplitude
+
+def run_metrics(run):
+    return metrics(run.yaw, float(np.median(run.target)), run.dt)
+
+# Plant model
+class Fopdt:
+    """ First order plus dead time with a steering deadband, stepped at dt. """
+    def __init__(self, gain, tau, delay, deadband, dt, rms=float("nan")):
+        self.gain = gain          # °/s per unit of steering past the deadband
+        self.tau = tau            # s
+        self.delay = delay        # Whole ticks between a steering output and its first effect
+        self.deadband = deadband
+        self.dt = dt
+        self.rms = rms            # One-step prediction error of the fit, °/s
+
+    @property
+    def theta(self):
+        return self.delay * self.dt
+
+    def simulate(self, gains, dps, seconds, noise=0.0, rng=None):
+        """ Closed loop with pid.PID the way spin_at_rate runs it; returns (yaw, steering) arrays. """
+        Kp, Ki, Kd, limit = gains
+        pid = PID(Kp, Ki, Kd, self.dt, -limit, limit)
+        a = math.exp(-self.dt / self.tau)
+        b = (1 - a) * self.gain
+        pending = [0.0] * self.delay
+        y = 0.0
+        yaw = []
+        steering = []
+        for _ in range(int(seconds / self.dt)):
+            measured = y + (rng.gauss(0, noise) if noise else 0.0)
+            u = pid.update(dps, measured)
+            yaw.append(measured)
+            steering.append(u)
+            pending.append(u)
+            u = pending.pop(0)
+            y = a * y + b * math.copysign(max(0.0, abs(u) - self.deadband), u)
+        return np.array(yaw), np.array(steering)
+
+def fit_fopdt(runs, max_delay=6, deadbands=np.arange(0.0, 0.42, 0.02)):
+    """ Least-squares Fopdt for runs sharing one dt: a linear fit of (a, b) for every delay and deadband on a grid. """
+    dt = runs[0].dt
+    gap = np.full(max_delay + 1, np.nan)  # Between runs, so no regressor reaches into the next one
+    y = np.concatenate([part for run in runs for part in (run.yaw, gap)])
+    u = np.concatenate([part for run in runs for part in (run.steering, gap)])
+    best = None
+    for delay in range(max_delay + 1):
+        k = np.arange(max_delay, len(y) - 1)
+        nxt, now, lagged = y[k + 1], y[k], u[k - delay]
+        ok = np.isfinite(nxt) & np.isfinite(now) & np.isfinite(lagged)
+        nxt, now, lagged = nxt[ok], now[ok], lagged[ok]
+        sign, magnitude = np.sign(lagged), np.abs(lagged)
+        for deadband in deadbands:
+            x = sign * np.maximum(magnitude - deadband, 0.0)
+            # Normal equations of nxt ~ a * now + b * x
+            s_yy, s_yx, s_xx = now @ now, now @ x, x @ x
+            r_y, r_x = now @ nxt, x @ nxt
+            det = s_yy * s_xx - s_yx * s_yx
+            if det <= 0:
+                continue
+            a = (r_y * s_xx - r_x * s_yx) / det
+            b = (r_x * s_yy - r_y * s_yx) / det
+            if not 0 < a < 1 or b <= 0:
+                continue
+            sse = float(nxt @ nxt - 2 * (a * r_y + b * r_x) + a * a * s_yy + 2 * a * b * s_yx + b * b * s_xx)
+            if best is None or sse < best[0]:
+                best = (sse, a, b, delay, float(deadband), len(nxt))
+    if best is None:
+        return None
+    sse, a, b, delay, deadband, count = best
+    return Fopdt(b / (1 - a), -dt / math.log(a), delay, deadband, dt, math.sqrt(max(sse, 0.0) / count))
+
+def simc_gains(model, tc=None, limit=LIMIT):
+    """ SIMC PI gains (Skogestad) for the model; tc is the closed-loop time constant (default: the dead time).
+    Half a tick is added to the dead time for the sample-and-hold of the digital loop. """
+    theta = model.theta + model.dt / 2
+    tc = theta if tc is None else tc
+    Kp = model.tau / (model.gain * (tc + theta))
+    Ti = min(model.tau, 4 * (tc + theta))
+    return Kp, Kp / Ti, 0.0, limit
+
+def replay_mismatch(model, run):
+    """ Why replaying a run's gains on the model doesn't reproduce its log, or "" if it does.
+
+    Compared on quantities measurement noise and oscillation phase don't move much:
+    the mean yaw over each second (how fast and where it settles), and the mean
+    absolute tracking error over the run (how hard it oscillates).
+    """
+    dps = float(np.median(run.target))
+    yaw, _ = model.simulate(run.gains(), dps, len(run.yaw) * run.dt)
+    n = min(len(yaw), len(run.yaw))
+    predicted, logged = yaw[:n], run.yaw[:n]
+    reasons = []
+    w = max(10, int(round(1 / run.dt)))
+    m = n // w * w
+    if m:
+        means = np.abs(predicted[:m].reshape(-1, w).mean(1) - logged[:m].reshape(-1, w).mean(1)) / dps
+        worst = int(np.argmax(means))
+        if means[worst] > WINDOW_TOLERANCE:
+            reasons.append("mean yaw %.0f%% of the target off the log in second %d" % (100 * means[worst], worst + 1))
+    error, error_logged = (float(np.mean(np.abs(dps - y))) / dps for y in (predicted, logged))
+    if abs(error - error_logged) > ERROR_TOLERANCE:
+        reasons.append("mean tracking error %.0f%% of the target vs %.0f%% logged" % (100 * error, 100 * error_logged))
+    return ", ".join(reasons)
+
+# Report
+def _f(value, fmt):
+    return ("%" + fmt) % value if value == value else "-".rjust(int(fmt.split(".")[0]))
+
+def analyse(runs, verbose=True):
+    """ Metrics per run and a fit per sample period; returns ({dt: model}, [(run, metrics)]). """
+    results = []
+    groups = {}
+    for run in runs:
+        m = run_metrics(run)
+        results.append((run, m))
+        groups.setdefault(run.dt, []).append(run)
+    if verbose:
+        print("%-16s %4s %8s %8s %8s %6s %8s %8s %8s %8s %8s" % ("run", "dps", "Kp", "Ki", "Kd", "ticks", "rise s",
+                                                              "over %", "ss err", "osc Hz", "osc rms"))
+        for run, (rise, over, steady, freq, amp) in results[:40]:
+            Kp, Ki, Kd, _ = run.gains()
+            print("%-16s %4.0f %8.4g %8.4g %8.4g %6d %8s %8s %8s %8s %8s" % (
+                run.name, np.median(run.target), Kp, Ki, Kd, len(run.yaw), _f(rise, "8.2f"), _f(over, "8.1f"),
+                _f(steady, "8.2f"), _f(freq, "8.2f"), _f(amp, "8.2f")))
+        if len(results) > 40:
+            print("... %d more runs" % (len(results) - 40))
+    models = {dt: fit_fopdt(group) for dt, group in groups.items()}
+    return models, results
+
+def report_model(dt, model, group, results):
+    """ Print the model, the replays against their logs, and suggested gains if the model is trusted; returns whether it is. """
+    print("\ndt %.3f s, %d runs: K %.0f °/s per unit steering, tau %.3f s, dead time %d ticks (%.3f s), deadband %.2f, "
+          "one-step rms %.2f °/s" % (dt, len(group), model.gain, model.tau, model.delay, model.theta, model.deadband, model.rms))
+    print("  %-36s %8s %8s %8s %8s" % ("replayed on the model", "rise s", "over %", "ss err", "osc Hz"))
+    seen = set()
+    problems = []
+    for run, logged in results:
+        gains = run.gains()
+        dps = float(np.median(run.target))
+        if run.dt != dt or (gains, dps) in seen:
+            continue
+        seen.add((gains, dps))
+        yaw, _ = model.simulate(gains, dps, len(run.yaw) * dt)
+        predicted = metrics(yaw, dps, dt)
+        label = "Kp %.3g Ki %.3g Kd %.3g" % gains[:3]
+        print("  %-36s %8s %8s %8s %8s" % (label + " (model)", _f(predicted[0], "8.2f"), _f(predicted[1], "8.1f"),
+                                           _f(predicted[2], "8.2f"), _f(predicted[3], "8.2f")))
+        print("  %-36s %8s %8s %8s %8s" % ("  logged " + run.name, _f(logged[0], "8.2f"), _f(logged[1], "8.1f"),
+                                           _f(logged[2], "8.2f"), _f(logged[3], "8.2f")))
+    for run in group:
+        mismatch = replay_mismatch(model, run)
+        if mismatch:
+            problems.append("%s: %s" % (run.name, mismatch))
+    if problems:
+        print("  WARNING: the model doesn't reproduce the logs, so no gains are suggested:")
+        for problem in problems:
+            print("    " + problem)
+        print("  Log more runs with steps of different sizes (and check the sample period) before trusting a fit.")
+        return False
+    dps = float(np.median(np.concatenate([run.target for run in group])))
+    print("  suggested (SIMC PI, target %.0f °/s; pass to spin_at_rate):" % dps)
+    for name, tc in (("tight, tc = dead time", None), ("smooth, tc = 3x dead time", 3 * (model.theta + dt / 2))):
+        gains = simc_gains(model, tc)
+        rise, over, steady, freq, _ = metrics(model.simulate(gains, dps, 10)[0], dps, dt)
+        print("    %-28s Kp=%.4f, Ki=%.4f, Kd=0   predicted rise %s s, overshoot %s %%, ss err %s"
+              % (name, gains[0], gains[1], _f(rise, ".2f"), _f(over, ".1f"), _f(steady, ".2f")))
+    return True
+
+# Self-test on synthetic logs from a known plant
+TRUE = dict(gain=220.0, tau=0.08, delay=2, deadband=0.2)
+
+def synthetic_log(runs, seed, binary=None):
+    """ Text of a console log with runs of spin_at_rate on the TRUE plant, alternating both print formats. """
+    rng = random.Random(seed)
+    model = Fopdt(dt=0.02, **TRUE)
+    out = io.StringIO()
+    for i in range(runs):
+        dps = rng.choice((9, 18, 27))
+        gains = (rng.choice((0, 0.002, 0.005)), rng.choice((0.05, 0.1, 0.2)), 0, LIMIT)
+        yaw, steering = model.simulate(gains, dps, 8, noise=1.0, rng=rng)
+        print(">>> spin_at_rate(dps = %d, timeout = 8, dt = 0.02, Kp = %g, Ki = %g, Kd = 0, limit = %g)"
+              % (dps, gains[0], gains[1], LIMIT), file=out)
+        print("Starting spin in 5 seconds...", file=out)
+        for y, s in zip(yaw, steering):
+            if i % 2:
+                print("Yaw: %.2f°/s, Target: %d°/s, Error: %.2f, Steering: %.2f" % (y, dps, dps - y, s), file=out)
+            else:
+                print("Y: %.2f, T: %d, E: %.2f, S: %.2f" % (y, dps, dps - y, s), file=out)
+        print("Spin complete.", file=out)
+        if binary and i == 0:
+            with open(binary, "wb") as f:
+                for k, (y, s) in enumerate(zip(yaw, steering)):
+                    f.write(struct.pack(RECORD_FORMAT, k, k * 20, 0, 0, int(round(-y * 100)), 0, 0, 0,
+                                        int(round(s * 1000)), 0, 0))
+    return out.getvalue()
+
+def selftest(total):
+    folder = tempfile.mkdtemp()
+    capture = os.path.join(folder, "capture.bin")
+    text = synthetic_log(24, 1, capture)
+    runs = list(read_log(io.StringIO(text), "synthetic"))
+    assert len(runs) == 24 and all(run.dt == 0.02 and len(run.yaw) == 400 for run in runs)
+    assert abs(runs[1].yaw[5] - float(text.split("Yaw: ")[6].split("°")[0])) < 1e-9, "old format parsed"
+
+    # Binary telemetry of run 0 gives the same metrics as its text
+    from_bin = read_telemetry(capture, np.median(runs[0].target))
+    assert from_bin.dt == 0.02 and np.allclose(from_bin.yaw, runs[0].yaw, atol=0.006)
+    assert np.allclose(run_metrics(from_bin), run_metrics(runs[0]), atol=0.05, equal_nan=True)
+
+    # Metrics on a response with known properties
+    dt = 0.01
+    t = np.arange(0, 5, dt)
+    wn, zeta = 2 * math.pi, 0.3
+    wd = wn * math.sqrt(1 - zeta ** 2)
+    step = 10 * (1 - np.exp(-zeta * wn * t) * (np.cos(wd * t) + zeta / math.sqrt(1 - zeta ** 2) * np.sin(wd * t)))
+    rise, over, steady, freq, _ = metrics(step + 0.5 * np.sin(2 * math.pi * 7 * t) * (t > 2), 10, dt)
+    assert abs(over - 100 * math.exp(-zeta * math.pi / math.sqrt(1 - zeta ** 2))) < 3, over
+    assert 0.1 < rise < 0.25 and abs(steady) < 0.3 and abs(freq - 7) < 0.3, (rise, steady, freq)
+
+    # The fit recovers the plant
+    model = fit_fopdt(runs)
+    print("fitted: K %.0f (true %.0f), tau %.3f (%.3f), dead time %d (%d) ticks, deadband %.2f (%.2f), rms %.2f"
+          % (model.gain, TRUE["gain"], model.tau, TRUE["tau"], model.delay, TRUE["delay"], model.deadband, TRUE["deadband"], model.rms))
+    assert model.delay == TRUE["delay"] and abs(model.deadband - TRUE["deadband"]) <= 0.021
+    assert abs(model.gain / TRUE["gain"] - 1) < 0.1 and abs(model.tau / TRUE["tau"] - 1) < 0.2
+    results = [(run, run_metrics(run)) for run in runs]
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        trusted = report_model(0.02, model, runs, results)
+    assert trusted and "suggested (SIMC" in out.getvalue(), out.getvalue()
+
+    # A model of another plant must fail the replay check and suggest nothing
+    wrong = Fopdt(TRUE["gain"] / 3, TRUE["tau"] * 4, TRUE["delay"], 0.0, 0.02)
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        trusted = report_model(0.02, wrong, runs, results)
+    assert not trusted and "WARNING" in out.getvalue() and "Kp=" not in out.getvalue(), out.getvalue()
+    print("replay check: fitted model trusted, a wrong one rejected")
+
+    # Scale: the same log repeated to total runs, streamed from disk
+    path = os.path.join(folder, "many.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(total // 24 + 1):
+            f.write(text)
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    with open(path, encoding="utf-8") as f:
+        models, results = analyse(read_log(f, path), verbose=False)
+    took = time.perf_counter() - start
+    print("%d runs (%d samples, %.1f MB of log) parsed, measured and fitted in %.2f s"
+          % (len(results), sum(len(run.yaw) for run, _ in results), size / 1e6, took))
+    assert models[0.02].delay == TRUE["delay"] and took < 30
+    print("spin analysis ok")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", help="console logs, or .bin telemetry captures")
+    parser.add_argument("--dt", type=float, default=None, help="control period in s when a log doesn't say (default 0.05; captures: from the timestamps)")
+    parser.add_argument("--target", type=float, default=18, help="yaw-rate target of a telemetry capture, °/s")
+    parser.add_argument("--selftest", action="store_true")
+    parser.add_argument("--runs", type=int, default=2000, help="runs in the self-test's scale check")
+    args = parser.parse_args()
+    if args.selftest:
+        selftest(args.runs)
+        return
+    if not args.paths:
+        parser.error("give logs to analyse, or --selftest")
+    runs = list(read_runs(args.paths, args.dt, args.target))
+    models, results = analyse(runs)
+    for dt, model in sorted(models.items()):
+        group = [run for run in runs if run.dt == dt]
+        if model is None:
+            print("\ndt %.3f s: no fit (no runs with both steering and a response)" % dt)
+            continue
+        report_model(dt, model, group, results)
+
+if __name__ == "__main__":
+    main()
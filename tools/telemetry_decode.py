@@ -0,0 +1,182 @@
+""" Host-side decoder for the binary telemetry stream.
+
+Streams live from the car, or decodes a capture saved with --save, and prints
+scaled CSV rows. Gaps in the sequence numbers (records the car dropped
+because the reader fell behind) are reported on stderr.
+
+Usage:
+    python tools/telemetry_decode.py ws://192.168.137.36/telemetry [--save capture.bin]
+    python tools/telemetry_decode.py capture.bin
+    python tools/telemetry_decode.py --selftest
+"""
+import os
+import sys
+import struct
+import asyncio
+import argparse
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+from telemetry import RECORD_FORMAT, RECORD_SIZE, FIELDS, SCALES
+import wsclient
+
+class Decoder:
+    """ Turns concatenated records into scaled rows and tracks sequence gaps. """
+    def __init__(self):
+        self.last_seq = None
+        self.records = 0
+        self.dropped = 0
+        self.pending = b""
+
+    def feed(self, data):
+        """ Decode whole records from data (partial trailing records are kept); yields rows. """
+        data = self.pending + data
+        whole = len(data) - len(data) % RECORD_SIZE
+        self.pending = data[whole:]
+        for values in struct.iter_unpack(RECORD_FORMAT, data[:whole]):
+            seq = values[0]
+            if self.last_seq is not None:
+                gap = (seq - self.last_seq - 1) & 0xFFFF
+                if gap:
+                    self.dropped += gap
+                    print("# gap: %d records dropped before seq %d" % (gap, seq), file=sys.stderr)
+            self.last_seq = seq
+            self.records += 1
+            yield [v / s if s != 1 else v for v, s in zip(values, SCALES)]
+
+def print_row(row):
+    print(",".join(str(round(v, 3)) for v in row))
+
+async def stream(url, save=None, limit=None):
+    parsed = urlparse(url)
+    reader, writer = await wsclient.connect(parsed.hostname, parsed.port or 80, parsed.path or "/telemetry")
+    decoder = Decoder()
+    out = open(save, "wb") if save else None
+    try:
+        while limit is None or decoder.records < limit:
+            opcode, payload = await wsclient.read_frame(reader)
+            if opcode == wsclient.CLOSE:
+                break
+            if opcode != wsclient.BINARY:
+                continue
+            if out:
+                out.write(payload)
+            for row in decoder.feed(payload):
+                print_row(row)
+    finally:
+        if out:
+            out.close()
+        writer.close()
+    return decoder
+
+def decode_file(path):
+    decoder = Decoder()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(64 * RECORD_SIZE)
+            if not chunk:
+                break
+            for row in decoder.feed(chunk):
+                print_row(row)
+    return decoder
+
+def selftest():
+    """ Stream from an in-process server fed by fake sensors; check back-pressure drops oldest and split frames stay in step. """
+    import web
+    from telemetry import Telemetry
+    from sim.machine import Pin, PWM
+
+    class FakeMPU:
+        def __init__(self):
+            self.t = 0
+
+        def get_motion(self):
+            self.t += 1
+            return (0.01 * self.t, -1.5, 12.25, 12.4), (3.5, -2.25, 4.16)
+
+    class FakeCar:
+        throttle = 0.25
+        steering = -0.5
+        MtrA = (PWM(Pin(5), duty=300), Pin(4, value=0), Pin(0, value=1))
+        MtrB = (PWM(Pin(14), duty=700), Pin(12, value=1), Pin(13, value=0))
+
+    # Back-pressure: a reader that falls a full ring behind loses the oldest records only
+    tel = Telemetry(FakeMPU(), FakeCar(), capacity=32)
+    reader = tel.reader()
+    for _ in range(100):
+        tel.sample()
+    buf = bytearray(64 * RECORD_SIZE)
+    count = reader.read_into(buf)
+    assert count == 32 and reader.dropped == 68, (count, reader.dropped)
+    assert [struct.unpack_from(RECORD_FORMAT, buf, i * RECORD_SIZE)[0] for i in range(count)] == list(range(68, 100))
+
+    tel = Telemetry(FakeMPU(), FakeCar())
+
+    async def run():
+        server = await web.start_async_webserver({"telemetry": web.WebSocketEndpoint(tel.stream)}, host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def sampler():
+            while True:
+                tel.sample()
+                await asyncio.sleep(0.002)
+
+        task = asyncio.create_task(sampler())
+        decoder = Decoder()
+        reader, writer = await wsclient.connect("127.0.0.1", port, "/telemetry")
+        rows = []
+        while len(rows) < 200:
+            opcode, payload = await wsclient.read_frame(reader)
+            rows.extend(decoder.feed(payload))
+
+        # Caught up and idle, a ping split across two segments well apart must still get its pong
+        task.cancel()
+        ping = wsclient.frame(b"still there?", wsclient.PING)
+        writer.write(ping[:3])
+        await writer.drain()
+        await asyncio.sleep(0.2)
+        writer.write(ping[3:])
+        opcode, payload = await asyncio.wait_for(wsclient.read_frame(reader), 2)
+        while opcode == wsclient.BINARY:
+            rows.extend(decoder.feed(payload))
+            opcode, payload = await asyncio.wait_for(wsclient.read_frame(reader), 2)
+        assert (opcode, payload) == (wsclient.PONG, b"still there?"), (opcode, payload)
+        writer.write(wsclient.frame(b"", wsclient.CLOSE))
+        await writer.drain()
+        assert (await asyncio.wait_for(wsclient.read_frame(reader), 2))[0] == wsclient.CLOSE
+        writer.close()
+        await asyncio.sleep(0.1)
+        server.close()
+        await server.wait_closed()
+        return decoder, rows
+
+    decoder, rows = asyncio.run(run())
+    row = dict(zip(FIELDS, rows[-1]))
+    assert (row["gy"], row["gz"], row["roll"], row["pitch"]) == (-1.5, 12.25, 3.5, -2.25), row
+    assert (row["throttle"], row["steering"], row["left"], row["right"]) == (0.25, -0.5, -300, 700), row
+    print("selftest ok: %d records streamed, %d dropped, record size %d bytes" % (decoder.records, decoder.dropped, RECORD_SIZE))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", nargs="?", help="ws:// URL of the telemetry endpoint, or a capture file")
+    parser.add_argument("--save", help="also write the raw stream to this file")
+    parser.add_argument("--count", type=int, help="stop after this many records")
+    parser.add_argument("--selftest", action="store_true")
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest()
+        return
+    if not args.source:
+        parser.error("source is required")
+    print(",".join(FIELDS))
+    if args.source.startswith("ws://"):
+        decoder = asyncio.run(stream(args.source, args.save, args.count))
+    else:
+        decoder = decode_file(args.source)
+    print("# %d records, %d dropped" % (decoder.records, decoder.dropped), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+""" Loopback benchmark of the UDP control transport (web.UdpControl) against the WebSocket channel.
+
+1. Acceptance rules, called directly: duplicates and reordering are
+   dropped, seq wraps at 65536, a restarted sender is taken after a
+   silence once it has sent a few datagrams in a row (a lone late or
+   duplicate one never is), and neither a ticks_ms wrap nor clock drift
+   between sender and car makes fresh datagrams look stale.
+2. Latency from sending a command to Car.update_motors running with it:
+   UdpControl read as datagrams arrive (serve(), as with the async server)
+   and polled from a 10 ms Timer (as with the blocking server), against
+   the WebSocket frame path of the async server.
+3. Loss tolerance: datagrams go through an emulated Wi-Fi link that drops,
+   delays, reorders and duplicates them and stalls now and then. The test
+   measures what the car applies: seqs must only go up, and nothing older
+   than max_age past the fastest recent datagram is applied. The same
+   send schedule and losses are run through a TCP model, where a lost
+   segment is retransmitted after the minimum RTO (200 ms) and every
+   later command waits behind it. That gives the stream transports'
+   command age for comparison.
+
+Usage: python tools/udp_bench.py [--messages 400] [--loss 0.1] [--seconds 10]
+"""
+import io
+import os
+import sys
+import time
+import heapq
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import web
+import wsclient
+from car import get_car
+from scheduler import Scheduler
+from udp_send import UdpSender
+
+with contextlib.redirect_stdout(io.StringIO()):
+    car = get_car()
+
+applied = []  # (perf_counter, throttle code) per update_motors
+update_motors = car.update_motors
+
+def recording_update():
+    update_motors()
+    applied.append((time.perf_counter(), round(car.throttle * 1000)))
+car.update_motors = recording_update
+
+SPACING = 0.015  # Between commands in the latency runs; closer than the poll period, UdpControl applies only the newest
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def quiet_udp(*args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return web.UdpControl(*args, **kwargs)
+
+def start_udp(handler, port, event):
+    """ A UdpControl read by serve() on an event loop in a thread (event) or polled from a 10 ms Timer; returns it and a stop function. """
+    if not event:
+        udp = quiet_udp(handler, port=port, interval=10)
+        return udp, udp.stop
+    udp = quiet_udp(handler, port=port, interval=None)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    serving = asyncio.run_coroutine_threadsafe(udp.serve(), loop)
+
+    def stop():
+        loop.call_soon_threadsafe(serving.cancel)
+        time.sleep(0.01)
+        udp.stop()
+        loop.call_soon_threadsafe(loop.stop)
+    return udp, stop
+
+# 1. Acceptance rules
+def check_rules():
+    udp = quiet_udp(lambda *a: None, port=free_port(socket.SOCK_DGRAM), scheduler=Scheduler())
+    udp.stop()
+    now = 5000
+
+    def accept(seq, ms, at):
+        return udp.accept((seq, ms, 0, 0, 0), at)
+
+    assert accept(10, 100, now) and not accept(10, 100, now + 1), "duplicate"
+    assert not accept(9, 90, now + 2), "older seq"
+    assert accept(12, 120, now + 20) and not accept(11, 110, now + 21), "reordered"
+    assert accept(65535, 130, now + 30) is False, "12 -> 65535 is 13 back, not 65523 ahead"
+    assert accept(13, 400, now + 300) and accept(14, 420, now + 320) and not accept(15, 440, now + 340 + 200), "arriving 200 ms late is stale"
+    assert not accept(13, 400, now + 1500), "a late duplicate after a silence must not re-apply an old command"
+    assert not accept(9, 90, now + 1600) and not accept(10, 100, now + 1700), "nor a few unrelated stray ones"
+    assert not accept(500, 7, now + 2000) and not accept(501, 27, now + 2020), "a restarted sender (new seq and clock)..."
+    assert accept(502, 47, now + 2040), "... is taken after a silence once it has sent confirm datagrams in a row"
+    assert accept(503, 67, now + 2060) and not accept(502, 47, now + 2061)
+
+    udp.seq = None
+    assert accept(65534, 0, now) and accept(65535, 20, now + 20) and accept(0, 40, now + 40) and accept(1, 60, now + 60), "seq wrap"
+    assert not accept(65535, 80, now + 80)
+    print("ordering ok: duplicates, reordering and seq wrap")
+
+    # The car's ticks_ms wraps (at 2**30 on the ESP8266) while the sender's ms keeps counting
+    udp.seq = None
+    wrap = 1 << 30
+    for i in range(100):
+        local = (wrap - 500 + i * 20) % wrap
+        assert accept(1000 + i, 10 ** 6 + i * 20, local), "tick wrap at datagram %d" % i
+
+    # Car clock 1% fast: receive - send grows 0.2 ms per datagram, the baseline creeps 1 ms
+    udp.seq = None
+    stale = udp.stale
+    for i in range(30000):
+        assert accept(i & 0xFFFF, i * 20, int(i * 20 * 1.01) + 100), "drift made datagram %d stale" % i
+    assert udp.stale == stale
+    print("clocks ok: ticks_ms wrap and 1% drift over 10 min, no false stale drops")
+
+# 2. Latency
+def udp_latency(messages, event=True):
+    port = free_port(socket.SOCK_DGRAM)
+    udp, stop = start_udp(lambda t, s, lease: car.set(t, s), port, event)
+    sender = UdpSender("127.0.0.1", port)
+    sent = {}
+    applied.clear()
+    try:
+        for i in range(messages):
+            code = i % 900 + 1
+            sent[code] = time.perf_counter()
+            sender.send(code / 1000, 0)
+            time.sleep(SPACING)
+        time.sleep(0.05)
+    finally:
+        stop()
+        sender.close()
+    return match(sent, messages)
+
+def ws_latency(messages):
+    async def control_socket(ws, request):
+        while True:
+            message = await ws.recv()
+            if message is None:
+                break
+            opcode, payload = message
+            if opcode == web.WS_BINARY:
+                car.set(*web.decode_control(payload))
+
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    with contextlib.redirect_stdout(io.StringIO()):
+        loop.run_until_complete(web.start_async_webserver({"ws": web.WebSocketEndpoint(control_socket)}, "127.0.0.1", port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    sent = {}
+    async def client():
+        reader, writer = await wsclient.connect("127.0.0.1", port)
+        for i in range(messages):
+            code = i % 900 + 1
+            sent[code] = time.perf_counter()
+            writer.write(wsclient.frame(web.encode_control(code / 1000, 0)))
+            await writer.drain()
+            await asyncio.sleep(SPACING)
+        await asyncio.sleep(0.05)
+        writer.close()
+
+    applied.clear()
+    asyncio.run(client())
+    return match(sent, messages)
+
+def match(sent, messages):
+    """ Latency (ms) of each command that reached update_motors, matched by its throttle code. """
+    latencies = []
+    seen = set()
+    for t, code in applied:
+        if code in sent and (code, sent[code]) not in seen:
+            seen.add((code, sent[code]))
+            latencies.append((t - sent[code]) * 1000)
+    return latencies
+
+# 3. Loss tolerance
+def link_schedule(seconds, rate, loss, rng):
+    """ Per datagram: (send time, list of delivery delays in s; empty when lost). """
+    schedule = []
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        stall = 0.3 if t % 2.5 < 0.3 else 0.0  # A 300 ms Wi-Fi stall every 2.5 s; what it holds comes out together
+        stall = max(0.0, stall - t % 2.5) if stall else 0.0
+        copies = []
+        if rng.random() >= loss:
+            copies.append(0.002 + rng.expovariate(1 / 0.008) + stall)
+            if rng.random() < 0.02:
+                copies.append(copies[0] + rng.expovariate(1 / 0.02))  # Duplicate
+        schedule.append((t, copies))
+    return schedule
+
+def run_udp_link(schedule):
+    """ Send the schedule through the emulated link to a real UdpControl; returns it, the applied seqs, their ages (ms) and apply times. """
+    port = free_port(socket.SOCK_DGRAM)
+    log = []  # (time.monotonic() at apply, seq)
+    udp = None
+
+    def handler(throttle, steering, lease):
+        car.set(throttle, steering)
+        log.append((time.monotonic(), udp.seq))
+
+    udp, stop = start_udp(handler, port, event=True)
+    sender = UdpSender("127.0.0.1", port)
+    start = time.monotonic() + 0.05
+    sent_at = {}
+    deliveries = []
+    for t, copies in schedule:
+        # Numbered and stamped when sent, delivered after the link's delay
+        data = sender.packet(0.5, 0.0, sender.ms(start + t))
+        sent_at[sender.seq] = start + t
+        for delay in copies:
+            deliveries.append((start + t + delay, sender.seq, data))
+    heapq.heapify(deliveries)
+    while deliveries:
+        due, _, data = heapq.heappop(deliveries)
+        time.sleep(max(0, due - time.monotonic()))
+        sender.sock.sendto(data, sender.address)
+    time.sleep(0.05)
+    stop()
+    sender.close()
+    ages = [(t - sent_at[seq]) * 1000 for t, seq in log]
+    return udp, [seq for _, seq in log], ages, [t for t, _ in log]
+
+def tcp_model(schedule, rto=0.2, poll=0.0):
+    """ Command age at delivery (ms) when the same datagrams are segments of one ordered stream. """
+    arrival = 0.0
+    ages = []
+    times = []
+    for t, copies in schedule:
+        delivered = t + (copies[0] if copies else rto + 0.002 + 0.008)  # Lost: retransmitted after the RTO
+        arrival = max(arrival, delivered)  # Head-of-line: nothing overtakes an earlier segment
+        ages.append((arrival - t) * 1000)
+        times.append(arrival)
+    return ages, times
+
+def worst_gap(times):
+    return max((b - a) * 1000 for a, b in zip(times, times[1:]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    check_rules()
+
+    print("\n%-40s %8s %8s %8s %8s" % ("send -> update_motors (ms)", "applied", "p50", "p95", "max"))
+    results = {}
+    for name, func in (("UDP, as it arrives (async server)", udp_latency),
+                       ("UDP, polled every 10 ms (Timer)", lambda n: udp_latency(n, event=False)),
+                       ("WebSocket frame (async server)", ws_latency)):
+        latencies = results[name] = func(args.messages)
+        print("%-40s %8d %8.2f %8.2f %8.2f" % (name, len(latencies), percentile(latencies, 50), percentile(latencies, 95), max(latencies)))
+        if name.startswith("UDP"):
+            assert len(latencies) > args.messages * 0.8 and percentile(latencies, 50) < 12
+    udp_p50 = percentile(results["UDP, as it arrives (async server)"], 50)
+    assert udp_p50 < 2 and udp_p50 < percentile(results["UDP, polled every 10 ms (Timer)"], 50) / 2, "datagrams must apply as they arrive"
+
+    rng = random.Random(args.seed)
+    rate = 50
+    schedule = link_schedule(args.seconds, rate, args.loss, rng)
+    lost = sum(1 for _, copies in schedule if not copies)
+    udp, seqs, ages, times = run_udp_link(schedule)
+    tcp_ages, tcp_times = tcp_model(schedule)
+    print("\nemulated link: %d commands at %d Hz, %.0f%% lost (%d), jitter ~8 ms, 2%% duplicated, 300 ms stall every 2.5 s"
+          % (len(schedule), rate, 100 * args.loss, lost))
+    print("UDP: %d received, %d applied, %d out of order or duplicate, %d stale, %d malformed"
+          % (udp.received, udp.applied, udp.out_of_order, udp.stale, udp.malformed))
+    print("\n%-40s %10s %10s %10s %14s" % ("command age when applied (ms)", "p50", "p99", "max", "longest gap"))
+    print("%-40s %10.1f %10.1f %10.1f %14.1f" % ("UDP, real UdpControl", percentile(ages, 50), percentile(ages, 99), max(ages), worst_gap(times)))
+    print("%-40s %10.1f %10.1f %10.1f %14.1f" % ("ordered stream (TCP model, RTO 200 ms)", percentile(tcp_ages, 50),
+                                                percentile(tcp_ages, 99), max(tcp_ages), worst_gap(tcp_times)))
+
+    assert seqs == sorted(seqs) and len(set(seqs)) == len(seqs), "applied commands must only move forward"
+    assert max(ages) < 2 + 150 + 10 + 40, "a stale command was applied"
+    assert percentile(ages, 99) < percentile(tcp_ages, 99) and max(ages) < max(tcp_ages)
+    print("udp control ok")
+
+if __name__ == "__main__":
+    main()
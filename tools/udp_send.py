@@ -0,0 +1,74 @@
+""" Host-side sender for the car's UDP control port (web.UdpControl).
+
+Sends throttle/steering datagrams at a fixed rate for a while, then a stop.
+Every datagram carries a sequence number, the sender's clock in ms and a
+lease, so the car drops reordered or stale ones and stops by itself when
+they stop coming.
+
+Usage: python tools/udp_send.py HOST [--throttle 0.3] [--steering 0] [--seconds 2] [--rate 50] [--lease 500]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import web
+
+class UdpSender:
+    """ Numbers and timestamps control datagrams for one car. """
+    def __init__(self, host, port=web.UDP_PORT, lease=500):
+        self.address = (host, port)
+        self.lease = lease
+        self.seq = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._start = time.monotonic()
+
+    def ms(self, at=None):
+        """ Sender clock in ms, now or at a time.monotonic() value. """
+        return int(((time.monotonic() if at is None else at) - self._start) * 1000)
+
+    def packet(self, throttle, steering, ms=None):
+        """ The next datagram, numbered and stamped (now, unless ms is given); send() sends it. """
+        self.seq = (self.seq + 1) & 0xFFFF
+        return web.encode_udp_control(self.seq, self.ms() if ms is None else ms, throttle, steering, self.lease)
+
+    def send(self, throttle, steering):
+        data = self.packet(throttle, steering)
+        self.sock.sendto(data, self.address)
+        return data
+
+    def close(self):
+        self.sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("host")
+    parser.add_argument("--port", type=int, default=web.UDP_PORT)
+    parser.add_argument("--throttle", type=float, default=0.0)
+    parser.add_argument("--steering", type=float, default=0.0)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--rate", type=float, default=50, help="datagrams per second")
+    parser.add_argument("--lease", type=int, default=500, help="ms the car keeps a command without a newer one")
+    args = parser.parse_args()
+
+    sender = UdpSender(args.host, args.port, args.lease)
+    period = 1 / args.rate
+    deadline = time.monotonic() + args.seconds
+    next_send = time.monotonic()
+    try:
+        while time.monotonic() < deadline:
+            sender.send(args.throttle, args.steering)
+            next_send += period
+            time.sleep(max(0, next_send - time.monotonic()))
+    finally:
+        for _ in range(3):  # A lost stop is covered by the lease, but don't wait for it
+            sender.send(0, 0)
+        sender.close()
+    print("sent %d datagrams to %s:%d" % (sender.seq, args.host, args.port))
+
+if __name__ == "__main__":
+    main()
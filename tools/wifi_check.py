@@ -0,0 +1,227 @@
+""" Wi-Fi connection manager (web.WifiManager) against a simulated radio.
+
+The station is a sim.network.WLAN on an Air: access points in range,
+where a join naming a BSSID takes 600 ms and one that has to find the
+network first takes a 2 s scan more. Everything runs on a SimClock, so
+timings are exact. Like the ESP8266 port, the radio can't list the
+stations on the car's access point. Scenarios:
+1. First boot, nothing cached: join by SSID, then scan once parked and
+   cache the BSSID and channel.
+2. Reboot: join the cached BSSID straight away, without scanning.
+3. The access point drops out for a few seconds mid-drive: rejoin.
+4. The cached access point is gone for good, mid-drive: roam to another
+   one with the same SSID, and cache that once parked.
+5. No network at all: keep retrying with backoff, bring up the car's own
+   access point after ap_after, and take it down once the network is back
+   and nobody is driving.
+6. Wrong password: fail fast, back off, fall back to the access point.
+7. Upgrade from connect_wifi: the SDK has already rejoined with saved
+   credentials before the manager starts, and nothing is cached yet.
+Throughout, check() must not block except for a scan, and must never scan
+while the car is being driven.
+
+Usage: python tools/wifi_check.py
+"""
+import io
+import os
+import sys
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import ujson
+import web
+from scheduler import Scheduler
+from sim.clock import SimClock
+from sim.network import Air, AccessPoint, WLAN, STA_IF, AP_IF
+
+SSID = "Home"
+PASSWORD = "secret"
+HOME = b"\x10\x20\x30\x40\x50\x60"
+HALL = b"\x10\x20\x30\x40\x50\x61"  # Second access point of the same network, weaker here
+
+def access_points():
+    return [AccessPoint(SSID, HOME, channel=6, rssi=-55, password=PASSWORD),
+            AccessPoint(SSID, HALL, channel=11, rssi=-72, password=PASSWORD),
+            AccessPoint("Neighbour", b"\x77" * 6, channel=1, rssi=-40, password="x")]
+
+class Rig:
+    """ A WifiManager on a scheduler, with its radio, and the longest any check() blocked. """
+    def __init__(self, folder, aps, password=PASSWORD, joined=False, **kwargs):
+        self.driving = False  # What the failsafe would say: a lease is held
+        self.clock = SimClock()
+        self.air = Air(self.clock, aps)
+        self.scheduler = Scheduler(self.clock)
+        self.wlan = WLAN(STA_IF, self.air)
+        if joined:
+            # Rejoined by the SDK at power-up, as with credentials saved before the manager existed
+            self.wlan.active(True)
+            self.wlan.connect(SSID, password)
+            while not self.wlan.isconnected():
+                self.clock.advance(100000)
+        self.ap = WLAN(AP_IF, self.air)
+        credentials = os.path.join(folder, "wifi.txt")
+        with open(credentials, "w") as f:
+            f.write("%s\n%s\n" % (SSID, password))
+        self.log = io.StringIO()
+        with contextlib.redirect_stdout(self.log):
+            self.wifi = web.WifiManager(credentials, os.path.join(folder, "wifi.json"), scheduler=self.scheduler,
+                                        clock=self.clock, wlan=self.wlan, ap=self.ap,
+                                        idle=lambda: not self.driving, **kwargs)
+        self.blocked = []  # (ms a check() took, scans during it, driving)
+        check = self.wifi.check
+
+        def timed_check():
+            start, scans = self.clock.now(), self.wlan.scans
+            check()
+            self.blocked.append(((self.clock.now() - start) // 1000, self.wlan.scans - scans, self.driving))
+        self.wifi.periodic.task.func = timed_check
+
+    def ms(self):
+        return self.clock.now() // 1000
+
+    def run(self, ms):
+        with contextlib.redirect_stdout(self.log):
+            self.scheduler.run(ms)
+
+    def run_until(self, condition, limit_ms):
+        """ Run until condition() holds; returns the ms it took. """
+        start = self.ms()
+        while not condition():
+            assert self.ms() - start < limit_ms, "gave up after %d ms" % limit_ms
+            self.run(self.wifi.interval)
+        return self.ms() - start
+
+    def assert_non_blocking(self):
+        for took, scans, driving in self.blocked:
+            assert took <= scans * self.air.scan_ms, "check() blocked %d ms with %d scans" % (took, scans)
+            assert not (driving and scans), "scanned while driving"
+
+def cached(folder):
+    with open(os.path.join(folder, "wifi.json")) as f:
+        return ujson.load(f)
+
+def report(name, rig, extra=""):
+    print("%-44s %8s %6d %8d %6d  %s" % (name, rig.wifi.connect_ms if rig.wifi.isconnected() else "-",
+                                          rig.wlan.scans, rig.wlan.connects, rig.wifi.drops, extra))
+
+def main():
+    folder = tempfile.mkdtemp()
+    print("%-44s %8s %6s %8s %6s" % ("scenario", "join ms", "scans", "connects", "drops"))
+
+    # 1. First boot: the SDK finds the network; the BSSID is learned by a scan once parked
+    rig = Rig(folder, access_points())
+    rig.driving = True
+    assert not rig.wifi.isconnected(), "the constructor must not wait for the join"
+    rig.run_until(rig.wifi.isconnected, 10000)
+    first = rig.wifi.connect_ms
+    rig.run(3000)
+    assert not rig.wifi.history[-1][1] and rig.wlan.scans == 0 and not os.path.exists(os.path.join(folder, "wifi.json"))
+    rig.driving = False
+    rig.run(rig.wifi.interval)
+    assert rig.wlan.scans == 1 and rig.wifi.isconnected()
+    assert cached(folder) == {"ssid": SSID, "bssid": "102030405060", "channel": 6}, "strongest access point cached"
+    report("1. first boot (SDK search, scan parked)", rig)
+    rig.assert_non_blocking()
+
+    # 2. Reboot: cached BSSID, no scan; wait() blocks like the old connect_wifi, but only as long as the join
+    rig = Rig(folder, access_points())
+    with contextlib.redirect_stdout(rig.log):
+        assert rig.wifi.wait(10000)
+    fast = rig.wifi.connect_ms
+    assert rig.wifi.history == [(fast, True)] and rig.wlan.scans == 0
+    assert fast <= rig.air.bssid_join_ms + rig.wifi.interval and fast * 3 < first
+    report("2. reboot (cached BSSID)", rig, "%.1fx faster than the SDK search" % (first / fast))
+
+    # 3. Link drops for 3 s mid-drive
+    rig.run(5000)
+    rig.air.drop(HOME)
+    rig.air.drop(HALL)
+    lost = rig.ms()
+    rig.run(3000)
+    assert not rig.wifi.isconnected()
+    rig.air.drop(HOME, up=True)
+    rig.air.drop(HALL, up=True)
+    rig.run_until(rig.wifi.isconnected, 15000)
+    assert rig.wifi.drops == 1 and 0 <= rig.ms() - lost - rig.wifi.connect_ms <= rig.wifi.interval, "latency from noticing the drop"
+    assert rig.ap.active() is False, "a short outage must not bring up the access point"
+    report("3. 3 s outage, rejoin", rig, "down %d ms" % rig.wifi.connect_ms)
+    rig.assert_non_blocking()
+
+    # 4. The cached access point is gone for good, mid-drive: roam to the other one, cache it once parked
+    rig.run(2000)
+    rig.driving = True
+    rig.air.drop(HOME)
+    lost = rig.ms()
+    rig.run_until(lambda: not rig.wifi.isconnected(), 1000)
+    rig.run_until(rig.wifi.isconnected, 15000)
+    assert rig.wlan._ap.bssid == HALL and rig.wifi.drops == 2 and rig.wlan.scans == 0
+    assert rig.wifi.connect_ms <= rig.wifi.fast_ms + rig.air.scan_ms + rig.air.auth_ms + rig.wifi.interval
+    assert cached(folder)["bssid"] == "102030405060", "no scan to learn the new one while driving"
+    rig.driving = False
+    rig.run(rig.wifi.interval)
+    assert cached(folder)["bssid"] == "102030405061" and cached(folder)["channel"] == 11
+    report("4. cached AP gone, roam", rig, "down %d ms" % (rig.ms() - lost))
+    rig.assert_non_blocking()
+
+    # 5. No network: retry with backoff, access point after ap_after, handed back when the network returns and
+    # nobody is driving through it
+    os.remove(os.path.join(folder, "wifi.json"))
+    rig = Rig(folder, [], ap_after=20000)
+    rig.run(19000)
+    assert not rig.ap.active()
+    up = rig.run_until(rig.ap.active, 2000) + 19000
+    assert rig.ap.config("essid") == "MyESP_Hotspot"
+    rig.run(40000)
+    retries = rig.wlan.connects
+    assert 4 <= retries <= 10, "%d joins in 60 s: backoff" % retries
+    rig.air.access_points.extend(access_points())
+    rig.driving = True  # Someone is driving through the car's access point
+    rig.run_until(rig.wifi.isconnected, rig.wifi.retry_ms + 5000)
+    rig.run(5000)
+    assert rig.ap.active() and rig.wlan.scans == 0, "no scan, and the access point stays, while driven"
+    rig.driving = False
+    rig.run(rig.wifi.interval)
+    assert not rig.ap.active(), "the access point must go once the station is back and nobody drives"
+    assert rig.wlan.scans == 1 and cached(folder)["bssid"] == "102030405060"
+    report("5. no network -> access point", rig, "AP up at %d ms, %d joins while down" % (up, retries))
+    rig.assert_non_blocking()
+
+    # 6. Wrong password
+    rig = Rig(folder, access_points(), password="wrong", ap_after=15000)
+    rig.run(30000)
+    assert not rig.wifi.isconnected() and rig.ap.active()
+    assert rig.wlan.connects <= 8
+    report("6. wrong password", rig, "access point up, joins backing off")
+    rig.assert_non_blocking()
+
+    longest = max(took for took, scans, _ in rig.blocked if not scans)
+
+    # 7. Already connected at start, no cache: keep the link, learn the BSSID once parked
+    os.remove(os.path.join(folder, "wifi.json"))
+    rig = Rig(folder, access_points(), joined=True)
+    rig.driving = True
+    rig.run(1000)
+    assert rig.wifi.isconnected() and rig.wlan.scans == 0 and rig.wlan.connects == 1
+    assert not os.path.exists(os.path.join(folder, "wifi.json")), "no BSSID known to cache"
+    assert rig.scheduler.tasks == [rig.wifi.periodic.task], "check() must keep running"
+    rig.driving = False
+    rig.run(rig.wifi.interval)
+    assert rig.wlan.scans == 1 and rig.wlan.connects == 1 and cached(folder)["bssid"] == "102030405060"
+    report("7. joined by the SDK before start", rig)
+    rig.assert_non_blocking()
+
+    # Without an idle callback the manager never scans
+    os.remove(os.path.join(folder, "wifi.json"))
+    rig = Rig(folder, access_points())
+    rig.wifi.idle = None
+    rig.run(10000)
+    assert rig.wifi.isconnected() and rig.wlan.scans == 0 and not os.path.exists(os.path.join(folder, "wifi.json"))
+
+    print("\nlongest check() without a scan: %d ms (the old connect_wifi blocked up to 10 s)" % longest)
+    print("wifi manager ok")
+
+if __name__ == "__main__":
+    main()
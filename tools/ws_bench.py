@@ -0,0 +1,149 @@
+""" Loopback comparison of the WebSocket control channel against the HTTP ctrl GET path.
+
+Runs the async server from web.py in-process and records when each command
+reaches the endpoint, so latency is command-sent to command-applied. The
+WebSocket client streams frames without waiting; the GET client waits for
+each response, as the UI does. Also checks that a frame declaring an
+oversized payload is refused with close status 1009, and that a client
+going away partway through a frame header just ends the connection.
+
+Usage: python tools/ws_bench.py [--messages 2000]
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sim
+sim.install()
+import web
+import wsclient
+
+applied = []
+ended = []  # One entry per handler that saw recv() return None
+
+def receive_state(r):
+    r.param_float(b't', 0)
+    r.param_float(b's', 0)
+    applied.append(time.perf_counter())
+    return {"ok": 1}
+
+async def control_socket(ws, request):
+    while True:
+        message = await ws.recv()
+        if message is None:
+            ended.append(ws)
+            break
+        opcode, payload = message
+        if opcode == web.WS_BINARY and len(payload) == 4:
+            web.decode_control(payload)
+            applied.append(time.perf_counter())
+
+endpoints = {"ctrl": receive_state, "ws": web.WebSocketEndpoint(control_socket)}
+
+async def bench_ws(port, count):
+    reader, writer = await wsclient.connect("127.0.0.1", port, "/ws")
+
+    # Ping must come back as a pong with the same payload
+    writer.write(wsclient.frame(b"hi", web.WS_PING))
+    assert await wsclient.read_frame(reader) == (web.WS_PONG, b"hi")
+
+    applied.clear()
+    sent = []
+    for i in range(count):
+        t = (i % 2001 - 1000) / 1000
+        sent.append(time.perf_counter())
+        writer.write(wsclient.frame(web.encode_control(t, -t)))
+        await asyncio.sleep(0)  # Stream without waiting for any reply
+    while len(applied) < count:
+        await asyncio.sleep(0.001)
+    writer.write(wsclient.frame(b"", web.WS_CLOSE))
+    assert (await wsclient.read_frame(reader))[0] == web.WS_CLOSE
+    writer.close()
+    await writer.wait_closed()
+    return [a - s for s, a in zip(sent, applied)], applied[-1] - sent[0]
+
+async def check_oversized(port):
+    # A frame declaring a huge payload must be refused from its header alone, with close status 1009
+    for length in (129, 1 << 40):  # Just over the default max_size of 128, and absurd
+        reader, writer = await wsclient.connect("127.0.0.1", port, "/ws")
+        writer.write(bytes((0x80 | web.WS_BINARY, 0x80 | 127)) + length.to_bytes(8, "big"))
+        opcode, payload = await asyncio.wait_for(wsclient.read_frame(reader), 2)
+        assert opcode == web.WS_CLOSE and payload == web.WS_TOO_BIG.to_bytes(2, "big"), (opcode, payload)
+        assert await reader.read() == b"", "the server must close the connection"
+        writer.close()
+
+async def check_truncated(port):
+    # A client that goes away inside a frame header (extended length or mask half sent) is a
+    # clean close: recv returns None and the server logs no client error
+    prefixes = (bytes((0x80 | web.WS_BINARY, 0x80 | 126, 0)),
+                bytes((0x80 | web.WS_BINARY, 0x80 | 127, 0, 0, 0)),
+                bytes((0x80 | web.WS_BINARY, 0x80 | 4, 1, 2)))
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        for prefix in prefixes:
+            ended.clear()
+            reader, writer = await wsclient.connect("127.0.0.1", port, "/ws")
+            writer.write(prefix)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+            for _ in range(200):
+                if ended:
+                    break
+                await asyncio.sleep(0.005)
+            assert ended, "recv should return None when the client leaves mid-header: %r" % prefix
+    await asyncio.sleep(0.01)  # Let the connection handlers finish
+    assert "Client error" not in log.getvalue(), log.getvalue()
+
+async def bench_get(port, count):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    applied.clear()
+    sent = []
+    for i in range(count):
+        t = (i % 2001 - 1000) / 1000
+        sent.append(time.perf_counter())
+        writer.write(("GET /ctrl?t=%.3f&s=%.3f HTTP/1.1\r\nHost: car\r\n\r\n" % (t, -t)).encode())
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int(head.split(b"Content-Length:")[1].split(b"\r\n")[0])
+        await reader.readexactly(length)
+    elapsed = time.perf_counter() - sent[0]
+    writer.close()
+    await writer.wait_closed()
+    return [a - s for s, a in zip(sent, applied)], elapsed
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def run(count):
+    server = await web.start_async_webserver(endpoints, host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    await check_oversized(port)
+    await check_truncated(port)
+    results = [("WebSocket",) + await bench_ws(port, count), ("HTTP GET",) + await bench_get(port, count)]
+    await asyncio.sleep(0.01)  # Let the connection handlers see EOF
+    server.close()
+    await server.wait_closed()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    assert web.decode_control(web.encode_control(-0.35, 1)) == (-0.35, 1.0)
+    assert web.decode_lease(web.encode_control(-0.35, 1)) is None
+    leased = web.encode_control(0.5, -0.2, 1000)
+    assert web.decode_control(leased) == (0.5, -0.2) and web.decode_lease(leased) == 1000
+    print("%-10s %10s %10s %10s %10s" % ("channel", "messages", "p50 (us)", "p99 (us)", "msgs/s"))
+    for name, latencies, elapsed in asyncio.run(run(args.messages)):
+        print("%-10s %10d %10.1f %10.1f %10.0f" % (name, len(latencies), percentile(latencies, 50) * 1e6,
+                                                  percentile(latencies, 99) * 1e6, len(latencies) / elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+""" Minimal asyncio WebSocket client (RFC 6455) for the host-side tools. """
+import os
+import base64
+import asyncio
+import hashlib
+
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+async def connect(host, port=80, path="/ws"):
+    """ Open a connection and complete the handshake; returns (reader, writer). """
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16))
+    writer.write(b"GET " + path.encode() + b" HTTP/1.1\r\nHost: " + host.encode() +
+                 b"\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Version: 13\r\nSec-WebSocket-Key: " + key + b"\r\n\r\n")
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    expected = base64.b64encode(hashlib.sha1(key + GUID).digest())
+    if not head.startswith(b"HTTP/1.1 101") or expected not in head:
+        raise ConnectionError("WebSocket handshake failed: %r" % head)
+    return reader, writer
+
+def frame(payload, opcode=BINARY):
+    """ Build one masked client frame. """
+    mask = os.urandom(4)
+    masked = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+    length = len(payload)
+    if length < 126:
+        head = bytes((0x80 | opcode, 0x80 | length))
+    elif length < 65536:
+        head = bytes((0x80 | opcode, 0x80 | 126)) + length.to_bytes(2, "big")
+    else:
+        head = bytes((0x80 | opcode, 0x80 | 127)) + length.to_bytes(8, "big")
+    return head + mask + masked
+
+async def read_frame(reader):
+    """ Read one unmasked server frame; returns (opcode, payload). """
+    head = await reader.readexactly(2)
+    length = head[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    return head[0] & 0x0F, await reader.readexactly(length)
@@ -1,61 +1,299 @@
+""" Packs index.html and the scripts and stylesheets it links into one page, plus the gzipped copy the car serves.
+
+Assets are minified (JS, CSS and the page's own markup) unless --no-minify
+is given. A manifest in .packer_cache.json remembers each asset's mtime,
+size and hash along with its processed text, so a rebuild only reads and
+minifies assets that changed, and outputs are only rewritten when the page
+did. --watch rebuilds whenever a file in this directory changes. Pure
+Python: no Node toolchain needed.
+
+Usage: python html_packer.py [input.html] [output.html] [output.html.gz] [--no-minify] [--force] [--watch]
+"""
 import re
 import os
 import sys
+import gzip
+import json
+import time
+import hashlib
+import argparse
+
+MANIFEST = ".packer_cache.json"
+VERSION = 1  # Bump when minification changes, to invalidate cached assets
+
+# One pass over the page for both kinds of linked asset
+ASSET = re.compile(r'<script\s+src="([^"]+)"></script>|<link\s+rel="stylesheet"\s+href="([^"]+)"\s*/?>')
+
+# Minification
+_KEEP_COMMENT = re.compile(r"^/\*!|@license|@preserve|Copyright", re.I)  # Licence headers stay
+
+_CSS_TOKEN = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*[\s\S]*?\*/)''')
+_CSS_TIGHT = re.compile(r"\s*([{};,>])\s*|:\s+")
+_PLACEHOLDER = re.compile(r"\0(\d+)\0")
+
+def minify_css(css):
+    """ Drop comments, collapse whitespace and remove it around { } ; , > and after :, and drop the last ; of each block. """
+    kept = []  # Strings and licence comments, set aside so the passes below can't touch them
+
+    def token(match):
+        string, comment = match.groups()
+        if comment and not _KEEP_COMMENT.search(comment):
+            return " "
+        kept.append(string or comment + "\n")
+        return f"\0{len(kept) - 1}\0"
+
+    css = _CSS_TOKEN.sub(token, css)
+    css = re.sub(r"\s+", " ", css)
+    css = _CSS_TIGHT.sub(lambda m: m.group(1) or ":", css)
+    css = css.replace(";}", "}")
+    return _PLACEHOLDER.sub(lambda m: kept[int(m.group(1))], css).strip()
+
+_JS_TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*[\s\S]*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+  | (?P<number>(?:0[xXbBoO][\da-fA-F_]+|(?:\d[\d_]*\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)n?)
+  | (?P<word>[\w$]+)
+  | (?P<punct>\+\+|--|.)
+''', re.X)
+_JS_REGEX = re.compile(r"/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n])+/[a-z]*")
+_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^") | {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do", "else"}
+_ENDS_STATEMENT = re.compile(r"[\w$)\]}'\"`]$|\+\+$|--$")
+_STARTS_STATEMENT = re.compile(r"^[\w$(\[{'\"`+\-/!~]")
+
+def minify_js(js):
+    """
+    Drop comments and whitespace, token by token. Strings, template literals and regex
+    literals are copied as is; a line break is kept wherever automatic semicolon
+    insertion could depend on it, and a space wherever two tokens would otherwise merge.
+    """
+    out = []
+    last = ""        # Last emitted token
+    newline = False  # Whitespace with a line break since the last token
+    pos = 0
+    n = len(js)
+    while pos < n:
+        if js[pos] == "/" and js[pos + 1:pos + 2] not in ("/", "*") and (not last or last in _REGEX_AFTER):
+            match = _JS_REGEX.match(js, pos)
+            if match:
+                token = match.group()
+                pos = match.end()
+                last = _emit(out, last, token, newline)
+                newline = False
+                continue
+        match = _JS_TOKEN.match(js, pos)
+        pos = match.end()
+        kind = match.lastgroup
+        token = match.group()
+        if kind == "space":
+            newline = newline or "\n" in token
+        elif kind == "comment":
+            if token.startswith("/*") and _KEEP_COMMENT.search(token):
+                if out:
+                    out.append("\n")
+                out.append(token + "\n")
+                last = ""
+                newline = False
+            else:
+                newline = newline or token.startswith("//") or "\n" in token
+        else:
+            last = _emit(out, last, token, newline)
+            newline = False
+    return "".join(out).strip()
+
+def _emit(out, last, token, newline):
+    if last:
+        if newline and _ENDS_STATEMENT.search(last) and _STARTS_STATEMENT.match(token):
+            out.append("\n")
+        elif (last[-1].isalnum() or last[-1] in "_$") and (token[0].isalnum() or token[0] in "_$"):
+            out.append(" ")
+        elif last[-1] in "+-" and token[0] == last[-1]:
+            out.append(" ")  # a + +b, a - -b
+        elif last[-1] == "/" and token[0] == "/":
+            out.append(" ")  # Division followed by a regex literal
+    out.append(token)
+    return token
+
+_HTML_COMMENT = re.compile(r"<!--(?!\[)[\s\S]*?-->")
+_INLINE_BLOCK = re.compile(r"(<script>|<style>)([\s\S]*?)(</script>|</style>)")
+
+def minify_html(html):
+    """ Drop comments, indentation and blank lines, and minify inline <script> and <style> blocks. """
+    def block(match):
+        open_tag, body, close_tag = match.groups()
+        body = minify_js(body) if open_tag == "<script>" else minify_css(body)
+        return open_tag + body + close_tag
+
+    html = _HTML_COMMENT.sub("", html)
+    html = "\n".join(line.strip() for line in html.splitlines() if line.strip())
+    return _INLINE_BLOCK.sub(block, html)
+
+# Packing
+class AssetCache:
+    """ Processed asset text keyed by path, revalidated by mtime and size, then by content hash. """
+    def __init__(self, path, minify):
+        self.path = path
+        self.minify = minify
+        self.entries = {}
+        self.page = None             # Hash of the last page written
+        self.read = self.reused = 0  # Assets read from disk / served from the manifest, this build
+        if path is None:
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == VERSION:
+                self.entries = manifest["assets"]
+                self.page = manifest.get("page")
+        except (OSError, ValueError, KeyError):
+            pass
 
-def inline_resources(html_file):
-    # Read the original HTML content.
+    def get(self, file_path, kind):
+        """ Processed text of the asset at file_path, minified as kind ("js" or "css") if enabled. """
+        stat = os.stat(file_path)
+        key = f"{file_path}:{kind}:{int(self.minify)}"
+        entry = self.entries.get(key)
+        if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            self.reused += 1
+            return entry["text"]
+        with open(file_path, "r", encoding="utf-8") as f:
+            source = f.read()
+        self.read += 1
+        digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        if not entry or entry["sha1"] != digest:
+            text = source if not self.minify else (minify_js(source) if kind == "js" else minify_css(source))
+            entry = {"sha1": digest, "text": text}
+        entry["mtime"] = stat.st_mtime_ns  # Touched but unchanged: just remember the new mtime
+        entry["size"] = stat.st_size
+        self.entries[key] = entry
+        return entry["text"]
+
+    def save(self):
+        manifest = {"version": VERSION, "page": self.page, "assets": self.entries}
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+def inline_resources(html_file, minify=False, cache=None):
+    """ Return html_file with its linked scripts and stylesheets inlined (and everything minified if asked). """
+    cache = cache or AssetCache(None, minify)
     with open(html_file, "r", encoding="utf-8") as f:
         html = f.read()
 
     # Get the directory of the HTML file to resolve relative paths.
     html_dir = os.path.dirname(os.path.abspath(html_file))
 
-    # Replace <script src="..."></script> with inline script tag.
-    def replace_script(match):
-        src = match.group(1)
-        file_path = os.path.join(html_dir, src)
+    parts = []
+    inlined = {}  # Placeholder -> (kind, text), filled in after minify_html so assets aren't minified twice
+    pos = 0
+    for match in ASSET.finditer(html):
+        src, href = match.groups()
+        kind = "js" if src else "css"
+        file_path = os.path.join(html_dir, src or href)
+        parts.append(html[pos:match.start()])
+        pos = match.end()
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            # Create an inline script tag.
-            return f"<script>\n{content}\n</script>"
+            content = cache.get(file_path, kind)
         except FileNotFoundError:
             print(f"File not found: {file_path}")
-            # Return the original tag if file not found.
-            return match.group(0)
+            parts.append(match.group(0))  # Keep the original tag
+            continue
+        if minify:
+            placeholder = f"\0{len(parts)}\0"
+            inlined[placeholder] = (kind, content)
+            parts.append(placeholder)
+        elif kind == "js":
+            parts.append(f"<script>\n{content}\n</script>")
+        else:
+            parts.append(f"<style>\n{content}\n</style>")
+    parts.append(html[pos:])
+    html = "".join(parts)
 
-    # The regex matches a script tag with a src attribute.
-    html = re.sub(r'<script\s+src="([^"]+)"></script>', replace_script, html)
+    if minify:
+        html = minify_html(html)
+        for placeholder, (kind, content) in inlined.items():
+            tag = "script" if kind == "js" else "style"
+            html = html.replace(placeholder, f"<{tag}>{content}</{tag}>", 1)
+    return html
 
-    # Replace <link rel="stylesheet" href="..."> with inline style tag.
-    def replace_link(match):
-        href = match.group(1)
-        file_path = os.path.join(html_dir, href)
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            # Create an inline style tag.
-            return f"<style>\n{content}\n</style>"
-        except FileNotFoundError:
-            print(f"File not found: {file_path}")
-            # Return the original tag if file not found.
-            return match.group(0)
+def write_gzip(html, output_file):
+    """ Write html gzipped for the car to serve as is, and its content hash (the ETag) to output_file + ".etag". """
+    data = html.encode("utf-8")
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "wb") as f:
+        f.write(gzip.compress(data, 9, mtime=0))  # No timestamp, so the same page packs to the same bytes
+    etag = hashlib.sha1(data).hexdigest()[:16]
+    with open(output_file + ".etag", "w") as f:
+        f.write(etag + "\n")
+    return len(data), os.path.getsize(output_file), etag
 
-    # The regex matches a link tag for stylesheets.
-    html = re.sub(r'<link\s+rel="stylesheet"\s+href="([^"]+)"\s*/?>', replace_link, html)
+def build(input_file, output_file, gzip_file, minify=True, force=False):
+    """ Pack input_file into output_file and gzip_file, reusing cached assets; returns whether the page changed. """
+    started = time.perf_counter()
+    cache = AssetCache(MANIFEST, minify)
+    if force:
+        cache.entries = {}
+    previous = cache.page
 
-    return html
+    new_html = inline_resources(input_file, minify, cache)
+    digest = hashlib.sha1(new_html.encode("utf-8")).hexdigest()
+    elapsed = (time.perf_counter() - started) * 1000
+    assets = f"{cache.read} asset(s) read, {cache.reused} cached"
+    cache.page = digest
+    if not force and digest == previous and os.path.exists(output_file) and os.path.exists(gzip_file):
+        cache.save()
+        print(f"Up to date ({assets}, {elapsed:.0f} ms)")
+        return False
+
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(new_html)
+    size, compressed, etag = write_gzip(new_html, gzip_file)
+    cache.save()
+    print(f"Written {output_file} and {gzip_file}, ETag {etag} ({assets}, {elapsed:.0f} ms)")
+
+    # Size report: the page with its assets inlined as written, against what is shipped
+    raw = inline_resources(input_file, False, AssetCache(None, False)) if minify else new_html
+    raw_gz = len(gzip.compress(raw.encode("utf-8"), 9, mtime=0))
+    print(f"{'':>12} {'bytes':>8} {'gzipped':>8}")
+    print(f"{'source':>12} {len(raw.encode('utf-8')):>8} {raw_gz:>8}")
+    print(f"{'shipped':>12} {size:>8} {compressed:>8}")
+    return True
+
+def watch(input_file, output_file, gzip_file, minify=True, interval=0.5):
+    """ Rebuild whenever a file in this directory changes, until interrupted. """
+    def snapshot():
+        return {name: os.stat(name).st_mtime_ns for name in os.listdir(".")
+                if name.endswith((".html", ".js", ".css")) and name != output_file}
+
+    seen = snapshot()
+    build(input_file, output_file, gzip_file, minify)
+    print(f"Watching {os.getcwd()} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot()
+            if current != seen:
+                changed = sorted(name for name in current if current[name] != seen.get(name))
+                print("Changed:", ", ".join(changed) or "(removed files)")
+                seen = current
+                build(input_file, output_file, gzip_file, minify)
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     # Change the cd to the directory of this script.
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-    # Usage: python inline_html.py [input.html] [output.html]
-    input_file = sys.argv[1] if len(sys.argv) > 1 else "index.html"
-    output_file = sys.argv[2] if len(sys.argv) > 2 else "index_packed.html"
-
-    new_html = inline_resources(input_file)
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(new_html)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", default="index.html")
+    parser.add_argument("output", nargs="?", default="index_packed.html")
+    # The car serves this copy from flash (www/ is uploaded, ui/ isn't)
+    parser.add_argument("gzip_output", nargs="?", default=os.path.join("..", "www", "ui.html.gz"))
+    parser.add_argument("--no-minify", dest="minify", action="store_false", help="inline assets as written")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and rebuild everything")
+    parser.add_argument("--watch", action="store_true", help="rebuild on every change")
+    args = parser.parse_args()
 
-    print(f"Written output to {output_file}")
+    if args.watch:
+        watch(args.input, args.output, args.gzip_output, args.minify)
+    else:
+        build(args.input, args.output, args.gzip_output, args.minify, args.force)
@@ -15,7 +15,16 @@ const isMobile = navigator.userAgentData.mobile;
 // Request variables
 let isRequestInProgress = false;
 
-function sendUpdate() {
+// WebSocket control channel (the HTTP GET path is the fallback)
+const controlScale = 1000; // Frames carry throttle and steering in thousandths
+const socketRetryDelay = 1000;
+let controlSocket = null;
+
+// Every command is a lease: the car ramps to a stop if no update arrives within leaseMs
+const leaseMs = 1000;
+const heartbeatInterval = 250;
+
+function sendUpdate(force = false) {
     function roundToMultiple(value, multiple) {
         return Math.round(value / multiple) * multiple;
     }
@@ -26,8 +35,16 @@ function sendUpdate() {
     let throttle = Number(roundToMultiple(throttleDirection * throttleLimit, resolutionThrottle).toFixed(2));
     let steering = Number(roundToMultiple(steeringDirection * steeringLimit, resolutionSteering).toFixed(2));
 
+    // Stream the update over the WebSocket when it's open, without waiting for a reply
+    if (controlSocket && controlSocket.readyState === WebSocket.OPEN) {
+        if (throttle !== prevThrottle || steering !== prevSteering) {
+            sendControlFrame(throttle, steering);
+        }
+        return;
+    }
+
     // If there was no change, or a request is already in progress, do nothing
-    if ((throttle === prevThrottle && steering === prevSteering) || isRequestInProgress) {
+    if ((!force && throttle === prevThrottle && steering === prevSteering) || isRequestInProgress) {
         console.log('No change or request in progress');
         return;
     }
@@ -37,12 +54,13 @@ function sendUpdate() {
 
         // Determine which values changed, and append them to params
         let params = new URLSearchParams();
-        if (steering !== prevSteering) {
+        if (force || steering !== prevSteering) {
             params.append('s', steering);
         }
-        if (throttle !== prevThrottle) {
+        if (force || throttle !== prevThrottle) {
             params.append('t', throttle);
         }
+        params.append('l', leaseMs);
         
         // Print the parameters to the console, as JSON
         console.log(JSON.stringify(Object.fromEntries(params.entries())));
@@ -52,19 +70,11 @@ function sendUpdate() {
         prevSteering = steering;
         
         // Determine URL
-        let currentUrl;
-        if (isLocalDocument) { // If local file, use user-provided URL
-            currentUrl = document.getElementById('urlInput').value;
-        } else { // If hosted, use current base URL
-            currentUrl = `${window.location.protocol}//${window.location.hostname}`;
-            if (window.location.port) {
-                currentUrl += `:${window.location.port}`;
-            }
-        }
+        let currentUrl = getBaseUrl();
         console.log('Current URL:', currentUrl);
 
         // Assemble and send request
-        const requestUrl = `${currentUrl}/?${params.toString()}`;
+        const requestUrl = `${currentUrl}/ctrl?${params.toString()}`;
         const controller = new AbortController();
         const timeoutId = setTimeout(() => controller.abort(), 500);
 
@@ -94,6 +104,56 @@ function sendUpdate() {
     }
 }
 
+function getBaseUrl() {
+    if (isLocalDocument) { // If local file, use user-provided URL
+        return document.getElementById('urlInput').value;
+    }
+    // If hosted, use current base URL
+    let currentUrl = `${window.location.protocol}//${window.location.hostname}`;
+    if (window.location.port) {
+        currentUrl += `:${window.location.port}`;
+    }
+    return currentUrl;
+}
+
+function sendControlFrame(throttle, steering) {
+    // 6 bytes: little-endian int16 throttle and steering, in thousandths, and uint16 lease in ms
+    const frame = new DataView(new ArrayBuffer(6));
+    frame.setInt16(0, Math.round(throttle * controlScale), true);
+    frame.setInt16(2, Math.round(steering * controlScale), true);
+    frame.setUint16(4, leaseMs, true);
+    controlSocket.send(frame.buffer);
+    prevThrottle = throttle;
+    prevSteering = steering;
+}
+
+function connectSocket() {
+    let url;
+    try {
+        url = new URL(getBaseUrl());
+    } catch (error) {
+        setTimeout(connectSocket, socketRetryDelay); // No usable URL yet
+        return;
+    }
+    const socketUrl = `${url.protocol === 'https:' ? 'wss:' : 'ws:'}//${url.host}/ws`;
+    const socket = new WebSocket(socketUrl);
+    socket.binaryType = 'arraybuffer';
+
+    socket.onopen = () => {
+        console.log('Control socket open:', socketUrl);
+        controlSocket = socket;
+        sendControlFrame(prevThrottle, prevSteering);
+    };
+    socket.onclose = () => {
+        if (controlSocket === socket) {
+            console.log('Control socket closed, falling back to HTTP');
+            controlSocket = null;
+        }
+        setTimeout(connectSocket, socketRetryDelay);
+    };
+    socket.onerror = () => socket.close();
+}
+
 function updateThrottleLimit() {
     const throttleLimitSlider = document.getElementById('throttleSlider');
     const throttleLimitLabel = document.getElementById('throttleLimit');
@@ -178,11 +238,24 @@ function load() {
     document.addEventListener('keyup', function(event) {
         handleKeyEvent(event, false);
     });
+
+    // Open the WebSocket control channel, and renew the last command's lease while idle
+    connectSocket();
+    setInterval(() => {
+        if (controlSocket && controlSocket.readyState === WebSocket.OPEN) {
+            sendControlFrame(prevThrottle, prevSteering);
+        } else if (prevThrottle || prevSteering) {
+            sendUpdate(true);
+        }
+    }, heartbeatInterval);
 }
 
 function saveUrl() {
     const urlInput = document.getElementById('urlInput');
     localStorage.setItem('url', urlInput.value);
+    if (controlSocket) {
+        controlSocket.close(); // Reconnect to the new URL
+    }
 }
 
 // Function to close the dialog
@@ -1,13 +1,27 @@
+import os
 import time
-import ure
+import asyncio
 import ujson
+import ustruct
+import uhashlib
+import ubinascii
 import socket
 import ntptime
 import machine
 import network
+import boottime
+import instrument
+from scheduler import Clock, Periodic
 
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-wlan = network.WLAN(network.STA_IF)
+server_socket = None  # Created by start_webserver
+_wlan = None
+
+def get_wlan():
+    """ Return the station interface, creating it on first use. """
+    global _wlan
+    if _wlan is None:
+        _wlan = boottime.timed("WLAN()", network.WLAN, network.STA_IF)
+    return _wlan
 
 def sync_time():
     try:
@@ -16,8 +30,9 @@ def sync_time():
     except OSError:
         print("Failed to sync time")
 
-def start_access_point(pwd=""):
-    ap = network.WLAN(network.AP_IF)
+def start_access_point(pwd="", channel=None, ap=None):
+    """ Bring up the car's own access point (open unless pwd is given); returns the interface. """
+    ap = ap or network.WLAN(network.AP_IF)
     ap.active(True)
     essid = 'MyESP_Hotspot'
     
@@ -27,65 +42,755 @@ def start_access_point(pwd=""):
     else:
         # Open access point (no password)
         ap.config(essid=essid, authmode=network.AUTH_OPEN)
+    if channel:
+        ap.config(channel=channel)  # Station and access point share the radio, and so the channel
     
     print("Access Point started with IP:", ap.ifconfig()[0])
+    return ap
 
-def connect_wifi(wait=True):
-    with open("wifi.txt", "r") as file:
-        ssid = file.readline().strip()
-        password = file.readline().strip()
-    wlan.active(True)
-    wlan.connect(ssid, password)
+# Wi-Fi connection manager
+WIFI_CACHE = "wifi.json"
+_wifi = None  # Created by connect_wifi
 
-    if wait:
-        for i in range(10):
+class WifiManager:
+    # States
+    IDLE = 0       # Waiting to retry
+    JOINING = 1
+    CONNECTED = 2
+
+    def __init__(self, credentials="wifi.txt", cache=WIFI_CACHE, fast_ms=3000, join_ms=12000, ap_after=20000,
+                 ap_password="", retry_ms=30000, interval=200, scheduler=None, clock=None, wlan=None, ap=None,
+                 idle=None):
+        """
+        Keeps the station joined in the background: starts joining at once, notices a
+        dropped link and rejoins. check() returns straight away; the one call that blocks,
+        a scan (about 2 s), only runs while idle() says nothing is driving the car.
+
+        A join first names the access point (BSSID) that worked last time, cached in
+        the cache file, which skips the driver's search for the network. If that hasn't
+        worked within fast_ms it joins by SSID alone and lets the SDK find the network,
+        and once joined and idle a scan finds the strongest access point with the SSID
+        to cache. Failed attempts are retried with a backoff of up to retry_ms. If the
+        link is still down after ap_after ms the car's own access point comes up (None:
+        never), on the cached channel, and it is taken down again once the station is
+        back and nobody is on it. The ESP8266 port can't list the access point's
+        stations (status() only answers "rssi"), so there that means once idle() holds.
+
+        Connect latency (link down or start, to joined) is kept in connect_ms and history.
+
+        interval: Check period in milliseconds.
+        scheduler: See scheduler.Periodic.
+        idle: Callable that returns True while nothing is driving the car, e.g. Failsafe.parked.
+              None: never scan, and take the access point down as soon as the station is back.
+        """
+        with open(credentials, "r") as file:
+            self.ssid = file.readline().strip()
+            self.password = file.readline().strip()
+        self.cache = cache
+        self.fast_ms = fast_ms
+        self.join_ms = join_ms
+        self.ap_after = ap_after
+        self.ap_password = ap_password
+        self.retry_ms = retry_ms
+        self.interval = interval
+        self.idle = idle
+        self.clock = clock or (scheduler.clock if scheduler else Clock())
+        self.wlan = wlan or get_wlan()
+        self.ap = ap                 # Access point interface once started
+        self.ap_active = False
+        self.bssid, self.channel = self._load_cache()
+
+        self.state = WifiManager.IDLE
+        self.fast = False            # The current attempt named the cached BSSID
+        self.attempts = 0            # Since the link went down
+        self.drops = 0
+        self.connect_ms = None       # Latest connect latency
+        self.history = []            # (ms, fast) for the last few connects
+        self._down = self.clock.now()
+        self._started = self._down
+        self._retry = self._down
+        self._learn = False          # Joined without the cached BSSID: scan for one to cache when idle
+        self.wlan.active(True)
+        if not self.wlan.isconnected():
+            self._join()  # Doesn't block; a link the SDK rejoined by itself is picked up by the first check
+
+        self.periodic = Periodic(interval, self.check, "wifi", scheduler)
+
+    def _ms_since(self, t):
+        return self.clock.diff(self.clock.now(), t) // 1000
+
+    def isconnected(self):
+        return self.state == WifiManager.CONNECTED
+
+    def check(self):
+        """ Advance the connection: notice joins, drops and failed attempts, and start the next step. """
+        wlan = self.wlan
+        if self.state == WifiManager.CONNECTED:
             if wlan.isconnected():
-                break
-            time.sleep(1)
+                if self._learn and self.idle and self.idle():
+                    self._learn_bssid()
+                if self.ap_active and not self._ap_in_use():
+                    self.ap.active(False)
+                    self.ap_active = False
+                    print("Access Point stopped")
+                return
+            self.drops += 1
+            self.attempts = 0
+            self._down = self.clock.now()
+            print("Wi-Fi link lost; rejoining")
+            self._join()
+            return
         if wlan.isconnected():
-            print("Connected to", wlan.config('ssid'), "with IP", wlan.ifconfig()[0])
+            self._joined()
+            return
+        if self.state == WifiManager.JOINING:
+            elapsed = self._ms_since(self._started)
+            failed = wlan.status() in (network.STAT_WRONG_PASSWORD, network.STAT_NO_AP_FOUND, network.STAT_CONNECT_FAIL)
+            if self.fast and (failed or elapsed >= self.fast_ms):
+                self._join(fast=False)  # The cached access point is gone (or moved channel)
+            elif failed or elapsed >= self.join_ms:
+                self._backoff("status %d" % wlan.status())
+        elif self.clock.diff(self.clock.now(), self._retry) >= 0:
+            self._join()
+        if not self.ap_active and self.ap_after is not None and self._ms_since(self._down) >= self.ap_after:
+            self.ap = start_access_point(self.ap_password, self.channel, self.ap)
+            self.ap_active = True
+
+    def _join(self, fast=None):
+        """ Start one join attempt: straight to the cached BSSID, or by SSID with the SDK finding the network. """
+        self.fast = self.bssid is not None if fast is None else fast
+        self.wlan.connect(self.ssid, self.password, bssid=self.bssid if self.fast else None)
+        self.attempts += 1
+        self._started = self.clock.now()
+        self.state = WifiManager.JOINING
+
+    def _backoff(self, reason):
+        delay = min(self.retry_ms, 500 << min(self.attempts, 6))
+        self._retry = self.clock.add(self.clock.now(), delay * 1000)
+        self.state = WifiManager.IDLE
+        print("Joining", self.ssid, "failed (%s); retrying in %d ms" % (reason, delay))
+
+    def _joined(self):
+        took = self._ms_since(self._down)
+        self.connect_ms = took
+        self.history = self.history[-7:] + [(took, self.fast)]
+        self.state = WifiManager.CONNECTED
+        self.attempts = 0
+        # Also when the SDK rejoined by itself (credentials saved by the old connect_wifi): nothing known to cache
+        self._learn = not self.fast
+        boottime.first("wifi")
+        print("Connected to", self.ssid, "with IP", self.wlan.ifconfig()[0], "in %d ms" % took,
+              "(cached BSSID)" if self.fast else "(found by the SDK)")
+
+    def _learn_bssid(self):
+        # Blocks for the scan; only called while idle
+        self._learn = False
+        best = None
+        for net in self.wlan.scan():
+            if net[0] == self.ssid.encode() and (best is None or net[3] > best[3]):
+                best = net
+        if best is not None and (best[1], best[2]) != (self.bssid, self.channel):
+            self.bssid, self.channel = best[1], best[2]
+            self._save_cache()
+
+    def _ap_in_use(self):
+        """ Whether someone may be on our access point: its station list where the port has one, else whether the car is driven. """
+        try:
+            return len(self.ap.status("stations")) > 0
+        except (ValueError, OSError, TypeError):
+            return self.idle is not None and not self.idle()
+
+    def wait(self, timeout=10000):
+        """ Block until joined or timeout ms, checking every interval; returns whether joined. """
+        start = self.clock.now()
+        while not self.isconnected() and self._ms_since(start) < timeout:
+            self.check()
+            if not self.isconnected():
+                self.clock.sleep(self.interval * 1000)
+        return self.isconnected()
+
+    # BSSID cache
+    def _load_cache(self):
+        try:
+            with open(self.cache, "r") as f:
+                entry = ujson.load(f)
+            if entry["ssid"] == self.ssid:
+                return ubinascii.unhexlify(entry["bssid"]), entry["channel"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None, None
+
+    def _save_cache(self):
+        temp = self.cache + ".tmp"
+        with open(temp, "w") as f:
+            ujson.dump({"ssid": self.ssid, "bssid": ubinascii.hexlify(self.bssid).decode(), "channel": self.channel}, f)
+        os.rename(temp, self.cache)
+
+    def stop(self):
+        """ Stops the timer or removes the scheduler task; the link stays as it is. """
+        self.periodic.stop()
+
+def connect_wifi(wait=True):
+    """ Join the network in wifi.txt with a timer-driven WifiManager; returns it. """
+    global _wifi
+    if _wifi is None:
+        _wifi = WifiManager()
+    if wait:
+        _wifi.wait()
+    return _wifi
+
+def wait_wifi(timeout=10000):
+    """ Wait up to timeout ms for the connection started by connect_wifi. """
+    return connect_wifi(wait=False).wait(timeout)
+
+# WebSocket
+WS_TEXT = 0x1
+WS_BINARY = 0x2
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+_WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+CONTROL_SCALE = 1000  # Control frames carry throttle and steering in thousandths
+
+class WebSocketEndpoint:
+    """ Marks an endpoint as a WebSocket: handler(ws, request) is a coroutine run for each connection.
+
+    endpoints = {"ws": web.WebSocketEndpoint(control_socket)}
+
+    max_size: Largest message payload accepted, see WebSocket.
+    """
+    def __init__(self, handler, max_size=128):
+        self.handler = handler
+        self.max_size = max_size
+
+    async def accept(self, reader, writer, request):
+        """ Complete the handshake and run the handler until the connection closes. """
+        key = request.header(b"Sec-WebSocket-Key")
+        if key is None:
+            writer.write(UPGRADE_REQUIRED)
+            await writer.drain()
+            return
+        accept = ubinascii.b2a_base64(uhashlib.sha1(key + _WS_GUID).digest()).strip()
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                     b"Upgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        await writer.drain()
+        await self.handler(WebSocket(reader, writer, self.max_size), request)
+
+WS_TOO_BIG = 1009  # Close status: message too big to process
+
+class WebSocket:
+    """ Server side of one WebSocket connection (RFC 6455) over asyncio streams.
+
+    Payloads go into one buffer of max_size bytes (control frames are 4-6); a frame
+    declaring more closes the connection with status 1009 before anything is read
+    or allocated for it.
+    """
+    def __init__(self, reader, writer, max_size=128):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self.header = bytearray(10)
+        self.payload = bytearray(max_size)  # Unmasked payload of the last message, reused
+
+    async def recv(self):
+        """ Return (opcode, payload memoryview) of the next text/binary message, or None once closed.
+
+        Pings are answered and pongs dropped here; the payload is only valid until the next recv.
+        """
+        reader = self.reader
+        while not self.closed:
+            try:
+                # The client may go away anywhere in a frame, not just between frames
+                head = await reader.readexactly(2)
+                opcode = head[0] & 0x0F
+                length = head[1] & 0x7F
+                if length == 126:
+                    ext = await reader.readexactly(2)
+                    length = ext[0] << 8 | ext[1]
+                elif length == 127:
+                    ext = await reader.readexactly(8)
+                    length = 0
+                    for b in ext:
+                        length = length << 8 | b
+                if length <= len(self.payload):
+                    mask = await reader.readexactly(4) if head[1] & 0x80 else None
+                    data = await reader.readexactly(length) if length else b""
+            except Exception:
+                self.closed = True
+                break
+            if length > len(self.payload):
+                await self.close(WS_TOO_BIG)
+                break
+            payload = self.payload
+            if mask:
+                for i in range(length):
+                    payload[i] = data[i] ^ mask[i & 3]
+            else:
+                payload[:length] = data
+            message = memoryview(payload)[:length]
+
+            if opcode == WS_PING:
+                await self.send(message, WS_PONG)
+            elif opcode == WS_CLOSE:
+                await self.close()
+            elif opcode == WS_TEXT or opcode == WS_BINARY:
+                return opcode, message
+        return None
+
+    async def send(self, data, opcode=WS_BINARY):
+        """ Send one unmasked frame. """
+        if self.closed and opcode != WS_CLOSE:
+            return
+        header = self.header
+        header[0] = 0x80 | opcode
+        length = len(data)
+        if length < 126:
+            header[1] = length
+            n = 2
+        elif length < 65536:
+            header[1] = 126
+            header[2] = length >> 8
+            header[3] = length & 0xFF
+            n = 4
+        else:
+            header[1] = 127
+            for i in range(8):
+                header[9 - i] = (length >> (8 * i)) & 0xFF
+            n = 10
+        self.writer.write(bytes(header[:n]) + bytes(data))
+        await self.writer.drain()
+
+    async def close(self, status=None):
+        """ Send a close frame (once, with the status code if given) and shut the connection. """
+        if not self.closed:
+            self.closed = True
+            try:
+                await self.send(ustruct.pack(">H", status) if status else b"", WS_CLOSE)
+            except Exception:
+                pass
+        self.writer.close()
+
+def decode_control(payload):
+    """ Decode a 4-byte control frame (little-endian int16 throttle, steering in thousandths). """
+    throttle = payload[0] | payload[1] << 8
+    steering = payload[2] | payload[3] << 8
+    if throttle >= 0x8000:
+        throttle -= 0x10000
+    if steering >= 0x8000:
+        steering -= 0x10000
+    return throttle / CONTROL_SCALE, steering / CONTROL_SCALE
+
+def decode_lease(payload):
+    """ Lease in ms from a 6-byte control frame (trailing little-endian uint16), or None for a 4-byte one. """
+    if len(payload) == 6:
+        return payload[4] | payload[5] << 8
+    return None
+
+def encode_control(throttle, steering, lease=None):
+    """ Build the control frame payload that decode_control (and decode_lease) read. """
+    t = int(round(throttle * CONTROL_SCALE)) & 0xFFFF
+    s = int(round(steering * CONTROL_SCALE)) & 0xFFFF
+    if lease is None:
+        return bytes((t & 0xFF, t >> 8, s & 0xFF, s >> 8))
+    return bytes((t & 0xFF, t >> 8, s & 0xFF, s >> 8, lease & 0xFF, lease >> 8 & 0xFF))
+
+# UDP control
+UDP_PORT = 4210
+# seq, sender ms, throttle and steering (thousandths), lease ms (0: the default lease)
+UDP_FORMAT = "<HIhhH"
+UDP_SIZE = ustruct.calcsize(UDP_FORMAT)
+
+def encode_udp_control(seq, ms, throttle, steering, lease=0):
+    """ Build the datagram UdpControl reads. """
+    return ustruct.pack(UDP_FORMAT, seq & 0xFFFF, ms & 0xFFFFFFFF,
+                        int(round(throttle * CONTROL_SCALE)), int(round(steering * CONTROL_SCALE)), lease)
+
+class UdpControl:
+    def __init__(self, handler, port=UDP_PORT, max_age=150, resync=1000, confirm=3, interval=10, scheduler=None):
+        """
+        Control datagrams over UDP, next to the web server: no connection, no HTTP framing,
+        and a lost datagram doesn't hold up the ones behind it.
+
+        Each read drains the socket and passes the newest acceptable command to
+        handler(throttle, steering, lease), lease being None for the default. A datagram
+        is dropped if its seq is not newer than the last one applied (duplicates and
+        reordering), or if it is more than max_age ms older than the fastest recent
+        datagram: the sender's clock is unknown, so age is measured against the smallest
+        recent receive-minus-send time, which creeps up 1 ms per datagram to follow drift.
+        After resync ms without an applied command, a restarted sender (or a link whose
+        delay has grown for good) is taken once it has sent confirm datagrams with
+        consecutive seqs and consistent delays; a lone late or duplicate datagram never
+        is, so it can't re-apply an old command.
+
+        With the async server, run serve() as one of its tasks and pass interval=None:
+        datagrams are then applied as they arrive instead of at the next poll.
+        interval: Poll period in milliseconds (None: don't poll).
+        scheduler: See scheduler.Periodic.
+        """
+        self.handler = handler
+        self.max_age = max_age
+        self.resync = resync
+        self.confirm = confirm
+        self.seq = None        # Last applied seq
+        self.last_ms = 0       # ticks_ms when it was applied
+        self._base = None      # Smallest recent (receive - send) ms
+        self._run = 0          # Rejected datagrams in a row from what may be a new sender, after a silence
+        self._run_seq = 0
+        self._run_delay = 0
+        self.received = 0
+        self.applied = 0
+        self.stale = 0
+        self.out_of_order = 0
+        self.malformed = 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        self.sock.setblocking(False)
+        boottime.first("udp")
+        print("UDP control on port", port)
+
+        self.periodic = Periodic(interval, self.poll, "udp", scheduler)
+
+    def poll(self, data=None):
+        """ Read every waiting datagram (after data, one already read) and apply the newest acceptable one;
+        returns 1 if one was applied. """
+        newest = None
+        while True:
+            if data is None:
+                try:
+                    data = self.sock.recv(UDP_SIZE + 1)
+                except OSError:
+                    break  # Nothing waiting
+            self.received += 1
+            if len(data) != UDP_SIZE:
+                self.malformed += 1
+            else:
+                command = ustruct.unpack(UDP_FORMAT, data)
+                if self.accept(command, time.ticks_ms()):
+                    newest = command
+            data = None
+        if newest is None:
+            return 0
+        self.applied += 1
+        _, _, throttle, steering, lease = newest
+        self.handler(throttle / CONTROL_SCALE, steering / CONTROL_SCALE, lease or None)
+        return 1
+
+    async def serve(self):
+        """ Apply datagrams as they arrive, woken by the asyncio loop's poller; run as a task of the async server. """
+        loop = asyncio.get_event_loop()
+        if hasattr(loop, "sock_recv"):
+            def wait():
+                return loop.sock_recv(self.sock, UDP_SIZE + 1)  # CPython
         else:
-            print("Failed to connect to", ssid)
+            stream = asyncio.StreamReader(self.sock)  # MicroPython wraps any socket, polled with the server's
+
+            def wait():
+                return stream.read(UDP_SIZE + 1)
+        while True:
+            try:
+                data = await wait()
+            except OSError:
+                return  # Closed by stop()
+            self.poll(data)
+
+    def accept(self, command, now):
+        """ Whether a decoded datagram received at now (ticks_ms) is newer and fresh; records it if so. """
+        seq, ms, _, _, _ = command
+        delay = (now - ms) & 0xFFFFFFFF  # One-way delay plus the unknown clock offset
+        if self.seq is None:
+            self._base = delay
+        else:
+            ordered = 0 < (seq - self.seq) & 0xFFFF < 0x8000
+            if ordered:
+                self._base = (self._base + 1) & 0xFFFFFFFF
+            if not ordered or _signed(delay - self._base) > self.max_age:
+                if time.ticks_diff(now, self.last_ms) < self.resync or not self._confirmed(seq, delay):
+                    if ordered:
+                        self.stale += 1
+                    else:
+                        self.out_of_order += 1
+                    return False
+                self._base = delay  # A new sender (or clock): its own baseline
+        if _signed(delay - self._base) < 0:
+            self._base = delay  # Faster than any recent one (or a clock wrapped): the new baseline
+        self._run = 0
+        self.seq = seq
+        self.last_ms = now
+        return True
+
+    def _confirmed(self, seq, delay):
+        # Whether this rejected datagram completes a run of confirm from one live sender: consecutive seqs and
+        # delays within max_age of the first. A late or duplicated datagram on its own never makes a run
+        if self._run and (seq - self._run_seq) & 0xFFFF == 1 and abs(_signed(delay - self._run_delay)) <= self.max_age:
+            self._run += 1
+        else:
+            self._run = 1
+            self._run_delay = delay
+        self._run_seq = seq
+        return self._run >= self.confirm
+
+    def stop(self):
+        """ Stops polling and closes the socket. """
+        self.periodic.stop()
+        self.sock.close()
+
+def _signed(value):
+    # A difference of two 32-bit wrapping values, as a signed number
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+# Byte constants shared by the request parser and response writer
+_SP = 0x20
+_CR = 0x0D
+_LF = 0x0A
+_AMP = 0x26
+_EQ = 0x3D
+_DOT = 0x2E
+_MINUS = 0x2D
+_PLUS = 0x2B
+_ZERO = 0x30
+_SLASH = 0x2F
+_LOWER_A = 0x61
+_LOWER_Z = 0x7A
+MAX_REQUEST = 2048
+
+# Responses
+NOT_FOUND = (b"HTTP/1.1 404 Not Found\r\n"
+             b"Connection: keep-alive\r\n"
+             b"Content-Length: 0\r\n\r\n")
+UPGRADE_REQUIRED = (b"HTTP/1.1 426 Upgrade Required\r\n"
+                    b"Upgrade: websocket\r\n"
+                    b"Connection: keep-alive\r\n"
+                    b"Content-Length: 0\r\n\r\n")
+_OK_HEADER = (b"HTTP/1.1 200 OK\r\n"
+              b"Access-Control-Allow-Origin: *\r\n"
+              b"Connection: keep-alive\r\n"
+              b"Content-Length:     \r\n\r\n")  # Length is written right-aligned into the blank field
+_LENGTH_END = len(_OK_HEADER) - 4
+_BODY = len(_OK_HEADER)
+_FLOAT_SCALE = 10000  # Decimal places kept when formatting floats (4)
+_VALUE_MAX = 15       # Longest formatted value: sign, 9 integer digits, point and 4 decimals
+
+class Response:
+    """ Reusable 200 OK response buffer.
+
+    The header template is encoded once; each write only fills in the
+    Content-Length digits and the body, and returns a memoryview of the
+    finished response so it goes out with a single sendall. Dicts of numbers
+    (the usual endpoint result) are formatted straight into the buffer.
+    """
+    def __init__(self, size=256):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.buf[:_BODY] = _OK_HEADER
+        self._keys = {}  # Encoded '"key": ' prefixes, built once per key
+
+    def write(self, result):
+        """ Format an endpoint result (dict, str, bytes or None) as the body; returns the response bytes. """
+        end = _BODY
+        if isinstance(result, dict):
+            end = self._dict(result, end)
+            if end < 0:
+                result = ujson.dumps(result)
+                end = _BODY
+        if isinstance(result, str):
+            result = result.encode()
+        elif result is not None and not isinstance(result, (bytes, dict)):
+            result = str(result).encode()
+        if isinstance(result, bytes):
+            if _BODY + len(result) > len(self.buf):
+                return _OK_HEADER[:_LENGTH_END - 4] + str(len(result)).encode() + b"\r\n\r\n" + result
+            end = _BODY + len(result)
+            self.buf[_BODY:end] = result
+
+        # Right-align the body length in the blank Content-Length field
+        length = end - _BODY
+        i = _LENGTH_END
+        while True:
+            i -= 1
+            self.buf[i] = _ZERO + length % 10
+            length //= 10
+            if not length:
+                break
+        while i > _LENGTH_END - 4:
+            i -= 1
+            self.buf[i] = _SP
+        return self.mv[:end]
+
+    def _dict(self, result, i):
+        # Write {"key": number, ...}; returns -1 if a value isn't a plain number or it might not fit
+        buf = self.buf
+        keys = self._keys
+        if i + 2 > len(buf):
+            return -1
+        buf[i] = 0x7B
+        i += 1
+        for key in result:
+            value = result[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not -1e9 < value < 1e9:
+                return -1  # Also rejects nan/inf
+            prefix = keys.get(key)
+            if prefix is None:
+                if not isinstance(key, str) or len(key) > 16:
+                    return -1
+                prefix = keys[key] = b', "' + key.encode() + b'": '
+            if i + len(prefix) + _VALUE_MAX + 1 > len(buf):
+                return -1  # This entry at its longest, and the closing brace
+            if i == _BODY + 1:
+                buf[i:i + len(prefix) - 2] = prefix[2:]
+                i += len(prefix) - 2
+            else:
+                buf[i:i + len(prefix)] = prefix
+                i += len(prefix)
+            if isinstance(value, int):
+                if value < 0:
+                    buf[i] = _MINUS
+                    i += 1
+                i = self._digits(abs(value), i, 1)
+            else:
+                # Fixed point with trailing zeros trimmed (keeps at least one decimal, like 0.0)
+                scaled = int(abs(value) * _FLOAT_SCALE + 0.5)
+                if value < 0 and scaled:
+                    buf[i] = _MINUS
+                    i += 1
+                i = self._digits(scaled // _FLOAT_SCALE, i, 1)
+                buf[i] = _DOT
+                frac = scaled % _FLOAT_SCALE
+                width = 4
+                while width > 1 and frac % 10 == 0:
+                    frac //= 10
+                    width -= 1
+                i = self._digits(frac, i + 1, width)
+        buf[i] = 0x7D
+        return i + 1
+
+    def _digits(self, value, i, width):
+        # Write value in decimal, zero-padded to at least width digits
+        buf = self.buf
+        n = 1
+        limit = 10
+        while value >= limit:
+            n += 1
+            limit *= 10
+        if n < width:
+            n = width
+        for j in range(i + n - 1, i - 1, -1):
+            buf[j] = _ZERO + value % 10
+            value //= 10
+        return i + n
+
+# Static files
+class StaticFile:
+    """ Marks an endpoint as a pre-compressed file streamed from flash in chunks.
+
+    path is a gzip file written by ui/html_packer.py, next to path + ".etag"
+    holding its content hash. Headers are built once; each request either
+    gets 304 Not Modified (its If-None-Match matches) or the file, read into
+    one reused buffer, so the page is never held in RAM whole.
+
+    endpoints = {"": web.StaticFile("www/ui.html.gz")}
+    """
+    def __init__(self, path, content_type=b"text/html; charset=utf-8", max_age=86400, chunk=512):
+        self.path = path
+        with open(path + ".etag", "rb") as f:
+            self.etag = b'"' + f.read().strip() + b'"'
+        size = os.stat(path)[6]
+        cache = b"Cache-Control: public, max-age=" + str(max_age).encode() + b"\r\n"
+        self.header = (b"HTTP/1.1 200 OK\r\n"
+                       b"Content-Type: " + content_type + b"\r\n"
+                       b"Content-Encoding: gzip\r\n"
+                       b"Vary: Accept-Encoding\r\n"
+                       b"ETag: " + self.etag + b"\r\n" + cache +
+                       b"Connection: keep-alive\r\n"
+                       b"Content-Length: " + str(size).encode() + b"\r\n\r\n")
+        self.not_modified = (b"HTTP/1.1 304 Not Modified\r\n"
+                             b"ETag: " + self.etag + b"\r\n" + cache +
+                             b"Connection: keep-alive\r\n\r\n")
+        self.buf = bytearray(chunk)
+        self.mv = memoryview(self.buf)
+
+    def fresh(self, request):
+        """ Whether the client's cached copy is current. """
+        tags = request.header(b"If-None-Match")
+        return tags is not None and (self.etag in tags or tags == b"*")
+
+    def send(self, sock, request):
+        """ Blocking server: write the response to a socket. """
+        if self.fresh(request):
+            sock.sendall(self.not_modified)
+            return
+        sock.sendall(self.header)
+        with open(self.path, "rb", 0) as f:  # Unbuffered: chunks go straight into self.buf
+            while True:
+                n = f.readinto(self.buf)
+                if not n:
+                    break
+                sock.sendall(self.mv[:n])
+
+    async def serve(self, writer, request):
+        """ Async server: write the response to a stream, draining after each chunk. """
+        if self.fresh(request):
+            writer.write(self.not_modified)
+            await writer.drain()
+            return
+        writer.write(self.header)
+        with open(self.path, "rb", 0) as f:  # Unbuffered: chunks go straight into self.buf
+            while True:
+                n = f.readinto(self.buf)
+                if not n:
+                    break
+                writer.write(self.mv[:n])
+                await writer.drain()
+
+@instrument.timed("handle_request")
+def handle_request(request, endpoints, response):
+    """ Dispatch a parsed request to its endpoint and return the HTTP response bytes. """
+    endpoint = request.find_endpoint(endpoints)
+    if endpoint is None:
+        return NOT_FOUND
+    handler = endpoints[endpoint]
+    if isinstance(handler, WebSocketEndpoint):
+        return UPGRADE_REQUIRED
+    if isinstance(handler, StaticFile):
+        return NOT_FOUND  # Streamed by the servers, never built in memory
+    return response.write(handler(request))
+
+def stats_endpoint(request):
+    """ Endpoint serving instrument.stats() (empty unless instrumentation is enabled); ?reset=1 clears them after reading. """
+    result = instrument.stats()
+    if request.param_float(b'reset'):
+        instrument.reset()
+    return result
+
+def start_webserver(endpoints, port=80):
+    request = HttpRequest()
+    response = Response()
 
-def start_webserver(endpoints):
     def handle_client(client_socket):
         # Set a timeout so we don't block indefinitely
         client_socket.settimeout(2)
+        request.reset()
         while True:
             try:
                 data = client_socket.recv(1024)
                 if not data:
                     break  # Client closed connection
-            except OSError:
-                break  # Timeout or socket error
-
-            # Parse the HTTP request
-            request = parse_http_request(data.decode())
-            
-            # Default response (404 Not Found with empty body)
-            default_body = ""
-            default_response = ("HTTP/1.1 404 Not Found\r\n"
-                                "Connection: keep-alive\r\n"
-                                "Content-Length: " + str(len(default_body)) + "\r\n\r\n" +
-                                default_body)
-            response = default_response
-
-            # Check if endpoint exists in our endpoints dict
-            endpoint = request['endpoint'].strip('/') if request['endpoint'] else ''
-            if endpoint in endpoints:
-                result = endpoints[endpoint](request)
-                body = ""
-                if isinstance(result, dict):
-                    body = ujson.dumps(result)
-                elif result is not None:
-                    body = str(result)
-                response = ("HTTP/1.1 200 OK\r\n"
-                            "Access-Control-Allow-Origin: *\r\n"
-                            "Connection: keep-alive\r\n"
-                            "Content-Length: " + str(len(body)) + "\r\n\r\n" +
-                            body)
+                complete = request.feed(data)
+            except (OSError, ValueError):
+                break  # Timeout, socket error or oversized request
+
+            # Answer every complete request in the buffer (a request may span several recv calls)
             try:
-                client_socket.send(response)
+                while complete:
+                    endpoint = request.find_endpoint(endpoints)
+                    if endpoint is not None and isinstance(endpoints[endpoint], StaticFile):
+                        endpoints[endpoint].send(client_socket, request)
+                    else:
+                        client_socket.sendall(handle_request(request, endpoints, response))
+                    complete = request.next()
             except Exception:
                 break  # Exit if sending fails
         client_socket.close()
@@ -93,8 +798,9 @@ def start_webserver(endpoints):
     global server_socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind(('', 80))
+    server_socket.bind(('', port))
     server_socket.listen(5)
+    boottime.first("listening")
     print("Web server started")
     while True:
         try:
@@ -104,28 +810,316 @@ def start_webserver(endpoints):
         except Exception as e:
             print("Error accepting connection:", e)
 
+# Asyncio server
+async def serve_client(reader, writer, endpoints, timeout=None):
+    """ Serve keep-alive requests on one connection until the client disconnects or goes idle. """
+    request = HttpRequest()
+    response = Response()
+    try:
+        while True:
+            if timeout:
+                data = await asyncio.wait_for(reader.read(512), timeout)
+            else:
+                data = await reader.read(512)
+            if not data:
+                break  # Client closed connection
+            if request.feed(data):
+                while True:
+                    endpoint = request.find_endpoint(endpoints)
+                    handler = endpoints[endpoint] if endpoint is not None else None
+                    if isinstance(handler, WebSocketEndpoint) and request.header(b"Upgrade"):
+                        await handler.accept(reader, writer, request)
+                        return
+                    if isinstance(handler, StaticFile):
+                        await handler.serve(writer, request)
+                    else:
+                        writer.write(handle_request(request, endpoints, response))
+                    await writer.drain()  # The response buffer is reused for the next request
+                    if not request.next():
+                        break
+    except Exception as e:
+        # Timeouts and resets just end this connection; other clients keep running
+        if not isinstance(e, (OSError, ValueError, asyncio.TimeoutError)):
+            print("Client error:", e)
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def start_async_webserver(endpoints, host="0.0.0.0", port=80, timeout=30):
+    """ Start an asyncio web server that multiplexes many keep-alive clients; returns the server object. """
+    def on_connect(reader, writer):
+        return serve_client(reader, writer, endpoints, timeout)
+
+    server = await asyncio.start_server(on_connect, host, port)
+    boottime.first("listening")
+    print("Async web server started")
+    return server
+
+def run_webserver(endpoints, tasks=(), port=80):
+    """ Run the asyncio web server alongside the given coroutines (sensor/control tasks) forever.
+
+    If one of them raises, the server stops and the exception propagates, so the
+    caller's cleanup (main's stops the car) runs instead of the server carrying on
+    taking drive commands without its control tasks.
+    """
+    async def run():
+        await start_async_webserver(endpoints, port=port)
+        await asyncio.gather(*tasks)
+        while True:
+            await asyncio.sleep(3600)
+
+    asyncio.run(run())
+
+# Request parsing
+
+def _tails(name):
+    # The last letter of a header name in both cases, each followed by the colon
+    lower = name[-1:].lower() + b":"
+    upper = name[-1:].upper() + b":"
+    return (lower, upper) if upper != lower else (lower,)
+
+_LENGTH_TAILS = _tails(b"content-length")
+
+class HttpRequest:
+    """ Incremental HTTP request parser working directly on the bytes from recv.
+
+    Each request is located with a handful of bytes.find calls and recorded as
+    offsets into the received data, so reading the method, endpoint or a
+    numeric parameter never decodes the request or builds intermediate
+    strings. Bytes are only copied when a request spans several recv calls.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Discard all buffered data. """
+        self.data = b""
+        self.start = 0
+        self._clear()
+
+    def _clear(self):
+        self.method_end = 0
+        self.path_end = 0
+        self.query_start = 0
+        self.query_end = 0
+        self.header_end = 0
+        self.end = 0
+
+    @instrument.timed("HttpRequest.feed")
+    def feed(self, data):
+        """ Add received bytes; returns True once a complete request is available. """
+        if self.start < len(self.data):
+            # Part of a request is pending: join it with the new bytes
+            data = self.data[self.start:] + data
+            if len(data) > MAX_REQUEST:
+                raise ValueError("Request too large")
+        self.data = data
+        self.start = 0
+        return self._parse()
+
+    @instrument.timed("HttpRequest.next")
+    def next(self):
+        """ Move past the current request; returns True if another complete request is already buffered. """
+        self.start = self.end
+        return self._parse()
+
+    def _parse(self):
+        data = self.data
+        start = self.start
+        self._clear()
+
+        # Locate the end of the header block (\r\n\r\n, or bare \n\n)
+        head_end = data.find(b"\r\n\r\n", start)
+        if head_end >= 0:
+            header_end = head_end + 4
+        else:
+            head_end = data.find(b"\n\n", start)
+            if head_end < 0:
+                return False
+            header_end = head_end + 2
+
+        # Request line: METHOD SP PATH[?QUERY] SP VERSION
+        line_end = data.find(b"\n", start, header_end)
+        if line_end > start and data[line_end - 1] == _CR:
+            line_end -= 1
+        method_end = data.find(b" ", start, line_end)
+        if method_end < 0:
+            method_end = line_end
+        path_end = data.find(b" ", method_end + 1, line_end)
+        if path_end < 0:
+            path_end = line_end
+        query = data.find(b"?", method_end + 1, path_end)
+        if query >= 0:
+            self.query_start = query + 1
+            self.query_end = path_end
+            path_end = query
+        self.method_end = method_end
+        self.path_end = path_end
+
+        # Content-Length is the only header we need
+        body_len = 0
+        i = self._find_header(b"content-length", line_end, header_end, _LENGTH_TAILS)
+        if i >= 0:
+            while i < header_end and (data[i] == _SP or _ZERO <= data[i] <= _ZERO + 9):
+                if data[i] != _SP:
+                    body_len = body_len * 10 + data[i] - _ZERO
+                i += 1
+        self.header_end = header_end
+        self.end = header_end + body_len
+        return len(data) >= self.end
+
+    # Accessors
+    def _equals(self, start, end, text):
+        if end - start != len(text):
+            return False
+        data = self.data
+        for j in range(len(text)):
+            if data[start + j] != ord(text[j]):
+                return False
+        return True
+
+    def _find_header(self, name, start, end, tails=None):
+        # Offset just past "name:" on the first header line between start and end whose name
+        # matches, ignoring ASCII case; -1 if there is none. Any such line has the name's last
+        # letter, in one case or the other, right before its colon, so bytes.find on those
+        # tails (see _tails) passes over the other lines without a loop here
+        data = self.data
+        n = len(name)
+        found = -1
+        for tail in tails or _tails(name):
+            i = data.find(tail, start + n, end)
+            while i >= 0 and (found < 0 or i < found):
+                line = i - n + 1
+                if data[line - 1] == _LF and self._name_is(line, name):
+                    found = i
+                    break
+                i = data.find(tail, i + 1, end)
+        return found + 2 if found >= 0 else -1
+
+    def _name_is(self, i, name):
+        data = self.data
+        for j in range(len(name)):
+            c = data[i + j]
+            d = name[j]
+            if c != d and (c | 0x20 != d | 0x20 or not _LOWER_A <= c | 0x20 <= _LOWER_Z):
+                return False
+        return True
+
+    def header(self, name):
+        """ Return the value of header name (bytes, in any case) as bytes, or None. """
+        i = self._find_header(name, self.start, self.header_end)
+        if i < 0:
+            return None
+        end = self.data.find(b"\n", i, self.header_end)
+        return self.data[i:end].strip()
+
+    def find_endpoint(self, endpoints):
+        """ Return the key of endpoints matching the path (without slashes), or None. """
+        start = self.method_end + 1
+        end = self.path_end
+        data = self.data
+        while start < end and data[start] == _SLASH:
+            start += 1
+        while end > start and data[end - 1] == _SLASH:
+            end -= 1
+        for name in endpoints:
+            if self._equals(start, end, name):
+                return name
+        return None
+
+    def param_float(self, key, default=None):
+        """ Return query parameter key (bytes) as a float, or default if absent or malformed. """
+        data = self.data
+        i = self.query_start
+        end = self.query_end
+        if not i:
+            return default
+        klen = len(key)
+        while i < end:
+            j = 0
+            while j < klen and i + j < end and data[i + j] == key[j]:
+                j += 1
+            if j == klen and i + j < end and data[i + j] == _EQ:
+                return self._parse_float(i + j + 1, end, default)
+            while i < end and data[i] != _AMP:
+                i += 1
+            i += 1
+        return default
+
+    def _parse_float(self, i, end, default):
+        data = self.data
+        sign = 1
+        if i < end and (data[i] == _MINUS or data[i] == _PLUS):
+            sign = -1 if data[i] == _MINUS else 1
+            i += 1
+        whole = 0
+        frac = 0
+        scale = 1
+        digits = 0
+        seen_dot = False
+        while i < end and data[i] != _AMP:
+            c = data[i]
+            if c == _DOT and not seen_dot:
+                seen_dot = True
+            elif _ZERO <= c <= _ZERO + 9:
+                digits += 1
+                if seen_dot:
+                    frac = frac * 10 + c - _ZERO
+                    scale *= 10
+                else:
+                    whole = whole * 10 + c - _ZERO
+            else:
+                return default
+            i += 1
+        if not digits:
+            return default
+        return sign * (whole + frac / scale)
+
+    # Dict-style access, for endpoints written against parse_http_request
+    @property
+    def method(self):
+        return self.data[self.start:self.method_end].decode() if self.method_end > self.start else None
+
+    @property
+    def endpoint(self):
+        return self.data[self.method_end + 1:self.path_end].decode() if self.path_end > self.method_end + 1 else None
+
+    @property
+    def params(self):
+        params = {}
+        if self.query_start:
+            query = self.data[self.query_start:self.query_end].decode()
+            for param in query.split('&'):
+                if '=' in param:
+                    key, value = param.split('=', 1)
+                    params[key] = value
+        return params
+
+    @property
+    def body(self):
+        if self.end <= self.header_end:
+            return None
+        return self.data[self.header_end:self.end].decode()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __str__(self):
+        return str(self.method) + " " + str(self.endpoint) + " " + str(self.params)
+
 def parse_http_request(http_request):
-    # Split request into headers and body
-    parts = http_request.split('\n\n', 1)
-    headers = parts[0]
-    body = parts[1] if len(parts) > 1 else ''
-
-    # Use regex to extract method, endpoint, and parameters
-    method_match = ure.search(r'^(\w+)', headers)
-    endpoint_match = ure.search(r'^\w+\s+([^?\s]+)', headers)
-    params_match = ure.search(r'\?([^?\s]+)\s', headers)
-
-    params_string = params_match.group(1) if params_match else None
-    params = {}
-    if params_string:
-        for param in params_string.split('&'):
-            key, value = param.split('=')
-            params[key] = value
-
-    result = {
-        'method': method_match.group(1) if method_match else None,
-        'endpoint': endpoint_match.group(1) if endpoint_match else None,
-        'params': params,
-        'body': body if body != '' else None
+    """ Parse a complete request (str or bytes) into a dict of method, endpoint, params and body. """
+    if isinstance(http_request, str):
+        http_request = http_request.encode()
+    request = HttpRequest()
+    if not request.feed(http_request):
+        request.feed(b"\r\n\r\n")  # Tolerate a missing blank line, as the regex parser did
+    return {
+        'method': request.method,
+        'endpoint': request.endpoint,
+        'params': request.params,
+        'body': request.body,
     }
-    return result
\ No newline at end of file